@@ -0,0 +1,348 @@
+# ==============================================================================
+# 文件: async_main.py
+# 描述: 异步服务模式（Quart + AsyncOpenAI）。评价、流式评价和投票接口运行在事件循环上，
+#       等待上游的请求只占用协程而不占用线程；图片编码、缓存读写、抽样等同步操作放到线程池。
+#       其余路由（页面、画廊、反馈等）原样交给同步 Flask 应用处理，路由和 JSON 结构保持不变。
+#
+# 生产环境启动（单进程，抽样器和排行榜的内存状态只在本进程内共享）:
+#     hypercorn "async_main:application" --bind 0.0.0.0:5022 --workers 1
+# 开发调试:
+#     python async_main.py
+# ==============================================================================
+
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from quart import Quart, Response, g, jsonify, request
+
+from pregenerate import DEFAULT_MAIN_PATH, load_server
+from providers import ProviderUnavailableError
+
+SERVER_MAIN_PATH = os.environ.get("ARENA_MAIN_PATH", DEFAULT_MAIN_PATH)
+ASYNC_BLOCKING_WORKERS = 32   # 处理图片编码、SQLite、pandas 等同步操作的线程数
+
+server = load_server(SERVER_MAIN_PATH)
+app = Quart(__name__)
+app.config['JSON_AS_ASCII'] = False
+
+# 相同缓存键的并发请求只调用一次上游（事件循环内的 single-flight）
+_inflight = {}
+
+
+@app.before_serving
+async def configure_executor():
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=ASYNC_BLOCKING_WORKERS, thread_name_prefix="async-blocking"))
+
+
+@app.before_request
+async def start_request_metrics():
+    g.request_start = time.perf_counter()
+    server.begin_request()
+
+
+@app.before_request
+async def check_catalogue_changes():
+    await run_blocking(server.catalogue_watcher.check)
+
+
+@app.after_request
+async def finish_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    server.HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    if "request_start" in g:
+        server.HTTP_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    spans = server.request_spans()
+    if server.METRICS_SERVER_TIMING and spans:
+        response.headers["Server-Timing"] = server.server_timing_header(spans)
+    return response
+
+
+async def run_blocking(fn, *args, **kwargs):
+    # 带上当前上下文，使线程池中的计时 span 也计入本请求的 Server-Timing
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(None, partial(context.run, fn, *args, **kwargs))
+
+
+# --- 核心分析逻辑（异步版本） ---
+async def generate_analysis(model_key: str, artwork_info, prompt: str) -> dict:
+    model_name = server.MODEL_CONFIG[model_key]["model_name"]
+    messages, error = await run_blocking(server._prepare_request, model_key, artwork_info, prompt)
+    if error:
+        return error
+    start = time.perf_counter()
+    try:
+        async with server.providers.async_guard(model_key) as client:
+            response = await client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                timeout=server.providers.timeout(model_key, server.get_model_timeout(model_key)),
+            )
+        server._record_usage(model_key, getattr(response, "usage", None))
+        result = server._build_result(model_key, response.choices[0].message.content)
+    except ProviderUnavailableError as e:
+        result = {"error": str(e), "error_type": e.error_type}
+    except Exception as e:
+        result = {"error": f"模型 {model_name} 在处理时发生错误: {str(e)}"}
+    server._observe_model_call(model_key, result, time.perf_counter() - start, stream=False)
+    return result
+
+
+async def run_analysis(model_key: str, artwork_info, mode: str) -> dict:
+    """先查缓存；未命中时调用模型，并写回缓存。"""
+    prompt = server.PROMPT_BUILDERS[mode](artwork_info)
+    cache = server.evaluation_cache
+    if cache is None:
+        return await generate_analysis(model_key, artwork_info, prompt)
+    key = cache.make_key(model_key, artwork_info['id'], mode, prompt)
+    cached = await run_blocking(cache.lookup, key)
+    if cached is not None:
+        return cached
+    task = _inflight.get(key)
+    if task is None:
+        task = _inflight[key] = asyncio.ensure_future(_generate_and_store(key, model_key, artwork_info, prompt))
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # shield: 某个等待者超时被取消时，不影响共享同一调用的其他请求
+    return await asyncio.shield(task)
+
+
+async def _generate_and_store(key, model_key: str, artwork_info, prompt: str) -> dict:
+    result = await generate_analysis(model_key, artwork_info, prompt)
+    await run_blocking(server.evaluation_cache.store, key, result)
+    return result
+
+
+async def _timed(model_key: str, artwork_info, mode: str) -> tuple:
+    start = time.perf_counter()
+    timeout = server.get_model_timeout(model_key)
+    try:
+        result = await asyncio.wait_for(run_analysis(model_key, artwork_info, mode), timeout)
+    except asyncio.TimeoutError:
+        print(f"⏱️ [异步服务] 模型 {model_key} 超时（{timeout}s）")
+        result = {"error": f"模型 {model_key} 超过 {timeout} 秒未返回结果", "error_type": "timeout"}
+    return result, round(time.perf_counter() - start, 3)
+
+
+async def run_battle(model_keys, artwork_info, mode: str) -> tuple:
+    """两个模型在同一事件循环上并发调用，各自有独立的截止时间。"""
+    outcomes = await asyncio.gather(*(_timed(key, artwork_info, mode) for key in model_keys))
+    evaluations = {key: result for key, (result, _) in zip(model_keys, outcomes)}
+    timings = {key: elapsed for key, (_, elapsed) in zip(model_keys, outcomes)}
+    return evaluations, timings
+
+
+async def stream_analysis(model_key: str, artwork_info, mode: str, events: asyncio.Queue) -> dict:
+    prompt = server.PROMPT_BUILDERS[mode](artwork_info)
+    cache = server.evaluation_cache
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.make_key(model_key, artwork_info['id'], mode, prompt)
+        cached = await run_blocking(cache.lookup, cache_key)
+        if cached is not None:
+            events.put_nowait(("delta", model_key, cached["response"]))
+            return cached
+
+    model_name = server.MODEL_CONFIG[model_key]["model_name"]
+    messages, error = await run_blocking(server._prepare_request, model_key, artwork_info, prompt)
+    if error:
+        return error
+    start = time.perf_counter()
+    try:
+        async with server.providers.async_guard(model_key) as client:
+            stream = await client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                timeout=server.providers.timeout(model_key, server.get_model_timeout(model_key)),
+                stream=True,
+            )
+            parts = []
+            async for chunk in stream:
+                server._record_usage(model_key, getattr(chunk, "usage", None))
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not parts:
+                        server.MODEL_FIRST_TOKEN.observe(time.perf_counter() - start, model=model_key)
+                    parts.append(delta)
+                    events.put_nowait(("delta", model_key, delta))
+        result = server._build_result(model_key, "".join(parts))
+        if cache_key is not None:
+            await run_blocking(cache.store, cache_key, result)
+    except ProviderUnavailableError as e:
+        result = {"error": str(e), "error_type": e.error_type}
+    except Exception as e:
+        result = {"error": f"模型 {model_name} 在处理时发生错误: {str(e)}"}
+    server._observe_model_call(model_key, result, time.perf_counter() - start, stream=True)
+    return result
+
+
+async def stream_battle(model_keys, artwork_info, mode: str):
+    """与同步版 stream_battle 相同的 SSE 事件序列（start / delta / end / done）。"""
+    slots = dict(zip(model_keys, ("model_a", "model_b")))
+    evaluation_id = server.issue_battle(artwork_info['id'], model_keys, mode)
+    events = asyncio.Queue()
+    start = time.perf_counter()
+
+    async def worker(key):
+        result = await stream_analysis(key, artwork_info, mode, events)
+        events.put_nowait(("end", key, result))
+
+    tasks = [asyncio.ensure_future(worker(key)) for key in model_keys]
+    evaluations, timings = {}, {}
+    deadlines = {key: start + server.get_model_timeout(key) for key in model_keys}
+    try:
+        yield server._sse("start", {"slots": list(slots.values()), "evaluation_id": evaluation_id})
+        while len(evaluations) < len(model_keys):
+            pending = [key for key in model_keys if key not in evaluations]
+            wait_for = min(deadlines[key] for key in pending) - time.perf_counter()
+            try:
+                kind, key, payload = await asyncio.wait_for(events.get(), max(wait_for, 0))
+            except asyncio.TimeoutError:
+                now = time.perf_counter()
+                for key in pending:
+                    if now >= deadlines[key]:
+                        timeout = server.get_model_timeout(key)
+                        evaluations[key] = {"error": f"模型 {key} 超过 {timeout} 秒未返回结果", "error_type": "timeout"}
+                        timings[key] = round(now - start, 3)
+                        tasks[model_keys.index(key)].cancel()
+                        yield server._sse("end", {"slot": slots[key], "elapsed": timings[key], "error": evaluations[key]["error"]})
+                continue
+            if key in evaluations:
+                continue
+            if kind == "delta":
+                yield server._sse("delta", {"slot": slots[key], "text": payload})
+            else:
+                evaluations[key] = payload
+                timings[key] = round(time.perf_counter() - start, 3)
+                end_event = {"slot": slots[key], "elapsed": timings[key]}
+                if "error" in payload:
+                    end_event["error"] = payload["error"]
+                yield server._sse("end", end_event)
+        ordered = {key: evaluations[key] for key in model_keys}
+        yield server._sse("done", {"evaluations": ordered, "timings": {key: timings[key] for key in model_keys},
+                                   "evaluation_id": evaluation_id})
+    finally:
+        # 正常结束、超时或客户端断开时，取消仍在进行的上游流
+        for task in tasks:
+            task.cancel()
+
+
+async def iterate_blocking(generator):
+    """在线程池中逐个取同步生成器的元素（用于接入预取票据的同步 SSE 流）。"""
+    sentinel = object()
+    try:
+        while True:
+            item = await run_blocking(next, generator, sentinel)
+            if item is sentinel:
+                return
+            yield item
+    finally:
+        await run_blocking(generator.close)
+
+
+def _stream_response(events):
+    return Response(events, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+# ==============================================================================
+# API 接口路由 (API Routes)
+# ==============================================================================
+async def _load_battle_request(data, mode: str):
+    """校验请求并确定对战模型；返回 (作品, 模型对, 预取票据, 错误响应)。"""
+    if not data or 'artwork_id' not in data:
+        return None, None, None, (jsonify({"error": "请求体必须包含 'artwork_id'"}), 400)
+    artwork_id = data['artwork_id']
+    artwork_info = await run_blocking(server.find_artwork, artwork_id)
+    if artwork_info is None:
+        return None, None, None, (jsonify({"error": f"ID为 '{artwork_id}' 的艺术品未找到"}), 404)
+    if len(server.MODEL_CONFIG) < 2:
+        return None, None, None, (jsonify({"error": "配置的模型少于2个，无法进行比较"}), 500)
+    ticket = server.claim_prefetch(data, artwork_id, mode)
+    if ticket is not None:
+        return artwork_info, ticket.model_keys, ticket, None
+    model_keys = await run_blocking(server.choose_model_pair, mode)
+    return artwork_info, model_keys, None, None
+
+
+async def _evaluate(mode: str):
+    data = await request.get_json(silent=True)
+    artwork_info, model_keys, ticket, error = await _load_battle_request(data, mode)
+    if error:
+        return error
+    print(f"🔄 [异步服务] 模型 {list(model_keys)} 对作品 ID: {artwork_info['id']} 进行评价（{mode}）")
+    evaluation_id = server.issue_battle(artwork_info['id'], model_keys, mode)  # 投票时据此确定评价模式
+    if ticket is not None:
+        evaluations, timings = await run_blocking(server.collect_ticket, ticket)
+    else:
+        evaluations, timings = await run_battle(model_keys, artwork_info, mode)
+    return jsonify({"evaluations": evaluations, "timings": timings, "evaluation_id": evaluation_id})
+
+
+async def _evaluate_stream(mode: str):
+    data = await request.get_json(silent=True) or request.args
+    artwork_info, model_keys, ticket, error = await _load_battle_request(data, mode)
+    if error:
+        return error
+    print(f"🔄 [异步服务] 模型 {list(model_keys)} 对作品 ID: {artwork_info['id']} 进行【流式】评价（{mode}）")
+    if ticket is not None:
+        prompt_builder = server.PROMPT_BUILDERS[mode]
+        return _stream_response(iterate_blocking(
+            server.stream_battle(prompt_builder, mode, ticket.model_keys, artwork_info, ticket)))
+    return _stream_response(stream_battle(tuple(model_keys), artwork_info, mode))
+
+
+@app.route('/api/artwork/evaluate', methods=['POST'])
+async def evaluate_artwork_api():
+    return await _evaluate(server.MODE_NAMED)
+
+
+@app.route('/api/artwork/evaluate_anonymous', methods=['POST'])
+async def evaluate_artwork_anonymous_api():
+    """匿名评价接口，不提供作品元数据"""
+    return await _evaluate(server.MODE_ANONYMOUS)
+
+
+@app.route('/api/artwork/evaluate_stream', methods=['GET', 'POST'])
+async def evaluate_artwork_stream_api():
+    return await _evaluate_stream(server.MODE_NAMED)
+
+
+@app.route('/api/artwork/evaluate_anonymous_stream', methods=['GET', 'POST'])
+async def evaluate_artwork_anonymous_stream_api():
+    return await _evaluate_stream(server.MODE_ANONYMOUS)
+
+
+@app.route('/api/vote', methods=['POST'])
+async def vote_api():
+    # 等待批量提交、抽样器文件锁期间只挂起协程
+    body, status = await run_blocking(server.handle_vote, await request.get_json(silent=True))
+    return jsonify(body), status
+
+
+# 以上路由由事件循环处理，其余请求交给同步 Flask 应用（在线程池中运行）
+ASYNC_PATHS = {rule.rule for rule in app.url_map.iter_rules() if rule.endpoint != 'static'}
+_wsgi_app = AsyncioWSGIMiddleware(server.app)
+
+
+async def application(scope, receive, send):
+    """ASGI 入口：异步路由走 Quart，其余路由走原 Flask 应用。"""
+    if scope["type"] == "http" and scope["path"] not in ASYNC_PATHS:
+        await _wsgi_app(scope, receive, send)
+    else:
+        await app(scope, receive, send)
+
+
+if __name__ == '__main__':
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = ["0.0.0.0:5022"]
+    asyncio.run(serve(application, config))
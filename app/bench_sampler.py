@@ -0,0 +1,117 @@
+# ==============================================================================
+# 文件: bench_sampler.py
+# 描述: 对比旧版（字典嵌套 + 逐对循环）与新版（NumPy 对战矩阵）抽样器的性能
+# 用法: python bench_sampler.py [--models 20 100 500] [--repeat 50]
+# ==============================================================================
+
+import argparse
+import contextlib
+import io
+import random
+import time
+from itertools import combinations
+
+import numpy as np
+
+from sampler import ModelSampler
+
+
+class LegacyDictSampler:
+    """旧版抽样器的统计结构与权重计算（V4 之前的实现），仅用于基准对比。"""
+
+    def __init__(self, model_list: list):
+        self.model_list = sorted(model_list)
+        self.all_pairs = list(combinations(self.model_list, 2))
+        self.battle_counts = {pair: 0 for pair in self.all_pairs}
+        self.win_counts = {model: {other_model: 0 for other_model in self.model_list if other_model != model} for model in self.model_list}
+
+    def _calculate_sampling_weights(self):
+        pairs, weights = [], []
+        max_weight_for_unseen = 0.0
+        for pair in self.all_pairs:
+            m1, m2 = pair
+            n = self.battle_counts.get(pair, 0)
+            if n > 0:
+                p_hat = self.win_counts[m1].get(m2, 0) / n
+                variance_proxy = p_hat * (1 - p_hat) + 1e-6
+                weight = np.sqrt(variance_proxy) * (1/np.sqrt(n) - 1/np.sqrt(n + 1))
+                pairs.append(pair)
+                weights.append(weight)
+                if weight > max_weight_for_unseen:
+                    max_weight_for_unseen = weight
+        if max_weight_for_unseen == 0.0:
+            max_weight_for_unseen = 1.0
+        for pair in self.all_pairs:
+            if self.battle_counts.get(pair, 0) == 0:
+                pairs.append(pair)
+                weights.append(max_weight_for_unseen * 1.1)
+        return pairs, weights
+
+    def select_pair(self) -> tuple:
+        pairs, weights = self._calculate_sampling_weights()
+        return random.choices(population=pairs, weights=weights, k=1)[0]
+
+
+def make_samplers(n_models: int, n_votes: int, seed: int = 0):
+    """构造两套统计数据完全相同的抽样器。"""
+    rng = np.random.default_rng(seed)
+    models = [f"model-{i:04d}" for i in range(n_models)]
+    legacy = LegacyDictSampler(models)
+    with contextlib.redirect_stdout(io.StringIO()):
+        matrix = ModelSampler(models, ratings_file_path="__bench_no_such_file__.csv")
+
+    idx_a = rng.integers(0, n_models, size=n_votes)
+    idx_b = (idx_a + rng.integers(1, n_models, size=n_votes)) % n_models
+    outcomes = rng.integers(0, 3, size=n_votes)
+    matrix.stats.add(idx_a, idx_b, outcomes)
+    for a, b, outcome in zip(idx_a, idx_b, outcomes):
+        m_a, m_b = matrix.model_list[a], matrix.model_list[b]
+        legacy.battle_counts[tuple(sorted((m_a, m_b)))] += 1
+        if outcome == 0:
+            legacy.win_counts[m_a][m_b] += 1
+        elif outcome == 1:
+            legacy.win_counts[m_b][m_a] += 1
+    return legacy, matrix
+
+
+def time_per_call(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="抽样器微基准测试")
+    parser.add_argument("--models", type=int, nargs="+", default=[20, 100, 500])
+    parser.add_argument("--votes-per-pair", type=float, default=2.0)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'模型数':<8}{'模型对数':<10}{'旧版/次':<14}{'新版(重算)/次':<16}{'新版(缓存)/次':<16}{'加速比':<8}")
+    for n_models in args.models:
+        n_pairs = n_models * (n_models - 1) // 2
+        legacy, matrix = make_samplers(n_models, int(n_pairs * args.votes_per_pair))
+
+        # 两种实现的权重必须一致
+        pairs, weights = legacy._calculate_sampling_weights()
+        expected = dict(zip(pairs, weights))
+        new_weights = matrix._calculate_sampling_weights()
+        assert np.allclose([expected[pair] for pair in matrix.all_pairs], new_weights)
+
+        legacy_t = time_per_call(legacy.select_pair, args.repeat)
+
+        def select_recompute():
+            matrix.stats.version += 1  # 模拟每次抽样前都有新投票
+            matrix.select_pair()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            recompute_t = time_per_call(select_recompute, args.repeat)
+            cached_t = time_per_call(matrix.select_pair, args.repeat)
+
+        print(f"{n_models:<8}{n_pairs:<10}{legacy_t * 1e3:>9.3f} ms   {recompute_t * 1e3:>9.3f} ms     "
+              f"{cached_t * 1e3:>9.3f} ms     {legacy_t / recompute_t:>6.1f}x")
+
+
+if __name__ == '__main__':
+    main()
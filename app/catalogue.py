@@ -0,0 +1,223 @@
+# ==============================================================================
+# 文件: catalogue.py
+# 描述: 艺术品目录的内存索引，按作品ID O(1) 查找、按年代分组随机抽取和分页，供所有路由共享；
+#       以及清洗后目录的列式快照，避免每次启动都重新解析 Excel
+# ==============================================================================
+
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # 未安装 pyarrow 时不使用快照，每次启动都解析 Excel
+    feather = None
+
+# 快照格式版本：清洗逻辑变化时递增，使旧快照失效
+SNAPSHOT_FORMAT_VERSION = 1
+# 以 category 类型保存的低基数列，显著降低常驻内存
+CATEGORICAL_COLUMNS = ['年代', '材质', '形制', '收藏地', '材料', 'era_group']
+
+
+class ArtworkIndex:
+    """
+    按作品ID建立的只读索引。
+
+    目录加载时一次性构建，每条记录是一个普通字典（含预先计算好的本地图片路径 image_file），
+    请求路径上只需一次字典查找，不再扫描和复制 DataFrame。
+    同时按 era_group 预先分桶，画廊随机抽取只需 O(k)，分页浏览使用按种子缓存的稳定乱序。
+    目录文件变化时可调用 rebuild() 整体替换，正在进行的请求仍使用旧索引，互不影响。
+    """
+
+    def __init__(self, frame: pd.DataFrame, image_directory: str, max_cached_orders: int = 256):
+        self.image_directory = image_directory
+        self.max_cached_orders = max_cached_orders
+        self.records = {}
+        self.era_buckets = {}
+        self.all_ids = []
+        self.frame = None
+        self._orders = OrderedDict()
+        self._orders_lock = threading.Lock()
+        self.rebuild(frame)
+
+    def rebuild(self, frame: pd.DataFrame):
+        if frame is None:
+            self.frame, self.records, self.era_buckets, self.all_ids = None, {}, {}, []
+            return
+        records, era_buckets = {}, {}
+        for record in frame.to_dict('records'):
+            record['image_file'] = os.path.join(self.image_directory, f"{record['id']}.jpg")
+            records[record['id']] = record
+            era_buckets.setdefault(record.get('era_group'), []).append(record['id'])
+        # 先构建完整的新索引，再一次性替换引用
+        self.frame, self.records, self.era_buckets, self.all_ids = frame, records, era_buckets, list(records)
+        with self._orders_lock:
+            self._orders = OrderedDict()
+
+    def _bucket(self, era=None) -> list:
+        return self.all_ids if era is None else self.era_buckets.get(era, [])
+
+    def sample(self, era=None, k: int = 10) -> list:
+        """从指定年代（None 表示全部）中随机抽取至多 k 条记录。"""
+        bucket = self._bucket(era)
+        records = self.records
+        return [records[artwork_id] for artwork_id in random.sample(bucket, min(k, len(bucket)))]
+
+    def page(self, era=None, seed: int = 0, offset: int = 0, limit: int = 20) -> list:
+        """
+        按种子确定的稳定乱序分页读取。同一 (年代, 种子) 的顺序只计算一次并缓存，
+        之后每页只需 O(limit)。
+        """
+        bucket = self._bucket(era)
+        key = (era, seed, id(bucket))
+        with self._orders_lock:
+            order = self._orders.get(key)
+            if order is not None:
+                self._orders.move_to_end(key)
+        if order is None:
+            order = list(bucket)
+            random.Random(seed).shuffle(order)
+            with self._orders_lock:
+                self._orders[key] = order
+                while len(self._orders) > self.max_cached_orders:
+                    self._orders.popitem(last=False)
+        records = self.records
+        return [records[artwork_id] for artwork_id in order[offset:offset + limit]]
+
+    def count(self, era=None) -> int:
+        return len(self._bucket(era))
+
+    def get(self, artwork_id):
+        return self.records.get(artwork_id)
+
+    def __contains__(self, artwork_id) -> bool:
+        return artwork_id in self.records
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+
+class CatalogueWatcher:
+    """
+    目录文件变化检测：最多每 interval 秒检查一次文件修改时间，变化时调用 on_change()。
+    """
+
+    def __init__(self, path: str, on_change, interval: float = 30.0):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._last_check = time.monotonic()
+        self._mtime = self._current_mtime()
+
+    def _current_mtime(self):
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+    def check(self):
+        now = time.monotonic()
+        if now - self._last_check < self.interval:
+            return
+        if not self._lock.acquire(blocking=False):
+            return  # 其他线程正在检查或重新加载
+        try:
+            self._last_check = now
+            mtime = self._current_mtime()
+            if mtime is not None and mtime != self._mtime:
+                self.on_change()
+                self._mtime = mtime
+        finally:
+            self._lock.release()
+
+
+def public_record(record: dict) -> dict:
+    """转换为可直接 JSON 序列化的记录：去掉服务器本地路径，NaN 转为 None。"""
+    return {key: (None if isinstance(value, float) and math.isnan(value) else value)
+            for key, value in record.items() if key != 'image_file'}
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _read_snapshot_meta(snapshot_path: str):
+    try:
+        with open(snapshot_path + '.meta.json', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_atomic(path: str, write):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _write_meta(snapshot_path: str, meta: dict):
+    def write(tmp_path):
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+    _write_atomic(snapshot_path + '.meta.json', write)
+
+
+def load_snapshot(source_path: str, snapshot_path: str):
+    """
+    若快照与源文件一致（修改时间和大小相同，或内容哈希相同），以内存映射方式读取快照；否则返回 None。
+    """
+    if feather is None or not os.path.exists(snapshot_path):
+        return None
+    meta = _read_snapshot_meta(snapshot_path)
+    if not meta or meta.get('format_version') != SNAPSHOT_FORMAT_VERSION:
+        return None
+    stat = os.stat(source_path)
+    if meta.get('source_mtime_ns') != stat.st_mtime_ns or meta.get('source_size') != stat.st_size:
+        # 修改时间变了但内容可能没变（如重新拷贝），用哈希确认
+        if meta.get('source_sha256') != _file_sha256(source_path):
+            return None
+        meta.update(source_mtime_ns=stat.st_mtime_ns, source_size=stat.st_size)
+        _write_meta(snapshot_path, meta)
+    try:
+        return feather.read_table(snapshot_path, memory_map=True).to_pandas()
+    except Exception as e:
+        print(f"⚠️ [目录] 读取快照失败，将重新解析源文件: {e}")
+        return None
+
+
+def save_snapshot(frame: pd.DataFrame, source_path: str, snapshot_path: str) -> pd.DataFrame:
+    """
+    将清洗后的目录写成 Feather 快照（低基数列转为 category），并返回转换后的 DataFrame。
+    """
+    frame = frame.reset_index(drop=True)
+    for column in CATEGORICAL_COLUMNS:
+        if column in frame.columns:
+            frame[column] = frame[column].astype('category')
+    if feather is None:
+        return frame
+    stat = os.stat(source_path)
+    meta = {
+        'format_version': SNAPSHOT_FORMAT_VERSION,
+        'source_mtime_ns': stat.st_mtime_ns,
+        'source_size': stat.st_size,
+        'source_sha256': _file_sha256(source_path),
+        'rows': len(frame),
+    }
+    try:
+        _write_atomic(snapshot_path, lambda tmp: feather.write_feather(frame, tmp, compression='uncompressed'))
+        _write_meta(snapshot_path, meta)
+    except Exception as e:
+        print(f"⚠️ [目录] 写入快照失败: {e}")
+    return frame
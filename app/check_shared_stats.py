@@ -0,0 +1,99 @@
+# ==============================================================================
+# 文件: check_shared_stats.py
+# 描述: 多进程共享抽样统计的一致性检查：N 个进程同时投票，核对共享矩阵的最终计数
+#       与投票存储中的记录完全一致（不多计、不漏计）
+# 用法: python check_shared_stats.py [--processes 8] [--votes 200] [--models 6]
+# ==============================================================================
+
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from record_store import RecordStore
+from sampler import ModelSampler, SharedPairStats, shared_stats_name
+
+WINNERS = ['model_a', 'model_b', 'tie']
+
+
+def make_sampler(model_list: list, store: RecordStore, shared: bool) -> ModelSampler:
+    with contextlib.redirect_stdout(io.StringIO()):
+        return ModelSampler(model_list, os.devnull, vote_store=store, shared_stats=shared)
+
+
+def worker(worker_id: int, db_path: str, model_list: list, votes: int, start_event):
+    """模拟一个服务进程：写入投票存储后调用 record_vote，与 vote_api 的顺序一致。"""
+    rng = random.Random(worker_id)
+    store = RecordStore(db_path)
+    sampler = make_sampler(model_list, store, shared=True)
+    start_event.wait()
+    for k in range(votes):
+        model_a, model_b = rng.sample(model_list, 2)
+        winner = rng.choice(WINNERS)
+        evaluation_id = f"w{worker_id}-{k}"
+        store.write('ratings', {'timestamp': time.time(), 'evaluation_id': evaluation_id, 'artwork_id': 0,
+                                'winner': winner, 'model_a': model_a, 'model_b': model_b})
+        sampler.record_vote(model_a, model_b, winner, evaluation_id)
+        if k % 10 == 0:
+            sampler.select_pair()  # 读路径与写路径交错进行
+    store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查多进程共享抽样统计的计数是否精确")
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--votes", type=int, default=200, help="每个进程的投票数")
+    parser.add_argument("--models", type=int, default=6)
+    args = parser.parse_args()
+
+    model_list = [f"model_{i:02d}" for i in range(args.models)]
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "records.db")
+        name = shared_stats_name(db_path, model_list)
+        SharedPairStats.unlink(name)
+        RecordStore(db_path).close()  # 先建好表结构，避免多个进程同时建表
+
+        context = multiprocessing.get_context("spawn")
+        start_event = context.Event()
+        processes = [context.Process(target=worker, args=(i, db_path, model_list, args.votes, start_event))
+                     for i in range(args.processes)]
+        for process in processes:
+            process.start()
+        time.sleep(1.0)  # 等各进程完成初始化后同时开始投票
+        start = time.perf_counter()
+        start_event.set()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+        failed = [process.exitcode for process in processes if process.exitcode != 0]
+
+        store = RecordStore(db_path)
+        try:
+            shared = make_sampler(model_list, store, shared=True)
+            reference = make_sampler(model_list, store, shared=False)
+            expected_votes = args.processes * args.votes
+            total_battles = int(shared.stats.battles.sum()) // 2
+            exact = (total_battles == expected_votes
+                     and np.array_equal(shared.stats.battles, reference.stats.battles)
+                     and np.array_equal(shared.stats.wins, reference.stats.wins))
+            print(f"{args.processes} 个进程 × {args.votes} 票，用时 {elapsed:.2f} 秒"
+                  f"（{expected_votes / elapsed:.0f} 票/秒），退出码异常的进程 {len(failed)} 个")
+            print(f"共享矩阵对战总数 {total_battles}，期望 {expected_votes}，"
+                  f"与从投票存储重新统计的结果{'一致' if exact else '不一致'}")
+            shared.stats.close()
+        finally:
+            store.close()
+            SharedPairStats.unlink(name)
+        if failed or not exact:
+            raise SystemExit(1)
+        print("✅ 共享统计计数精确。")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+# ==============================================================================
+# 文件: evaluation_cache.py
+# 描述: 模型评价结果的持久化缓存（SQLite），按 (模型, 作品, 模式, 提示词版本) 分键，
+#       支持每个键保留多份不同样本、按总大小淘汰，以及相同请求合并为一次上游调用
+# ==============================================================================
+
+import hashlib
+import json
+import random
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+CacheKey = namedtuple("CacheKey", ["model_key", "artwork_id", "mode", "prompt_hash"])
+
+
+def prompt_hash(prompt: str) -> str:
+    """提示词文本的短哈希，提示词一旦修改，旧缓存自然失效。"""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+class EvaluationCache:
+    """
+    评价结果缓存。
+
+    策略：
+    1.  每个键最多保留 samples_per_key 份不同的回答；数量未满时仍会调用模型生成新样本，
+        数量已满后随机返回其中一份，保证同一作品的评价仍有一定多样性。
+    2.  所有样本的总字节数超过 max_bytes 时，按最近访问时间淘汰最旧的样本。
+    3.  相同键的并发请求只会触发一次上游调用（single-flight），其余请求等待并共享结果。
+    """
+
+    def __init__(self, db_path: str, samples_per_key: int = 3, max_bytes: int = 1024 ** 3):
+        self.db_path = db_path
+        self.samples_per_key = samples_per_key
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS evaluations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                model_key TEXT NOT NULL,
+                artwork_id TEXT NOT NULL,
+                mode TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                response_hash TEXT NOT NULL,
+                response TEXT NOT NULL,
+                model_info TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                UNIQUE (model_key, artwork_id, mode, prompt_hash, response_hash)
+            );
+            CREATE INDEX IF NOT EXISTS idx_evaluations_access ON evaluations (last_access);
+        """)
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM evaluations").fetchone()[0]
+
+    @staticmethod
+    def make_key(model_key: str, artwork_id: str, mode: str, prompt: str) -> CacheKey:
+        return CacheKey(model_key, str(artwork_id), mode, prompt_hash(prompt))
+
+    @property
+    def enabled(self) -> bool:
+        return self.samples_per_key > 0
+
+    def lookup(self, key: CacheKey):
+        """样本数已满时随机返回一份缓存结果，否则返回 None（表示应生成新样本）。"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, response, model_info FROM evaluations "
+                "WHERE model_key=? AND artwork_id=? AND mode=? AND prompt_hash=?", key).fetchall()
+            if len(rows) < self.samples_per_key:
+                return None
+            row_id, response, model_info = random.choice(rows)
+            self._conn.execute("UPDATE evaluations SET last_access=? WHERE id=?", (time.time(), row_id))
+            self._conn.commit()
+        return {"model_name": key.model_key, "response": response,
+                "model_info": json.loads(model_info), "cached": True}
+
+    def sample_count(self, key: CacheKey) -> int:
+        """某个键当前已保存的不同样本数。"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM evaluations "
+                "WHERE model_key=? AND artwork_id=? AND mode=? AND prompt_hash=?", key).fetchone()[0]
+
+    def store(self, key: CacheKey, result: dict):
+        """保存一份成功的评价结果；错误结果和重复回答不会写入。返回是否新增了样本。"""
+        if not self.enabled or "error" in result or not result.get("response"):
+            return False
+        response = result["response"]
+        size = len(response.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO evaluations (model_key, artwork_id, mode, prompt_hash, response_hash, "
+                "response, model_info, size, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (*key, hashlib.sha256(response.encode("utf-8")).hexdigest(), response,
+                 json.dumps(result.get("model_info", {}), ensure_ascii=False), size, now, now))
+            if cursor.rowcount:
+                self._total_bytes += size
+                self._evict_locked()
+            self._conn.commit()
+        return bool(cursor.rowcount)
+
+    def _evict_locked(self):
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT id, size FROM evaluations ORDER BY last_access LIMIT 64").fetchall()
+            if not rows:
+                self._total_bytes = 0
+                return
+            for row_id, size in rows:
+                self._conn.execute("DELETE FROM evaluations WHERE id=?", (row_id,))
+                self._total_bytes -= size
+                if self._total_bytes <= self.max_bytes:
+                    break
+
+    def get_or_generate(self, key: CacheKey, generate) -> dict:
+        """
+        命中缓存则直接返回；否则调用 generate() 生成并写入缓存。
+        相同键的并发请求共享同一次 generate() 调用。
+        """
+        cached = self.lookup(key)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+        if not owner:
+            return future.result()
+
+        try:
+            result = generate()
+            self.store(key, result)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM evaluations").fetchone()[0]
+        return {"entries": count, "bytes": self._total_bytes, "inflight": len(self._inflight)}
@@ -0,0 +1,383 @@
+# ==============================================================================
+# 文件: export_parquet.py
+# 描述: 把记录存储中的投票、反馈和错误报告导出为按 日期/评价模式 分区的 Parquet 数据集，供离线分析。
+#       投票预先按 evaluation_id 关联反馈和错误报告；回答全文按内容哈希去重后单独存放在 responses 数据集，
+#       只看指标的查询不会读到任何回答文本。增量运行只追加新记录，迟到的反馈/错误报告只重写受影响的分区
+# 用法: python export_parquet.py [--db records.db] [--out exports/parquet] [--interval 0] [--full]
+# ==============================================================================
+
+import argparse
+import json
+import os
+import re
+import shutil
+import sqlite3
+import time
+import zlib
+from datetime import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # 未安装 pyarrow 时无法导出
+    pa = pq = None
+
+EXPORT_FORMAT_VERSION = 1
+STATE_FILE_NAME = '_export_state.json'   # 以下划线开头，读取数据集时会被忽略
+RESPONSE_INDEX_FILE_NAME = '_exported_responses.db'   # 已导出回答的内容哈希索引，增量运行不必读取整个 responses 数据集
+UNKNOWN_PARTITION = 'unknown'
+COMPRESSION = 'zstd'
+SQL_CHUNK_SIZE = 500                     # IN (...) 查询每批的参数个数
+
+# 各数据集的列与类型；date 和 mode 是分区目录（date=.../mode=...），不重复写入文件
+VOTE_COLUMNS = [
+    ('vote_id', 'int64'), ('timestamp', 'string'), ('evaluation_id', 'string'), ('artwork_id', 'string'),
+    ('artwork_name', 'string'), ('winner', 'string'), ('model_a', 'string'), ('model_b', 'string'),
+    ('response_a_hash', 'string'), ('response_b_hash', 'string'),
+    ('feedback', 'string'), ('feedback_count', 'int32'), ('feedback_at', 'string'),
+    ('error_report_count', 'int32'), ('first_error_at', 'string'),
+]
+FEEDBACK_COLUMNS = [('feedback_id', 'int64'), ('timestamp', 'string'), ('evaluation_id', 'string'),
+                    ('feedback', 'string')]
+ERROR_REPORT_COLUMNS = [('report_id', 'int64'), ('timestamp', 'string'), ('user_ip', 'string'),
+                        ('evaluation_id', 'string'), ('artwork_id', 'string')]
+RESPONSE_COLUMNS = [('hash', 'string'), ('size', 'int64'), ('text', 'string')]
+
+_DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+_PARTITION_VALUE_PATTERN = re.compile(r"[\w-]+")
+_PART_PATTERN = re.compile(r"part-(\d+)-(\d+)\.parquet")
+
+
+def partition_date(timestamp) -> str:
+    """记录所属的日期分区：ISO 时间取日期部分，Unix 时间戳按本地时间换算。"""
+    text = '' if timestamp is None else str(timestamp)
+    if _DATE_PATTERN.match(text):
+        return text[:10]
+    try:
+        return datetime.fromtimestamp(float(text)).date().isoformat()
+    except (ValueError, OverflowError, OSError):
+        return UNKNOWN_PARTITION
+
+
+def partition_mode(mode) -> str:
+    return mode if mode and _PARTITION_VALUE_PATTERN.fullmatch(mode) else UNKNOWN_PARTITION
+
+
+def _schema(columns: list):
+    return pa.schema([(name, getattr(pa, kind)()) for name, kind in columns])
+
+
+def _chunks(values: list, size: int = SQL_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _part_name(first_id: int, last_id: int) -> str:
+    return f"part-{first_id:012d}-{last_id:012d}.parquet"
+
+
+def _part_files(directory: str) -> list:
+    """目录（含子目录）下的全部分片文件路径及其 ID 范围。"""
+    parts = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            match = _PART_PATTERN.fullmatch(name)
+            if match:
+                parts.append((os.path.join(root, name), int(match.group(1)), int(match.group(2))))
+    return parts
+
+
+def _write_part(directory: str, columns: list, rows: list, first_id: int, last_id: int, replace: bool = False) -> str:
+    """写入一个分片（先写以点开头的临时文件再改名）；replace=True 时同时删除目录中原有的分片。"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, _part_name(first_id, last_id))
+    tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    table = pa.Table.from_pylist([dict(zip((name for name, _ in columns), row)) for row in rows],
+                                 schema=_schema(columns))
+    pq.write_table(table, tmp_path, compression=COMPRESSION)
+    if replace:
+        for old_path, _, _ in _part_files(directory):
+            os.remove(old_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+class ParquetExporter:
+    """
+    增量导出器。导出目录下有四个数据集：
+
+    - votes/date=YYYY-MM-DD/mode=<named|anonymous|unknown>/part-*.parquet：紧凑投票记录，回答只有内容哈希，
+      已关联该评价的最新反馈、反馈次数、错误报告次数
+    - feedback/、error_reports/：原始反馈和错误报告，同样按日期和（所属投票的）评价模式分区
+    - responses/part-*.parquet：回答全文，按内容哈希去重，只追加
+
+    _export_state.json 记录各表已导出的最大行ID（水位线）和每个投票分区的行ID范围；
+    _exported_responses.db 记录已导出的回答哈希及其所在分片，判断回答是否已导出只按新投票引用的哈希查索引。
+    每次运行只读取水位线之后的新记录并追加新分片；新到的反馈或错误报告若属于已导出的投票，
+    只按行ID范围重写这些投票所在的分区。写入前先记下将要改动的分区，中途失败时下次运行先把它们恢复到上次的水位线。
+    """
+
+    def __init__(self, db_path: str, out_dir: str):
+        self.out_dir = out_dir
+        self.state_path = os.path.join(out_dir, STATE_FILE_NAME)
+        self.conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True, timeout=30)
+        vote_columns = [row[1] for row in self.conn.execute("PRAGMA table_info(votes)")]
+        self._mode_sql = "m.name" if 'mode' in vote_columns else "NULL"   # 旧库尚未迁移出 mode 列
+        self._mode_join = "LEFT JOIN symbols m ON m.id = v.mode " if 'mode' in vote_columns else ""
+        self.state = self._load_state()
+        self._exported = self._open_response_index()
+
+    def close(self):
+        self.conn.close()
+        self._exported.close()
+
+    # --- 状态 ---
+    def _load_state(self) -> dict:
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get('format_version') == EXPORT_FORMAT_VERSION:
+                return state
+        except (OSError, ValueError):
+            pass
+        return {'format_version': EXPORT_FORMAT_VERSION, 'pending': [], 'partitions': {},
+                'watermarks': {'votes': 0, 'feedback': 0, 'error_reports': 0}}
+
+    def _save_state(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.state_path)
+
+    def _open_response_index(self) -> sqlite3.Connection:
+        """打开已导出回答的哈希索引；索引为空而 responses 已有分片时（旧版本导出的目录），从分片补建一次。"""
+        os.makedirs(self.out_dir, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(self.out_dir, RESPONSE_INDEX_FILE_NAME))
+        conn.execute("CREATE TABLE IF NOT EXISTS exported (hash BLOB PRIMARY KEY, part_first_id INTEGER NOT NULL) WITHOUT ROWID")
+        parts = _part_files(os.path.join(self.out_dir, 'responses'))
+        if parts and conn.execute("SELECT 1 FROM exported LIMIT 1").fetchone() is None:
+            with conn:
+                for path, first_id, _ in parts:
+                    hashes = pq.read_table(path, columns=['hash']).column('hash').to_pylist()
+                    conn.executemany("INSERT OR IGNORE INTO exported (hash, part_first_id) VALUES (?, ?)",
+                                     [(bytes.fromhex(digest), first_id) for digest in hashes])
+            print(f"📇 [导出] 已从 {len(parts)} 个分片补建回答哈希索引。")
+        return conn
+
+    # --- 读取 ---
+    def _max_id(self, table: str) -> int:
+        return self.conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+
+    def _read_votes(self, where: str, params: tuple) -> list:
+        """读取投票并还原名称，每条记录为 (分区键, VOTE_COLUMNS 顺序的前 10 列)。"""
+        rows = self.conn.execute(
+            f"SELECT v.id, v.timestamp, v.evaluation_id, v.artwork_id, n.name, w.name, a.name, b.name, "
+            f"v.response_a, v.response_b, {self._mode_sql} FROM votes v "
+            "LEFT JOIN symbols n ON n.id = v.artwork_name LEFT JOIN symbols w ON w.id = v.winner "
+            "LEFT JOIN symbols a ON a.id = v.model_a LEFT JOIN symbols b ON b.id = v.model_b "
+            f"{self._mode_join}WHERE {where} ORDER BY v.id", params).fetchall()
+        return [(f"{partition_date(row[1])}/{partition_mode(row[10])}", list(row[:10])) for row in rows]
+
+    def _vote_modes(self, evaluation_ids: list) -> dict:
+        modes = {}
+        for chunk in _chunks(evaluation_ids):
+            for evaluation_id, mode in self.conn.execute(
+                    f"SELECT v.evaluation_id, {self._mode_sql} FROM votes v {self._mode_join}"
+                    f"WHERE v.evaluation_id IN ({', '.join('?' * len(chunk))})", chunk):
+                modes.setdefault(evaluation_id, mode)
+        return modes
+
+    def _joined(self, votes: list, max_feedback_id: int, max_report_id: int) -> list:
+        """为投票补上关联列：最新反馈及其时间、反馈次数、错误报告次数、首次报告时间；回答哈希转为十六进制。"""
+        evaluation_ids = sorted({row[2] for _, row in votes if row[2] is not None})
+        feedback, reports = {}, {}
+        for chunk in _chunks(evaluation_ids):
+            placeholders = ', '.join('?' * len(chunk))
+            for evaluation_id, text, timestamp, count in self.conn.execute(
+                    "SELECT f.evaluation_id, f.feedback, f.timestamp, c.n FROM feedback f JOIN ("
+                    "SELECT evaluation_id, MAX(id) AS last_id, COUNT(*) AS n FROM feedback "
+                    f"WHERE id <= ? AND evaluation_id IN ({placeholders}) GROUP BY evaluation_id"
+                    ") c ON f.id = c.last_id", (max_feedback_id, *chunk)):
+                feedback[evaluation_id] = (text, count, timestamp)
+            for evaluation_id, count, first_at in self.conn.execute(
+                    "SELECT evaluation_id, COUNT(*), MIN(timestamp) FROM error_reports "
+                    f"WHERE id <= ? AND evaluation_id IN ({placeholders}) GROUP BY evaluation_id",
+                    (max_report_id, *chunk)):
+                reports[evaluation_id] = (count, first_at)
+        joined = []
+        for key, row in votes:
+            row = row[:8] + [None if digest is None else bytes(digest).hex() for digest in row[8:10]]
+            text, count, timestamp = feedback.get(row[2], (None, 0, None))
+            report_count, first_at = reports.get(row[2], (0, None))
+            joined.append((key, row + [text, count, timestamp, report_count, first_at]))
+        return joined
+
+    # --- 写入 ---
+    def _partition_dir(self, dataset: str, key: str) -> str:
+        date, mode = key.split('/')
+        return os.path.join(self.out_dir, dataset, f"date={date}", f"mode={mode}")
+
+    def _rebuild_partition(self, key: str, max_ids: dict) -> int:
+        """按记录的行ID范围重新读取一个投票分区（截至 max_ids 水位线）并整体替换，返回行数。"""
+        directory = self._partition_dir('votes', key)
+        span = self.state['partitions'].get(key)
+        if span is None:
+            shutil.rmtree(directory, ignore_errors=True)
+            return 0
+        votes = [vote for vote in self._read_votes("v.id >= ? AND v.id <= ?", (span[0], min(span[1], max_ids['votes'])))
+                 if vote[0] == key]
+        if not votes:
+            shutil.rmtree(directory, ignore_errors=True)
+            return 0
+        rows = [row for _, row in self._joined(votes, max_ids['feedback'], max_ids['error_reports'])]
+        _write_part(directory, VOTE_COLUMNS, rows, rows[0][0], rows[-1][0], replace=True)
+        return len(rows)
+
+    def _recover(self):
+        """上次运行中途失败时，删除水位线之后写出的分片，并把改动过的投票分区恢复到上次的水位线。"""
+        watermarks = self.state['watermarks']
+        for dataset, table in (('feedback', 'feedback'), ('error_reports', 'error_reports'), ('responses', 'votes')):
+            for path, first_id, _ in _part_files(os.path.join(self.out_dir, dataset)):
+                if first_id > watermarks[table]:
+                    os.remove(path)
+        with self._exported:
+            self._exported.execute("DELETE FROM exported WHERE part_first_id > ?", (watermarks['votes'],))
+        if self.state['pending']:
+            print(f"♻️ [导出] 上次导出未完成，恢复 {len(self.state['pending'])} 个投票分区。")
+            for key in self.state['pending']:
+                self._rebuild_partition(key, watermarks)
+            self.state['pending'] = []
+            self._save_state()
+
+    def _append_records(self, dataset: str, columns: list, sql: str, first_id: int, last_id: int) -> int:
+        """追加一张原始表中行ID在 (first_id, last_id] 的记录，按记录日期和所属投票的评价模式分区。"""
+        rows = [list(row) for row in self.conn.execute(sql, (first_id, last_id))]
+        if not rows:
+            return 0
+        evaluation_index = [name for name, _ in columns].index('evaluation_id')
+        modes = self._vote_modes(sorted({row[evaluation_index] for row in rows if row[evaluation_index]}))
+        partitions = {}
+        for row in rows:
+            key = f"{partition_date(row[1])}/{partition_mode(modes.get(row[evaluation_index]))}"
+            partitions.setdefault(key, []).append(row)
+        for key, part_rows in partitions.items():
+            _write_part(self._partition_dir(dataset, key), columns, part_rows, part_rows[0][0], part_rows[-1][0])
+        return len(rows)
+
+    def _append_responses(self, votes: list) -> int:
+        """追加新投票引用的、尚未导出的回答全文。"""
+        digests = sorted({bytes(digest) for _, row in votes for digest in row[8:10] if digest is not None})
+        exported = set()
+        for chunk in _chunks(digests):
+            exported.update(bytes(digest) for digest, in self._exported.execute(
+                f"SELECT hash FROM exported WHERE hash IN ({', '.join('?' * len(chunk))})", chunk))
+        digests = [digest for digest in digests if digest not in exported]
+        if not digests:
+            return 0
+        rows = []
+        for chunk in _chunks(digests):
+            for digest, size, body in self.conn.execute(
+                    f"SELECT hash, size, body FROM responses WHERE hash IN ({', '.join('?' * len(chunk))})", chunk):
+                rows.append([bytes(digest).hex(), size, zlib.decompress(body).decode('utf-8')])
+        if rows:
+            first_id = votes[0][1][0]
+            _write_part(os.path.join(self.out_dir, 'responses'), RESPONSE_COLUMNS, rows, first_id, votes[-1][1][0])
+            # 分片落盘后再登记；登记后、保存水位线前中断时，_recover 会同时删除分片和这些登记
+            with self._exported:
+                self._exported.executemany("INSERT OR IGNORE INTO exported (hash, part_first_id) VALUES (?, ?)",
+                                           [(bytes.fromhex(row[0]), first_id) for row in rows])
+        return len(rows)
+
+    def run(self) -> dict:
+        """导出一次，返回各数据集新写入的记录数和重写的分区数。"""
+        self._recover()
+        watermarks = self.state['watermarks']
+        # 先固定本次的上界，导出期间新写入的记录留到下一次
+        max_ids = {table: self._max_id(table) for table in watermarks}
+        summary = {'votes': 0, 'rewritten_partitions': 0, 'feedback': 0, 'error_reports': 0, 'responses': 0}
+        if max_ids == watermarks:
+            return summary
+
+        new_votes = self._read_votes("v.id > ? AND v.id <= ?", (watermarks['votes'], max_ids['votes']))
+        late_ids = sorted({row[0] for table in ('feedback', 'error_reports') for row in self.conn.execute(
+            f"SELECT DISTINCT evaluation_id FROM {table} WHERE id > ? AND id <= ? AND evaluation_id IS NOT NULL",
+            (watermarks[table], max_ids[table]))})
+        affected = set()
+        for chunk in _chunks(late_ids):
+            affected.update(key for key, _ in self._read_votes(
+                f"v.id <= ? AND v.evaluation_id IN ({', '.join('?' * len(chunk))})", (watermarks['votes'], *chunk)))
+        new_by_partition = {}
+        for key, row in new_votes:
+            new_by_partition.setdefault(key, []).append((key, row))
+
+        # 先记下将要改动的分区，中途失败时下次运行据此恢复
+        self.state['pending'] = sorted(affected | set(new_by_partition))
+        self._save_state()
+        partitions = self.state['partitions']
+        for key, votes in new_by_partition.items():
+            first_id, last_id = votes[0][1][0], votes[-1][1][0]
+            span = partitions.get(key)
+            partitions[key] = [min(span[0], first_id), max(span[1], last_id)] if span else [first_id, last_id]
+            if key not in affected:
+                rows = [row for _, row in self._joined(votes, max_ids['feedback'], max_ids['error_reports'])]
+                _write_part(self._partition_dir('votes', key), VOTE_COLUMNS, rows, first_id, last_id)
+        for key in affected:
+            self._rebuild_partition(key, max_ids)
+        summary['votes'] = len(new_votes)
+        summary['rewritten_partitions'] = len(affected)
+
+        summary['feedback'] = self._append_records(
+            'feedback', FEEDBACK_COLUMNS,
+            "SELECT id, timestamp, evaluation_id, feedback FROM feedback WHERE id > ? AND id <= ? ORDER BY id",
+            watermarks['feedback'], max_ids['feedback'])
+        summary['error_reports'] = self._append_records(
+            'error_reports', ERROR_REPORT_COLUMNS,
+            "SELECT id, timestamp, user_ip, evaluation_id, artwork_id FROM error_reports "
+            "WHERE id > ? AND id <= ? ORDER BY id", watermarks['error_reports'], max_ids['error_reports'])
+        if new_votes:
+            summary['responses'] = self._append_responses(new_votes)
+
+        self.state['watermarks'] = max_ids
+        self.state['pending'] = []
+        self._save_state()
+        return summary
+
+
+def main():
+    base_dir = os.environ.get("ARENA_DATA_DIR", os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="将投票/反馈/错误报告增量导出为按日期和评价模式分区的 Parquet 数据集")
+    parser.add_argument("--db", default=os.path.join(base_dir, "records.db"))
+    parser.add_argument("--out", default=os.path.join(base_dir, "exports", "parquet"), help="导出目录")
+    parser.add_argument("--interval", type=float, default=0, help="大于 0 时作为定时任务每隔多少秒导出一次")
+    parser.add_argument("--full", action="store_true", help="清空导出目录后全部重新导出")
+    args = parser.parse_args()
+
+    if pq is None:
+        print("❌ [导出] 未安装 pyarrow，无法导出 Parquet。")
+        return
+    if not os.path.exists(args.db):
+        print(f"❌ [导出] 记录存储 '{args.db}' 不存在。")
+        return
+    if args.full:
+        shutil.rmtree(args.out, ignore_errors=True)
+
+    exporter = ParquetExporter(args.db, args.out)
+    try:
+        while True:
+            start = time.perf_counter()
+            summary = exporter.run()
+            print(f"📤 [导出] 投票 {summary['votes']} 条（重写 {summary['rewritten_partitions']} 个分区），"
+                  f"反馈 {summary['feedback']} 条，错误报告 {summary['error_reports']} 条，"
+                  f"回答 {summary['responses']} 条，耗时 {time.perf_counter() - start:.2f} 秒。")
+            if args.interval <= 0:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        exporter.close()
+
+
+if __name__ == '__main__':
+    main()
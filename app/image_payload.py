@@ -0,0 +1,114 @@
+# ==============================================================================
+# 文件: image_payload.py
+# 描述: 为 VLM 请求准备图片负载：按分辨率上限缩放、重新压缩并编码为 base64，
+#       结果同时缓存在进程内 LRU 和磁盘（按原图修改时间失效）
+# ==============================================================================
+
+import base64
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+try:
+    from PIL import Image
+except ImportError:  # 未安装 Pillow 时退化为直接发送原图
+    Image = None
+
+ImagePayload = namedtuple("ImagePayload", ["base64", "mime_type", "original_bytes", "encoded_bytes"])
+
+
+class ImagePayloadCache:
+    """
+    图片负载缓存。
+
+    - 长边超过 max_side 的图片按比例缩小，并以 JPEG 重新压缩；max_side 为 None 或 0 时发送原图。
+    - 进程内 LRU 保存已编码的 base64 字符串，按条数和总字节数双重限制。
+    - 磁盘缓存保存缩放后的 JPEG，原图修改时间晚于缓存文件时自动重建。
+    """
+
+    def __init__(self, cache_dir: str, max_entries: int = 64, max_memory_bytes: int = 256 * 1024 * 1024,
+                 quality: int = 85):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_memory_bytes = max_memory_bytes
+        self.quality = quality
+        self._lru = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.bytes_saved = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, image_path: str, max_side: int = None) -> ImagePayload:
+        """返回指定分辨率上限下的图片负载。"""
+        mtime_ns = os.stat(image_path).st_mtime_ns
+        key = (image_path, mtime_ns, max_side or 0)
+        with self._lock:
+            payload = self._lru.get(key)
+            if payload is not None:
+                self._lru.move_to_end(key)
+        if payload is None:
+            payload = self._build(image_path, max_side)
+            self._remember(key, payload)
+        with self._lock:
+            self.bytes_saved += payload.original_bytes - payload.encoded_bytes
+        return payload
+
+    def _remember(self, key, payload: ImagePayload):
+        with self._lock:
+            if key in self._lru:
+                return
+            self._lru[key] = payload
+            self._memory_bytes += len(payload.base64)
+            while self._lru and (len(self._lru) > self.max_entries or self._memory_bytes > self.max_memory_bytes):
+                _, evicted = self._lru.popitem(last=False)
+                self._memory_bytes -= len(evicted.base64)
+
+    def _build(self, image_path: str, max_side: int) -> ImagePayload:
+        original_bytes = os.path.getsize(image_path)
+        data = None
+        if max_side and Image is not None:
+            data = self._load_or_render(image_path, max_side)
+        if data is None or len(data) >= original_bytes:
+            # 无需缩放，或重新压缩后反而更大：直接使用原图
+            with open(image_path, "rb") as f:
+                data = f.read()
+        return ImagePayload(base64.b64encode(data).decode("utf-8"), "image/jpeg", original_bytes, len(data))
+
+    def _cache_path(self, image_path: str, max_side: int) -> str:
+        digest = hashlib.sha1(os.path.abspath(image_path).encode("utf-8")).hexdigest()[:16]
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        return os.path.join(self.cache_dir, f"{stem}_{digest}_{max_side}_q{self.quality}.jpg")
+
+    def _load_or_render(self, image_path: str, max_side: int):
+        cache_path = self._cache_path(image_path, max_side)
+        try:
+            if os.path.getmtime(cache_path) >= os.path.getmtime(image_path):
+                with open(cache_path, "rb") as f:
+                    return f.read()
+        except OSError:
+            pass
+
+        try:
+            with Image.open(image_path) as img:
+                if max(img.size) <= max_side and img.format == "JPEG":
+                    return None
+                img = img.convert("RGB")
+                img.thumbnail((max_side, max_side), Image.LANCZOS)
+                buffer = io.BytesIO()
+                img.save(buffer, format="JPEG", quality=self.quality, optimize=True, progressive=True)
+        except (OSError, Image.DecompressionBombError) as e:
+            print(f"⚠️ [图片] 无法处理 {image_path}，将发送原图: {e}")
+            return None
+
+        data = buffer.getvalue()
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, cache_path)
+        return data
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._lru), "memory_bytes": self._memory_bytes, "bytes_saved": self.bytes_saved}
@@ -0,0 +1,224 @@
+# ==============================================================================
+# 文件: image_variants.py
+# 描述: 画廊和详情页图片的多尺寸派生图（JPEG / WebP），首次请求时生成或用命令行预先生成，
+#       磁盘缓存按原图修改时间区分版本；带版本号的 URL 可以被浏览器和 CDN 永久缓存
+# 用法: python image_variants.py [--images images/] [--cache image_cache/variants]
+#                               [--widths 320 640 1280 1920] [--formats jpeg webp] [--workers 4]
+# ==============================================================================
+
+import argparse
+import hashlib
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    from PIL import Image
+except ImportError:  # 未安装 Pillow 时只提供原图
+    Image = None
+
+DEFAULT_WIDTHS = (320, 640, 1280, 1920)   # 画廊卡片 1x/2x、详情页 1x/2x
+FORMATS = {"webp": ("WEBP", "image/webp", ".webp"), "jpeg": ("JPEG", "image/jpeg", ".jpg")}
+DEFAULT_QUALITY = {"webp": 80, "jpeg": 82}
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+ImageVariant = namedtuple("ImageVariant", ["path", "mime_type", "etag"])
+
+
+def negotiate_format(accept_header: str, formats=("webp", "jpeg")) -> str:
+    """按 Accept 头选择输出格式：浏览器声明支持 image/webp 时用 WebP，否则用 JPEG。"""
+    if "webp" in formats and "image/webp" in (accept_header or ""):
+        return "webp"
+    return "jpeg"
+
+
+def source_version(path: str) -> str:
+    """原图版本号（修改时间），原图被替换后 URL 随之变化。"""
+    return format(os.stat(path).st_mtime_ns, "x")
+
+
+def _render_variants(source_path: str, targets: list) -> int:
+    """
+    解码一次原图，生成多个 (宽度, 格式, 输出路径, 质量) 派生图；返回生成的数量。
+    宽度不超过原图时按比例缩小，原图更窄时只转换格式，不放大。
+    """
+    built = 0
+    with Image.open(source_path) as img:
+        widest = max(width for width, _, _, _ in targets)
+        if img.format == "JPEG":
+            img.draft("RGB", (widest, 1))  # 让 JPEG 解码器直接以不小于目标宽度的分辨率解码
+        img = img.convert("RGB")
+        for width, fmt, output_path, quality in sorted(targets, reverse=True):
+            resized = img
+            if img.width > width:
+                resized = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+            pil_format = FORMATS[fmt][0]
+            options = {"quality": quality}
+            if pil_format == "JPEG":
+                options.update(optimize=True, progressive=True)
+            else:
+                options.update(method=4)
+            tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            resized.save(tmp_path, format=pil_format, **options)
+            os.replace(tmp_path, output_path)
+            built += 1
+    return built
+
+
+class ImageVariantStore:
+    """
+    图片派生图存储。
+
+    - 派生图的宽度只取 widths 中的档位（请求宽度向上取档），避免任意尺寸撑爆缓存。
+    - 缓存文件名包含原图路径摘要和修改时间，原图更新后旧文件不再被引用，可用 prune() 清理。
+    - 同一派生图的并发首次请求只生成一次。
+    """
+
+    def __init__(self, image_directory: str, cache_dir: str, widths: tuple = DEFAULT_WIDTHS, quality: dict = None):
+        self.image_directory = os.path.abspath(image_directory)
+        self.cache_dir = cache_dir
+        self.widths = tuple(sorted(widths))
+        self.quality = dict(DEFAULT_QUALITY, **(quality or {}))
+        self._building = {}
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "built": 0, "fallbacks": 0}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return Image is not None
+
+    def source_path(self, filename: str):
+        """图片目录内的原图路径；文件不存在或路径越出图片目录时返回 None。"""
+        path = os.path.abspath(os.path.join(self.image_directory, filename))
+        if not path.startswith(self.image_directory + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    def snap_width(self, width: int) -> int:
+        for candidate in self.widths:
+            if candidate >= width:
+                return candidate
+        return self.widths[-1]
+
+    def variant_path(self, source_path: str, width: int, fmt: str) -> str:
+        digest = hashlib.sha1(source_path.encode("utf-8")).hexdigest()[:16]
+        stem = os.path.splitext(os.path.basename(source_path))[0]
+        return os.path.join(self.cache_dir, f"{stem}_{digest}_{source_version(source_path)}_{width}w"
+                                            f"_q{self.quality[fmt]}{FORMATS[fmt][2]}")
+
+    def get(self, source_path: str, width: int, fmt: str):
+        """返回派生图；无法生成时返回 None（调用方退回原图）。"""
+        if not self.enabled:
+            return None
+        width = self.snap_width(width)
+        output_path = self.variant_path(source_path, width, fmt)
+        etag = os.path.basename(output_path)
+        if os.path.exists(output_path):
+            with self._lock:
+                self.counters["hits"] += 1
+            return ImageVariant(output_path, FORMATS[fmt][1], etag)
+
+        with self._lock:
+            event = self._building.get(output_path)
+            owner = event is None
+            if owner:
+                event = self._building[output_path] = threading.Event()
+        if not owner:
+            event.wait()
+            return ImageVariant(output_path, FORMATS[fmt][1], etag) if os.path.exists(output_path) else None
+        try:
+            _render_variants(source_path, [(width, fmt, output_path, self.quality[fmt])])
+            with self._lock:
+                self.counters["built"] += 1
+            return ImageVariant(output_path, FORMATS[fmt][1], etag)
+        except (OSError, Image.DecompressionBombError) as e:
+            print(f"⚠️ [图片] 无法生成 {source_path} 的 {width}px {fmt} 派生图，将返回原图: {e}")
+            with self._lock:
+                self.counters["fallbacks"] += 1
+            return None
+        finally:
+            with self._lock:
+                del self._building[output_path]
+            event.set()
+
+    def missing_targets(self, source_path: str, widths: tuple, formats: tuple) -> list:
+        targets = []
+        for width in widths:
+            for fmt in formats:
+                output_path = self.variant_path(source_path, width, fmt)
+                if not os.path.exists(output_path):
+                    targets.append((width, fmt, output_path, self.quality[fmt]))
+        return targets
+
+    def prune(self) -> int:
+        """删除原图已更新或已删除后遗留的派生图，返回删除的文件数。"""
+        current = set()
+        for name in os.listdir(self.image_directory):
+            path = os.path.join(self.image_directory, name)
+            if os.path.isfile(path):
+                current.add(f"{os.path.splitext(name)[0]}_{hashlib.sha1(path.encode('utf-8')).hexdigest()[:16]}"
+                            f"_{source_version(path)}")
+        removed = 0
+        for name in os.listdir(self.cache_dir):
+            # 文件名形如 <原图名>_<路径摘要>_<版本>_<宽度>w_q<质量>.<扩展名>；生成中的临时文件不动
+            if not name.endswith(".tmp") and name.rsplit("_", 2)[0] not in current:
+                os.remove(os.path.join(self.cache_dir, name))
+                removed += 1
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters, building=len(self._building))
+
+
+def prebuild(store: ImageVariantStore, widths: tuple, formats: tuple, workers: int = None) -> tuple:
+    """用进程池为图片目录中的全部图片生成派生图，返回 (处理的原图数, 新生成的派生图数)。"""
+    jobs = []
+    for name in sorted(os.listdir(store.image_directory)):
+        source_path = store.source_path(name)
+        if source_path is None or os.path.splitext(name)[1].lower() not in (".jpg", ".jpeg", ".png", ".webp"):
+            continue
+        targets = store.missing_targets(source_path, widths, formats)
+        if targets:
+            jobs.append((source_path, targets))
+    built = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_render_variants, source_path, targets): source_path for source_path, targets in jobs}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                built += future.result()
+            except Exception as e:
+                print(f"⚠️ [图片] 处理 {futures[future]} 失败: {e}")
+            if done % 100 == 0:
+                print(f"⏳ [图片] 已处理 {done}/{len(jobs)} 张原图")
+    return len(jobs), built
+
+
+def main():
+    data_dir = os.environ.get("ARENA_DATA_DIR", os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="预先生成画廊和详情页使用的多尺寸 JPEG / WebP 派生图")
+    parser.add_argument("--images", default=os.path.join(data_dir, "images"), help="原图目录")
+    parser.add_argument("--cache", default=os.path.join(data_dir, "image_cache", "variants"), help="派生图缓存目录")
+    parser.add_argument("--widths", nargs="+", type=int, default=list(DEFAULT_WIDTHS))
+    parser.add_argument("--formats", nargs="+", default=list(FORMATS), choices=list(FORMATS))
+    parser.add_argument("--workers", type=int, default=None, help="进程数（默认 CPU 核数）")
+    parser.add_argument("--prune", action="store_true", help="同时删除过期的派生图")
+    args = parser.parse_args()
+
+    if Image is None:
+        print("❌ [图片] 未安装 Pillow，无法生成派生图。")
+        return
+    store = ImageVariantStore(args.images, args.cache, widths=tuple(args.widths))
+    start = time.perf_counter()
+    sources, built = prebuild(store, tuple(args.widths), tuple(args.formats), args.workers)
+    print(f"✅ [图片] {sources} 张原图共生成 {built} 个派生图，耗时 {time.perf_counter() - start:.1f} 秒。")
+    if args.prune:
+        print(f"🗑️ [图片] 已删除 {store.prune()} 个过期派生图。")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+# ==============================================================================
+# 文件: leaderboard.py
+# 描述: Chatbot Arena 风格的排行榜引擎：在对战矩阵上拟合 Bradley–Terry 模型，
+#       用进程池并行做 bootstrap 置信区间，两次完整拟合之间用在线 Elo 增量更新
+# ==============================================================================
+
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+ELO_SCALE = 400.0      # 与 Chatbot Arena 一致：评分 = 400 * log10(强度) + 1000
+ELO_BASE = 1000.0
+ONLINE_ELO_K = 4.0     # 在线 Elo 更新的步长
+
+
+def fit_bradley_terry(wins: np.ndarray, ties: np.ndarray = None, prior: float = 1.0,
+                      max_iter: int = 500, tol: float = 1e-9) -> np.ndarray:
+    """
+    用 MM 算法（Hunter, 2004）拟合 Bradley–Terry 模型，整个迭代都是矩阵运算。
+
+    Args:
+        wins: wins[i, j] 为 i 战胜 j 的次数。
+        ties: 对称矩阵，ties[i, j] 为 i 与 j 的平局次数，按双方各半场胜利计入。
+        prior: 每个模型与一个强度为 1 的虚拟对手各胜负 prior 场，保证没有胜场或没有负场的模型评分有限。
+
+    Returns:
+        以 Elo 刻度表示的评分数组。
+    """
+    w = wins.astype(np.float64)
+    if ties is not None:
+        w = w + ties / 2.0
+    games = w + w.T
+    total_wins = w.sum(axis=1) + prior
+    p = np.ones(len(w))
+    for _ in range(max_iter):
+        denominator = (games / (p[:, None] + p[None, :])).sum(axis=1) + 2 * prior / (p + 1.0)
+        new_p = total_wins / denominator
+        new_p /= np.exp(np.log(new_p).mean())
+        if np.max(np.abs(new_p - p)) < tol:
+            p = new_p
+            break
+        p = new_p
+    return ELO_SCALE * np.log10(p) + ELO_BASE
+
+
+def _outcome_cells(battles: np.ndarray, wins: np.ndarray) -> tuple:
+    """把对战矩阵展开为上三角模型对的 (i胜, j胜, 平) 计数。"""
+    rows, cols = np.triu_indices(len(battles), k=1)
+    i_wins = wins[rows, cols]
+    j_wins = wins[cols, rows]
+    ties = battles[rows, cols] - i_wins - j_wins
+    return rows, cols, np.stack([i_wins, j_wins, np.maximum(ties, 0)], axis=1).ravel()
+
+
+def _cells_to_matrices(n_models: int, rows, cols, cells) -> tuple:
+    cells = cells.reshape(-1, 3)
+    wins = np.zeros((n_models, n_models))
+    ties = np.zeros((n_models, n_models))
+    wins[rows, cols] = cells[:, 0]
+    wins[cols, rows] = cells[:, 1]
+    ties[rows, cols] = ties[cols, rows] = cells[:, 2]
+    return wins, ties
+
+
+def _bootstrap_chunk(n_models: int, rows, cols, cells, rounds: int, seed: int) -> np.ndarray:
+    """
+    在子进程中运行若干轮 bootstrap：按各结果格子的频率多项式重采样全部投票后重新拟合。
+    重采样只作用于 O(模型对数) 个格子，与投票总数无关。
+    """
+    rng = np.random.default_rng(seed)
+    total = int(cells.sum())
+    probabilities = cells / total
+    results = np.empty((rounds, n_models))
+    for r in range(rounds):
+        sample = rng.multinomial(total, probabilities)
+        results[r] = fit_bradley_terry(*_cells_to_matrices(n_models, rows, cols, sample))
+    return results
+
+
+class LeaderboardEngine:
+    """
+    排行榜引擎。
+
+    - 完整拟合：从抽样器取对战矩阵快照，拟合 Bradley–Terry 评分，并在进程池中计算 bootstrap 置信区间。
+    - 增量更新：每张新投票到达时做一次在线 Elo 更新；累计到 refit_min_votes 票或超过 refit_interval 秒后，
+      在后台线程中重新完整拟合，期间接口继续返回缓存结果。
+    """
+
+    def __init__(self, model_list: list, stats_provider, bootstrap_rounds: int = 200, processes: int = None,
+                 refit_min_votes: int = 50, refit_interval: float = 300.0):
+        """
+        Args:
+            model_list (list): 模型名称列表，顺序与对战矩阵的下标一致。
+            stats_provider: 无参函数，返回 (battles, wins) 矩阵的副本。
+            bootstrap_rounds (int): bootstrap 轮数，0 表示不计算置信区间。
+            processes (int): bootstrap 进程池大小，默认为 CPU 核数。
+        """
+        self.model_list = list(model_list)
+        self.model_index = {model: i for i, model in enumerate(self.model_list)}
+        self.stats_provider = stats_provider
+        self.bootstrap_rounds = bootstrap_rounds
+        self.processes = processes
+        self.refit_min_votes = refit_min_votes
+        self.refit_interval = refit_interval
+
+        self._lock = threading.Lock()
+        self._refit_lock = threading.Lock()
+        self._refit_scheduled = False
+        self._pool = None
+        self._payload = None
+        self._fitted_at = 0.0
+        self._votes_since_fit = 0
+        self._online = np.full(len(self.model_list), ELO_BASE)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.processes)
+        return self._pool
+
+    def record_vote(self, model_a: str, model_b: str, winner: str):
+        """新投票到达时的在线 Elo 更新（平局按各得半分处理）。"""
+        i, j = self.model_index.get(model_a), self.model_index.get(model_b)
+        if i is None or j is None or i == j:
+            return
+        score = {'model_a': 1.0, 'model_b': 0.0}.get(winner, 0.5)
+        with self._lock:
+            expected = 1.0 / (1.0 + 10 ** ((self._online[j] - self._online[i]) / ELO_SCALE))
+            self._online[i] += ONLINE_ELO_K * (score - expected)
+            self._online[j] -= ONLINE_ELO_K * (score - expected)
+            self._votes_since_fit += 1
+            if self._payload is not None:
+                # 写时复制：已发布的结果可能正在锁外被序列化，不能原地修改
+                models = [dict(entry, online_rating=round(float(self._online[self.model_index[entry['model']]]), 1))
+                          for entry in self._payload['models']]
+                self._payload = dict(self._payload, models=models)
+
+    def refit(self) -> dict:
+        """完整拟合一次并更新缓存结果。"""
+        with self._refit_lock:
+            start = time.perf_counter()
+            with self._lock:
+                votes_at_start = self._votes_since_fit
+            battles, wins = self.stats_provider()
+            rows, cols, cells = _outcome_cells(battles, wins)
+            ties = battles - wins - wins.T
+            ratings = fit_bradley_terry(wins, np.maximum(ties, 0))
+
+            lower = upper = None
+            total_votes = int(cells.sum())
+            if self.bootstrap_rounds > 0 and total_votes > 0:
+                samples = self._bootstrap(rows, cols, cells)
+                lower, upper = np.percentile(samples, [2.5, 97.5], axis=0)
+
+            total_battles = battles.sum(axis=1)
+            total_wins = wins.sum(axis=1)
+            total_ties = np.maximum(ties, 0).sum(axis=1)
+            entries = []
+            for i, model in enumerate(self.model_list):
+                entries.append({
+                    'model': model,
+                    'rating': round(float(ratings[i]), 1),
+                    'ci_lower': None if lower is None else round(float(lower[i]), 1),
+                    'ci_upper': None if upper is None else round(float(upper[i]), 1),
+                    'online_rating': round(float(ratings[i]), 1),
+                    'battles': int(total_battles[i]),
+                    'wins': int(total_wins[i]),
+                    'ties': int(total_ties[i]),
+                    'win_rate': round(float(total_wins[i] / total_battles[i]), 4) if total_battles[i] else None,
+                })
+            entries.sort(key=lambda entry: entry['rating'], reverse=True)
+            for rank, entry in enumerate(entries, 1):
+                entry['rank'] = rank
+
+            payload = {
+                'method': 'bradley-terry',
+                'votes': total_votes,
+                'bootstrap_rounds': self.bootstrap_rounds if lower is not None else 0,
+                'updated_at': datetime.now().isoformat(),
+                'fit_seconds': round(time.perf_counter() - start, 3),
+                'models': entries,
+            }
+            with self._lock:
+                self._payload = payload
+                self._online = ratings.copy()
+                self._votes_since_fit -= votes_at_start
+                self._fitted_at = time.monotonic()
+            print(f"📊 [排行榜] 已基于 {total_votes} 票重新拟合，耗时 {payload['fit_seconds']} 秒。")
+            return payload
+
+    def _bootstrap(self, rows, cols, cells) -> np.ndarray:
+        n_models = len(self.model_list)
+        pool = self._get_pool()
+        chunks = max(1, min(self.bootstrap_rounds, getattr(pool, '_max_workers', 1)))
+        base, extra = divmod(self.bootstrap_rounds, chunks)
+        seeds = np.random.SeedSequence().generate_state(chunks)
+        futures = [pool.submit(_bootstrap_chunk, n_models, rows, cols, cells, base + (k < extra), int(seeds[k]))
+                   for k in range(chunks)]
+        return np.vstack([future.result() for future in futures])
+
+    def snapshot(self) -> dict:
+        """
+        返回缓存的排行榜。首次调用时同步拟合；之后结果过期时在后台重新拟合，本次仍返回旧结果。
+        """
+        with self._lock:
+            payload = self._payload
+            stale = payload is not None and self._votes_since_fit > 0 and (
+                self._votes_since_fit >= self.refit_min_votes
+                or time.monotonic() - self._fitted_at >= self.refit_interval)
+            schedule = stale and not self._refit_scheduled
+            if schedule:
+                self._refit_scheduled = True
+            pending_votes = self._votes_since_fit
+        if payload is None:
+            return self.refit()
+        if schedule:
+            threading.Thread(target=self._refit_quietly, name="leaderboard-refit", daemon=True).start()
+        return dict(payload, pending_votes=pending_votes)
+
+    def _refit_quietly(self):
+        try:
+            self.refit()
+        except Exception as e:
+            print(f"❌ [排行榜] 重新拟合失败: {e}")
+        finally:
+            with self._lock:
+                self._refit_scheduled = False
@@ -0,0 +1,596 @@
+# ==============================================================================
+# 文件: loadtest.py
+# 描述: 本地压测。启动一个模拟 OpenAI 兼容接口的多模态模型服务（/v1/chat/completions，支持流式，
+#       可按模型配置首 token 延迟分布、生成速度和错误注入），用合成目录和图片启动服务端并把所有接入点
+#       指向模拟服务，再由并发虚拟用户访问 /、/api/artwork/evaluate 和 /api/vote。
+#       输出各接口 p50/p95/p99 延迟、吞吐量和服务端内存，结果写成 JSON，便于跨提交对比。
+# 用法: python loadtest.py run [--users 50] [--duration 60] [--server flask|async] [--profile profile.json]
+#                              [--no-cache] [--output results.json] [--keep]
+#       python loadtest.py stub [--port 9100] [--profile profile.json]      # 只启动模拟模型服务
+#       python loadtest.py compare 基线.json 本次.json
+# ==============================================================================
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RESULTS_DIR = os.path.join(BASE_DIR, "loadtest_results")
+STREAM_CHUNK_INTERVAL = 0.05   # 模拟服务流式输出时每个数据块的间隔（秒）
+SERVER_START_TIMEOUT = 180     # 等待服务端启动完成的最长时间（秒）
+MEMORY_SAMPLE_INTERVAL = 0.5   # 服务端内存采样间隔（秒）
+
+# 模拟模型的默认行为；profile 文件可按 model_name（即 MODEL_CONFIG 中的 "model_name"）覆盖任意字段：
+# {"default": {...}, "models": {"o3": {"first_token_median": 6.0, "error_rate": 0.05}}}
+DEFAULT_PROFILE = {
+    "default": {
+        "first_token_median": 1.0,   # 首 token 延迟的中位数（秒），按对数正态分布抽样
+        "first_token_sigma": 0.5,    # 对数正态分布的 sigma，越大长尾越重
+        "tokens_per_second": 60,     # 生成速度
+        "output_tokens": 400,        # 回答的平均 token 数（正态分布，标准差为 25%）
+        "error_rate": 0.0,           # 注入错误的概率
+        "error_status": 500,         # 注入错误时返回的 HTTP 状态码（429/500/503 等）
+    },
+    "models": {},
+}
+
+ERA_SAMPLES = ['东晋', '唐', '北宋', '南宋', '元', '明', '清', '近现代']
+TOKEN_WORDS = ['笔墨', '气韵', '构图', '留白', '皴法', '设色', '意境', '山水', '题跋', '用笔', '层次', '生动']
+
+
+# ------------------------------------------------------------------------------
+# 模拟模型服务
+# ------------------------------------------------------------------------------
+
+class StubModelServer:
+    """线程化的 OpenAI 兼容模拟服务，每个请求按所属模型的配置抽样延迟、长度和是否出错。"""
+
+    def __init__(self, profile: dict, host: str = "127.0.0.1", port: int = 0, seed: int = None):
+        self.profile = profile
+        self.rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/stats"):
+                    self.send_json(200, stub.stats())
+                else:
+                    self.send_json(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self.send_json(404, {"error": {"message": "not found"}})
+                    return
+                try:
+                    payload = json.loads(body)
+                except ValueError:
+                    self.send_json(400, {"error": {"message": "invalid JSON"}})
+                    return
+                stub.handle_completion(self, payload)
+
+            def send_json(self, status: int, data: dict):
+                raw = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.request_queue_size = 1024
+        self.port = self.httpd.server_address[1]
+        self.base_url = f"http://{host}:{self.port}/v1"
+
+    def model_profile(self, model: str) -> dict:
+        return dict(self.profile["default"], **self.profile["models"].get(model, {}))
+
+    def _plan(self, model: str) -> tuple:
+        """抽样一次请求的 (首 token 延迟, token 数, 生成速度, 注入的错误状态码或 None)。"""
+        options = self.model_profile(model)
+        with self._rng_lock:
+            first_token = self.rng.lognormvariate(math.log(options["first_token_median"]), options["first_token_sigma"])
+            tokens = max(1, int(self.rng.gauss(options["output_tokens"], options["output_tokens"] * 0.25)))
+            failed = self.rng.random() < options["error_rate"]
+        return first_token, tokens, options["tokens_per_second"], options["error_status"] if failed else None
+
+    def _count(self, model: str, field: str):
+        with self._stats_lock:
+            counters = self._stats.setdefault(model, {"requests": 0, "streamed": 0, "errors": 0, "tokens": 0})
+            counters[field] += 1
+
+    def _add_tokens(self, model: str, tokens: int):
+        with self._stats_lock:
+            self._stats[model]["tokens"] += tokens
+
+    def handle_completion(self, handler, payload: dict):
+        model = payload.get("model", "unknown")
+        stream = bool(payload.get("stream"))
+        first_token, tokens, tokens_per_second, error_status = self._plan(model)
+        self._count(model, "requests")
+        if stream:
+            self._count(model, "streamed")
+        time.sleep(first_token)
+        if error_status is not None:
+            self._count(model, "errors")
+            handler.send_json(error_status, {"error": {"message": f"injected error for {model}", "type": "server_error"}})
+            return
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        usage = {"prompt_tokens": 1000, "completion_tokens": tokens, "total_tokens": 1000 + tokens}
+        if not stream:
+            time.sleep(tokens / tokens_per_second)
+            self._add_tokens(model, tokens)
+            handler.send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": _fake_text(model, tokens)}}],
+                "usage": usage,
+            })
+            return
+
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Cache-Control", "no-cache")
+        handler.send_header("Connection", "close")  # 不带长度的流式响应，以关闭连接表示结束
+        handler.end_headers()
+        handler.close_connection = True
+        per_chunk = max(1, int(tokens_per_second * STREAM_CHUNK_INTERVAL))
+        sent = 0
+        try:
+            while sent < tokens:
+                count = min(per_chunk, tokens - sent)
+                time.sleep(count / tokens_per_second)
+                self._write_event(handler, _chunk(completion_id, model, {"content": _fake_text(model, count)}))
+                sent += count
+            self._write_event(handler, _chunk(completion_id, model, {}, finish_reason="stop"))
+            if (payload.get("stream_options") or {}).get("include_usage"):
+                self._write_event(handler, {"id": completion_id, "object": "chat.completion.chunk",
+                                            "created": int(time.time()), "model": model, "choices": [], "usage": usage})
+            handler.wfile.write(b"data: [DONE]\n\n")
+            handler.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 调用方中途取消了流式请求
+        self._add_tokens(model, sent)
+
+    @staticmethod
+    def _write_event(handler, data: dict):
+        handler.wfile.write(b"data: " + json.dumps(data, ensure_ascii=False).encode("utf-8") + b"\n\n")
+        handler.wfile.flush()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {model: dict(counters) for model, counters in self._stats.items()}
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="stub-model-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _chunk(completion_id: str, model: str, delta: dict, finish_reason: str = None) -> dict:
+    return {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+
+def _fake_text(model: str, tokens: int) -> str:
+    words = [TOKEN_WORDS[(hash(model) + i) % len(TOKEN_WORDS)] for i in range(tokens)]
+    return "".join(words)
+
+
+def load_profile(path: str = None) -> dict:
+    profile = {"default": dict(DEFAULT_PROFILE["default"]), "models": {}}
+    if path:
+        with open(path, encoding="utf-8") as f:
+            custom = json.load(f)
+        profile["default"].update(custom.get("default", {}))
+        profile["models"].update(custom.get("models", {}))
+    return profile
+
+
+# ------------------------------------------------------------------------------
+# 合成数据
+# ------------------------------------------------------------------------------
+
+def build_dataset(directory: str, artworks: int, image_side: int, seed: int = 0) -> list:
+    """在 directory 下生成合成目录（Excel）和图片，返回作品ID列表。"""
+    import pandas as pd
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    image_directory = os.path.join(directory, "images")
+    os.makedirs(image_directory, exist_ok=True)
+    rows = []
+    height = image_side * 3 // 4
+    gradient = np.linspace(0, 1, image_side, dtype=np.float32)[None, :, None]
+    for i in range(artworks):
+        artwork_id = f"LT{i:05d}"
+        rows.append({'id': artwork_id, '名称': f'压测作品{i}', '作者': f'作者{i % 37}',
+                     '年代': ERA_SAMPLES[i % len(ERA_SAMPLES)], '收藏地': '压测博物馆',
+                     '材质': '纸本', '形制': '立轴', '材料': '水墨'})
+        base = rng.uniform(80, 220, size=(1, 1, 3)).astype(np.float32)
+        noise = rng.normal(0, 12, size=(height, image_side, 3)).astype(np.float32)
+        pixels = np.clip(base * (0.6 + 0.4 * gradient) + noise, 0, 255).astype(np.uint8)
+        Image.fromarray(pixels).save(os.path.join(image_directory, f"{artwork_id}.jpg"), quality=85)
+    pd.DataFrame(rows).to_excel(os.path.join(directory, "中国博物馆书画数据目录.xlsx"), index=False)
+
+    # 仓库中未附带页面模板时，提供最小模板，使页面路由也能参与压测
+    template_directory = os.path.join(directory, "templates")
+    os.makedirs(template_directory, exist_ok=True)
+    with open(os.path.join(template_directory, "gallery.html"), "w", encoding="utf-8") as f:
+        f.write("<ul>{% for a in artworks %}<li><img src=\"{{ a.path }}\">{{ a['名称'] }}</li>{% endfor %}</ul>")
+    with open(os.path.join(template_directory, "artwork_detail.html"), "w", encoding="utf-8") as f:
+        f.write("<h1>{{ artwork['名称'] }}</h1>")
+    return [row['id'] for row in rows]
+
+
+# ------------------------------------------------------------------------------
+# 被测服务端（子进程）
+# ------------------------------------------------------------------------------
+
+def serve(args):
+    """在子进程中启动服务端；数据目录和模型接入点由父进程通过环境变量指定。"""
+    if args.server == "async":
+        import async_main
+        server, application = async_main.server, async_main.application
+    else:
+        from pregenerate import DEFAULT_MAIN_PATH, load_server
+        server, application = load_server(DEFAULT_MAIN_PATH), None
+    if not os.path.isdir(server.app.template_folder):
+        server.app.template_folder = os.path.join(os.environ["ARENA_DATA_DIR"], "templates")
+    if args.no_cache:
+        server.evaluation_cache = None
+
+    if application is not None:
+        from hypercorn.asyncio import serve as hypercorn_serve
+        from hypercorn.config import Config
+        config = Config()
+        config.bind = [f"127.0.0.1:{args.port}"]
+        config.accesslog = None
+        asyncio.run(hypercorn_serve(application, config))
+    else:
+        from werkzeug.serving import make_server
+        httpd = make_server("127.0.0.1", args.port, server.app, threaded=True)
+        httpd.serve_forever()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def read_memory(pid: int) -> dict:
+    """读取进程当前和峰值常驻内存（字节），仅支持 Linux，其他平台返回空字典。"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return {}
+    return {key: int(fields[name].split()[0]) * 1024 for key, name in (("rss", "VmRSS"), ("peak", "VmHWM"))
+            if name in fields}
+
+
+class MemorySampler:
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="memory-sampler", daemon=True)
+
+    def _loop(self):
+        while not self._stop.wait(MEMORY_SAMPLE_INTERVAL):
+            memory = read_memory(self.pid)
+            if memory:
+                self.samples.append(memory)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self) -> dict:
+        self._stop.set()
+        self._thread.join()
+        if not self.samples:
+            return {}
+        rss = [sample["rss"] for sample in self.samples]
+        return {"rss_start": rss[0], "rss_end": rss[-1], "rss_mean": int(np.mean(rss)),
+                "rss_peak": max(sample.get("peak", 0) for sample in self.samples)}
+
+
+# ------------------------------------------------------------------------------
+# 虚拟用户
+# ------------------------------------------------------------------------------
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.recording = False
+
+    def add(self, endpoint: str, seconds: float, status: int, ok: bool):
+        if self.recording:
+            self.samples.setdefault(endpoint, []).append((seconds, status, ok))
+
+    def summary(self, duration: float) -> dict:
+        endpoints = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            latencies = np.array([sample[0] for sample in samples])
+            statuses = {}
+            for _, status, _ in samples:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            endpoints[endpoint] = {
+                "requests": len(samples),
+                "errors": sum(1 for sample in samples if not sample[2]),
+                "status": statuses,
+                "throughput": len(samples) / duration,
+                "latency": {"p50": float(np.percentile(latencies, 50)), "p95": float(np.percentile(latencies, 95)),
+                            "p99": float(np.percentile(latencies, 99)), "mean": float(latencies.mean()),
+                            "max": float(latencies.max())},
+            }
+        return endpoints
+
+
+async def virtual_user(client, base_url: str, artwork_ids: list, recorder: Recorder, deadline: float,
+                       think_time: float, rng: random.Random):
+    """一个访客的循环：打开画廊 → 请求一场对战 → 投票，每步之间停顿一段思考时间。"""
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            response = await client.get(f"{base_url}/")
+            recorder.add("gallery", time.perf_counter() - start, response.status_code, response.status_code == 200)
+        except Exception:
+            recorder.add("gallery", time.perf_counter() - start, 0, False)
+
+        artwork_id = rng.choice(artwork_ids)
+        start = time.perf_counter()
+        evaluations = None
+        try:
+            response = await client.post(f"{base_url}/api/artwork/evaluate", json={"artwork_id": artwork_id})
+            if response.status_code == 200:
+                evaluations = response.json().get("evaluations", {})
+            ok = evaluations is not None and len(evaluations) == 2 and all("error" not in e for e in evaluations.values())
+            recorder.add("evaluate", time.perf_counter() - start, response.status_code, ok)
+        except Exception:
+            recorder.add("evaluate", time.perf_counter() - start, 0, False)
+
+        if evaluations and len(evaluations) == 2:
+            await asyncio.sleep(rng.expovariate(1 / think_time) if think_time > 0 else 0)
+            (model_a, result_a), (model_b, result_b) = evaluations.items()
+            vote = {"evaluation_id": str(uuid.uuid4()), "winner": rng.choice(["model_a", "model_b", "tie"]),
+                    "artwork_id": artwork_id, "artwork_name": "", "model_a": model_a, "model_b": model_b,
+                    "response_a": result_a.get("response", ""), "response_b": result_b.get("response", "")}
+            start = time.perf_counter()
+            try:
+                response = await client.post(f"{base_url}/api/vote", json=vote)
+                recorder.add("vote", time.perf_counter() - start, response.status_code, response.status_code == 200)
+            except Exception:
+                recorder.add("vote", time.perf_counter() - start, 0, False)
+        await asyncio.sleep(rng.expovariate(1 / think_time) if think_time > 0 else 0)
+
+
+async def drive(base_url: str, artwork_ids: list, args) -> tuple:
+    import httpx
+
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users * 2)
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(args.request_timeout)) as client:
+        start = time.monotonic()
+        deadline = start + args.warmup + args.duration
+        users = [virtual_user(client, base_url, artwork_ids, recorder, deadline, args.think_time,
+                              random.Random(args.seed * 100003 + i)) for i in range(args.users)]
+        tasks = [asyncio.ensure_future(user) for user in users]
+        await asyncio.sleep(args.warmup)
+        recorder.recording = True
+        measured_start = time.monotonic()
+        await asyncio.gather(*tasks)
+        measured = time.monotonic() - measured_start
+    return recorder, measured
+
+
+def _wait_until_ready(base_url: str, process):
+    import httpx
+
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"服务端启动失败（退出码 {process.returncode}），详见日志")
+        try:
+            if httpx.get(f"{base_url}/api/gallery?limit=1", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"服务端在 {SERVER_START_TIMEOUT} 秒内未就绪")
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BASE_DIR, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(args):
+    profile = load_profile(args.profile)
+    stub = StubModelServer(profile, seed=args.seed).start()
+    print(f"🧪 [压测] 模拟模型服务: {stub.base_url}")
+    work_dir = tempfile.mkdtemp(prefix="arena-loadtest-")
+    try:
+        _run_in(work_dir, stub, profile, args)
+    finally:
+        stub.stop()
+        if args.keep:
+            print(f"📁 [压测] 工作目录（合成数据、数据库、server.log）已保留: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _run_in(work_dir: str, stub, profile: dict, args):
+    artwork_ids = build_dataset(work_dir, args.artworks, args.image_side, args.seed)
+    print(f"🧪 [压测] 合成数据: {len(artwork_ids)} 件作品")
+
+    port = _free_port()
+    env = dict(os.environ, ARENA_DATA_DIR=work_dir, ARENA_PROVIDER_BASE_URL=stub.base_url,
+               ARENA_PROVIDER_UNLIMITED="0" if args.rate_limits else "1", PYTHONUNBUFFERED="1")
+    command = [sys.executable, os.path.abspath(__file__), "serve", "--server", args.server, "--port", str(port)]
+    if args.no_cache:
+        command.append("--no-cache")
+    log_path = os.path.join(work_dir, "server.log")
+    with open(log_path, "w", encoding="utf-8") as log:
+        process = subprocess.Popen(command, cwd=BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        _wait_until_ready(base_url, process)
+        print(f"🧪 [压测] 服务端（{args.server}）已就绪，{args.users} 个虚拟用户，"
+              f"预热 {args.warmup:g} 秒，测量 {args.duration:g} 秒...")
+        memory = MemorySampler(process.pid).start()
+        recorder, measured = asyncio.run(drive(base_url, artwork_ids, args))
+        memory_summary = memory.stop()
+    except Exception:
+        if not args.keep:
+            print("⚠️ [压测] 运行失败，可加 --keep 保留工作目录查看 server.log")
+        raise
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    endpoints = recorder.summary(measured)
+    results = {
+        "version": 1,
+        "commit": _git_commit(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {key: value for key, value in vars(args).items() if key != "func"},
+        "profile": profile,
+        "duration": measured,
+        "endpoints": endpoints,
+        "total_throughput": sum(endpoint["requests"] for endpoint in endpoints.values()) / measured,
+        "memory": memory_summary,
+        "stub": stub.stats(),
+        "server_log": log_path if args.keep else None,
+    }
+    output = args.output or os.path.join(
+        DEFAULT_RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{results['commit'][:8]}-{args.server}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print_results(results)
+    print(f"💾 [压测] 结果已写入 {output}")
+
+
+def print_results(results: dict):
+    print(f"\n{'接口':<10}{'请求数':>8}{'失败':>6}{'吞吐(次/秒)':>13}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+    for name, endpoint in results["endpoints"].items():
+        latency = endpoint["latency"]
+        print(f"{name:<10}{endpoint['requests']:>8}{endpoint['errors']:>6}{endpoint['throughput']:>13.2f}"
+              f"{latency['p50'] * 1000:>10.1f}{latency['p95'] * 1000:>10.1f}{latency['p99'] * 1000:>10.1f}")
+    memory = results.get("memory") or {}
+    if memory:
+        print(f"服务端内存: 起始 {memory['rss_start'] / 2**20:.0f} MB，结束 {memory['rss_end'] / 2**20:.0f} MB，"
+              f"峰值 {memory['rss_peak'] / 2**20:.0f} MB")
+
+
+def compare(args):
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+    print(f"基线 {baseline['commit'][:8]}（{baseline['started_at']}） → 本次 {current['commit'][:8]}（{current['started_at']}）")
+    print(f"{'接口':<10}{'指标':<12}{'基线':>12}{'本次':>12}{'变化':>10}")
+
+    def row(name, metric, old, new):
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "-"
+        print(f"{name:<10}{metric:<12}{old:>12.2f}{new:>12.2f}{change:>10}")
+
+    for name in sorted(set(baseline["endpoints"]) & set(current["endpoints"])):
+        old, new = baseline["endpoints"][name], current["endpoints"][name]
+        row(name, "throughput", old["throughput"], new["throughput"])
+        for quantile in ("p50", "p95", "p99"):
+            row(name, f"{quantile}(ms)", old["latency"][quantile] * 1000, new["latency"][quantile] * 1000)
+    if baseline.get("memory") and current.get("memory"):
+        row("memory", "peak(MB)", baseline["memory"]["rss_peak"] / 2**20, current["memory"]["rss_peak"] / 2**20)
+
+
+def stub_main(args):
+    stub = StubModelServer(load_profile(args.profile), port=args.port, seed=args.seed)
+    print(f"🧪 [压测] 模拟模型服务已启动: {stub.base_url}（Ctrl+C 退出）")
+    try:
+        stub.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(stub.stats(), ensure_ascii=False, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="使用本地模拟模型服务对服务端进行压测")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="启动模拟服务和服务端并执行压测")
+    run_parser.add_argument("--server", choices=["flask", "async"], default="flask",
+                            help="被测服务端：同步 Flask（默认）或异步模式（async_main.py + hypercorn）")
+    run_parser.add_argument("--users", type=int, default=50, help="并发虚拟用户数")
+    run_parser.add_argument("--duration", type=float, default=60, help="测量时长（秒）")
+    run_parser.add_argument("--warmup", type=float, default=10, help="预热时长（秒），期间的请求不计入结果")
+    run_parser.add_argument("--think-time", type=float, default=1.0, help="用户每步之间的平均停顿（秒，指数分布）")
+    run_parser.add_argument("--request-timeout", type=float, default=300)
+    run_parser.add_argument("--artworks", type=int, default=100, help="合成目录的作品数")
+    run_parser.add_argument("--image-side", type=int, default=1600, help="合成图片的长边像素")
+    run_parser.add_argument("--profile", default=None, help="模拟模型行为的 JSON 配置")
+    run_parser.add_argument("--no-cache", action="store_true", help="关闭评价缓存，每次评价都调用模拟模型")
+    run_parser.add_argument("--rate-limits", action="store_true", help="保留 PROVIDER_CONFIG 中的限流设置")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--output", default=None, help="结果 JSON 路径（默认写入 loadtest_results/）")
+    run_parser.add_argument("--keep", action="store_true", help="保留临时工作目录（合成数据、数据库、server.log）")
+    run_parser.set_defaults(func=run)
+
+    serve_parser = subparsers.add_parser("serve", help="（内部使用）在子进程中启动被测服务端")
+    serve_parser.add_argument("--server", choices=["flask", "async"], default="flask")
+    serve_parser.add_argument("--port", type=int, required=True)
+    serve_parser.add_argument("--no-cache", action="store_true")
+    serve_parser.set_defaults(func=serve)
+
+    stub_parser = subparsers.add_parser("stub", help="只启动模拟模型服务")
+    stub_parser.add_argument("--port", type=int, default=9100)
+    stub_parser.add_argument("--profile", default=None)
+    stub_parser.add_argument("--seed", type=int, default=None)
+    stub_parser.set_defaults(func=stub_main)
+
+    compare_parser = subparsers.add_parser("compare", help="对比两次压测结果")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
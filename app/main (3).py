@@ -4,20 +4,39 @@
 
 # --- 导入所需库 ---
 import os
-import base64
+import contextvars
+import json
+import queue
+import threading
 import pandas as pd
-from flask import Flask, request, jsonify, render_template, send_from_directory, abort
+from flask import Flask, Response, request, jsonify, render_template, send_file, send_from_directory, abort, g, url_for
 from flask_cors import CORS
-from openai import OpenAI
 from typing import Dict # <--- 就是增加了这一行！
 import logging
 import random
 import uuid
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from datetime import datetime
 from sampler import ModelSampler
+from leaderboard import LeaderboardEngine
+from providers import ProviderRegistry, ProviderUnavailableError, TokenBucket
+from evaluation_cache import EvaluationCache
+from image_payload import ImagePayloadCache
+from image_variants import (ImageVariantStore, negotiate_format, source_version,
+                            IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL)
+from record_store import RecordStore
+from catalogue import ArtworkIndex, CatalogueWatcher, public_record, load_snapshot, save_snapshot
+from prefetch import PrefetchManager
+from tiles import TileStore
+from search import SearchIndex, FACET_FIELDS, SEARCH_FIELDS, SUGGEST_FIELDS
+from metrics import REGISTRY, span, begin_request, request_spans, server_timing_header
 
 # --- V6 更新: 使用绝对路径，让服务更健壮 ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# 数据目录（目录文件、图片、投票记录和各类缓存），可用环境变量 ARENA_DATA_DIR 覆盖，例如压测时指向合成数据
+DATA_DIR = os.environ.get("ARENA_DATA_DIR", BASE_DIR)
 
 # --- Flask 应用和配置 ---
 app = Flask(__name__,
@@ -35,21 +54,125 @@ BASE_URL = "https://www.dmxapi.cn/v1"
 OPENROUTER_API_KEY = "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"
 OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 
-# --- 创建两个不同的客户端 ---
+# --- 各接入点的连接池与限流配置（由 ProviderRegistry 统一创建客户端） ---
+PROVIDER_CONFIG = {
+    # 原有的API
+    "dmxapi": {
+        "api_key": API_KEY, "base_url": BASE_URL,
+        "max_connections": 64, "requests_per_second": 10, "burst": 20,
+    },
+    # OpenRouter
+    "openrouter": {
+        "api_key": OPENROUTER_API_KEY, "base_url": OPENROUTER_BASE_URL,
+        "max_connections": 64, "requests_per_second": 20, "burst": 40,
+    },
+    # 混元
+    "hunyuan": {
+        "api_key": "sk-NMJW1J9COjwZwqOUJMWmHPhcelm55W0XrmzNsiPKE5LgQOEa",  # 混元 APIKey
+        "base_url": "https://api.hunyuan.cloud.tencent.com/v1",  # 混元 endpoint
+        "max_connections": 16, "requests_per_second": 2, "burst": 5,
+    },
+}
+# 压测时用 ARENA_PROVIDER_BASE_URL 把所有接入点指向本地模拟服务（见 loadtest.py），
+# ARENA_PROVIDER_UNLIMITED=1 时同时取消限流，以测量服务端自身的上限
+if os.environ.get("ARENA_PROVIDER_BASE_URL"):
+    for options in PROVIDER_CONFIG.values():
+        options["base_url"] = os.environ["ARENA_PROVIDER_BASE_URL"]
+if os.environ.get("ARENA_PROVIDER_UNLIMITED") == "1":
+    for options in PROVIDER_CONFIG.values():
+        options.pop("requests_per_second", None)
+# 熔断器：最近 BREAKER_WINDOW 次调用中错误率达到阈值后停用该模型 BREAKER_COOLDOWN 秒
+# （可在 MODEL_CONFIG 中用 "breaker_threshold" 等键按模型覆盖）
+BREAKER_WINDOW = 20
+BREAKER_THRESHOLD = 0.5
+BREAKER_MIN_CALLS = 5
+BREAKER_COOLDOWN = 60
+
+providers = ProviderRegistry(PROVIDER_CONFIG, BREAKER_WINDOW, BREAKER_THRESHOLD, BREAKER_MIN_CALLS, BREAKER_COOLDOWN)
 # 原有的客户端
-original_client = OpenAI(api_key=API_KEY, base_url=BASE_URL)
+original_client = providers.client("dmxapi")
 # OpenRouter客户端
-openrouter_client = OpenAI(api_key=OPENROUTER_API_KEY, base_url=OPENROUTER_BASE_URL)
-tengxun_client = OpenAI(
-    api_key="sk-NMJW1J9COjwZwqOUJMWmHPhcelm55W0XrmzNsiPKE5LgQOEa",  # 混元 APIKey
-    base_url="https://api.hunyuan.cloud.tencent.com/v1", # 混元 endpoint
-)
-DATA_FILE_PATH = os.path.join(BASE_DIR, "中国博物馆书画数据目录.xlsx")
-IMAGE_DIRECTORY = os.path.join(BASE_DIR, "images")
-RATINGS_FILE_PATH = os.path.join(BASE_DIR, "ratings.csv")
-FEEDBACK_FILE_PATH = os.path.join(BASE_DIR, "feedback.csv") # <-- 新增：独立的反馈文件路径
-
-ERROR_REPORT_FILE_PATH = os.path.join(BASE_DIR, "error_reports.csv") # 报错反馈
+openrouter_client = providers.client("openrouter")
+tengxun_client = providers.client("hunyuan")
+DATA_FILE_PATH = os.path.join(DATA_DIR, "中国博物馆书画数据目录.xlsx")
+CATALOGUE_SNAPSHOT_PATH = os.path.join(DATA_DIR, "catalogue_snapshot.feather")  # 清洗后目录的列式快照
+SEARCH_SNAPSHOT_PATH = os.path.join(DATA_DIR, "search_index.npz")                # 检索倒排表快照
+IMAGE_DIRECTORY = os.path.join(DATA_DIR, "images")
+RATINGS_FILE_PATH = os.path.join(DATA_DIR, "ratings.csv")
+FEEDBACK_FILE_PATH = os.path.join(DATA_DIR, "feedback.csv") # <-- 新增：独立的反馈文件路径
+
+ERROR_REPORT_FILE_PATH = os.path.join(DATA_DIR, "error_reports.csv") # 报错反馈
+RECORDS_DB_PATH = os.path.join(DATA_DIR, "records.db")  # 投票/反馈/错误报告的持久化存储，上面三个CSV会在首次启动时导入
+
+# --- 并发评价配置 ---
+EVALUATION_MAX_WORKERS = 16    # 所有请求共享的模型调用线程数上限
+DEFAULT_MODEL_TIMEOUT = 180    # 单个模型的默认超时（秒），可在 MODEL_CONFIG 中用 "timeout" 覆盖
+
+# --- 评价结果缓存配置 ---
+EVALUATION_CACHE_PATH = os.path.join(DATA_DIR, "evaluation_cache.db")
+EVALUATION_CACHE_SAMPLES_PER_KEY = 3            # 每个 (模型, 作品, 模式, 提示词) 保留的不同样本数，0 表示关闭缓存
+EVALUATION_CACHE_MAX_BYTES = 1024 * 1024 * 1024  # 缓存总大小上限，超出后按最近访问时间淘汰
+
+# --- 图片负载配置：发送给模型前按长边上限缩放并重新压缩 ---
+IMAGE_CACHE_DIRECTORY = os.path.join(DATA_DIR, "image_cache")
+DEFAULT_IMAGE_MAX_SIDE = 2048   # 默认长边上限（像素），可在 MODEL_CONFIG 中用 "max_image_side" 按模型覆盖
+PROVIDER_IMAGE_MAX_SIDE = {     # 按 MODEL_CONFIG 中的 "provider" 设置的长边上限
+    "Claude": 1568,
+}
+# --- 页面图片派生图配置：画廊和详情页按宽度档位请求缩略图，格式按 Accept 头协商（WebP / JPEG） ---
+IMAGE_VARIANT_DIRECTORY = os.path.join(IMAGE_CACHE_DIRECTORY, "variants")
+IMAGE_VARIANT_WIDTHS = (320, 640, 1280, 1920)
+GALLERY_IMAGE_WIDTH = 640      # 画廊卡片默认使用的宽度（2x 屏幕下约 320px 宽的卡片）
+DETAIL_IMAGE_WIDTH = 1280      # 详情页默认使用的宽度
+# --- 深度缩放瓦片配置：超大手卷/册页在详情页按需加载可见区域的瓦片（可用 tiles.py 预先生成） ---
+TILE_DIRECTORY = os.path.join(DATA_DIR, "tiles")
+TILE_SIZE = 256                # 瓦片边长（256 或 512）
+TILE_OVERLAP = 1
+TILE_FORMAT = "jpeg"
+TILE_MIN_SIDE = 4096           # 长边小于该值的图片直接显示派生图，不使用瓦片
+MODE_NAMED = "named"
+MODE_ANONYMOUS = "anonymous"
+
+CATALOGUE_CHECK_INTERVAL = 30  # 每隔多少秒检查一次目录文件是否被修改
+ERA_GROUPS = ['唐前', '宋元', '明', '清', '近现代']
+GALLERY_PAGE_SIZE = 20         # 画廊分页接口的默认每页条数
+GALLERY_MAX_PAGE_SIZE = 100
+SEARCH_PAGE_SIZE = 20          # 检索结果每页条数
+SEARCH_MAX_PAGE_SIZE = 100
+SEARCH_FACET_LIMIT = 20        # 每个分面字段最多返回的取值数
+SUGGEST_MAX_LIMIT = 50
+
+# --- 抽样器延迟感知配置 ---
+SAMPLER_LATENCY_BUDGET = 90          # 单场对战的耗时预算（秒），预期耗时超出的模型对降权；None 表示不考虑延迟
+SAMPLER_MIN_EXPLORATION = 0.2        # 降权后至少保留原抽样权重的比例
+# 多 worker 部署（如 gunicorn -w N）时，各进程通过共享内存共用同一份对战统计；需要记录存储可用
+SAMPLER_SHARED_STATS = False
+# 这些错误发生在请求发往上游之前或由客户端主动取消，不计入模型的失败率
+NON_MODEL_ERROR_TYPES = {"circuit_open", "rate_limited", "unavailable", "cancelled"}
+
+# --- 预取配置：预先抽取模型对并在后台开始生成 ---
+# 每张票据都会产生两次付费的模型调用。推荐由前端在用户表现出评价意图（停留一段时间、鼠标移到评价按钮等）
+# 后调用 POST /api/artwork/prefetch；详情页渲染时直接签发（爬虫和刷新也会触发）默认关闭。
+PREFETCH_ON_DETAIL_PAGE = False      # 为 True 时详情页渲染即签发预取票据（可用 ?prefetch=0 跳过）
+PREFETCH_DETAIL_MODE = "named"       # 详情页预取使用的评价模式
+PREFETCH_TTL = 90                    # 票据有效期（秒），过期未认领的生成会被取消
+PREFETCH_MAX_INFLIGHT = 4            # 同时进行中的预取对战数上限（每场占用两个评价线程）
+PREFETCH_MAX_PER_HOUR = 120          # 每小时最多签发的预取票据数，限制未被认领的生成带来的总开销
+BATTLE_MODE_MEMORY = 10000           # 记住最近签发的多少场对战（evaluation_id → 作品、模型对、评价模式），投票时据此确定 mode
+
+# --- 排行榜配置 ---
+LEADERBOARD_BOOTSTRAP_ROUNDS = 200   # bootstrap 轮数，0 表示不计算置信区间
+LEADERBOARD_REFIT_MIN_VOTES = 50     # 累计多少张新投票后重新完整拟合
+LEADERBOARD_REFIT_INTERVAL = 300     # 有新投票时，最多间隔多少秒重新完整拟合
+
+# --- 指标配置：/metrics 以 Prometheus 文本格式导出 ---
+METRICS_SERVER_TIMING = False        # 为 True 时在每个响应中附带 Server-Timing 头（各阶段耗时汇总）
+MODEL_LATENCY = REGISTRY.histogram("arena_model_latency_seconds", "模型调用总耗时（秒）", ("model", "stream"))
+MODEL_FIRST_TOKEN = REGISTRY.histogram("arena_model_first_token_seconds", "流式调用首个 token 的到达时间（秒）", ("model",))
+MODEL_TOKENS = REGISTRY.counter("arena_model_tokens_total", "模型返回的 token 用量", ("model", "kind"))
+MODEL_ERRORS = REGISTRY.counter("arena_model_errors_total", "模型调用失败次数", ("model", "error_type"))
+HTTP_REQUESTS = REGISTRY.counter("arena_http_requests_total", "HTTP 请求数", ("endpoint", "method", "status"))
+HTTP_SECONDS = REGISTRY.histogram("arena_http_request_seconds", "HTTP 请求处理耗时（秒，不含流式响应体）", ("endpoint",))
 
 # --- 数据加载 ---
 def map_era_to_group(era):
@@ -73,22 +196,57 @@ def map_era_to_group(era):
     # 其他不在此分类中
     return '其他'
 
-try:
-    datas = pd.read_excel(DATA_FILE_PATH)
+def load_catalogue():
+    """
+    读取并清洗艺术品目录，文件不存在时返回 None。
+    优先使用与 Excel 文件一致的列式快照，只有 Excel 变化后才重新解析。
+    """
+    start = time.perf_counter()
+    if not os.path.exists(DATA_FILE_PATH):
+        print(f"❌ [服务端] 错误: 数据文件 '{DATA_FILE_PATH}' 未找到。")
+        return None
+
+    datas = load_snapshot(DATA_FILE_PATH, CATALOGUE_SNAPSHOT_PATH)
+    if datas is not None:
+        print(f"✅ [服务端] 从快照加载 {len(datas)} 条艺术品数据，耗时 {time.perf_counter() - start:.3f} 秒。")
+        return datas
+
+    datas = save_snapshot(clean_catalogue(pd.read_excel(DATA_FILE_PATH)), DATA_FILE_PATH, CATALOGUE_SNAPSHOT_PATH)
+    print(f"✅ [服务端] 成功加载 {len(datas)} 条艺术品数据，并完成年代分组，耗时 {time.perf_counter() - start:.3f} 秒。")
+    return datas
+
+def clean_catalogue(datas: pd.DataFrame) -> pd.DataFrame:
     datas["path"] = "/images/" + datas["id"] + ".jpg"
-    # --- 新增：应用映射函数，创建新的'era_group'列 ---
-    datas['era_group'] = datas['年代'].apply(map_era_to_group)
-    print(f"✅ [服务端] 成功加载 {len(datas)} 条艺术品数据，并完成年代分组。")
-except FileNotFoundError:
-    print(f"❌ [服务端] 错误: 数据文件 '{DATA_FILE_PATH}' 未找到。")
-    datas = None
-datas.loc[datas["收藏地"].isna(),"收藏地"] = "未记录"
+    # --- 新增：应用映射函数，创建新的'era_group'列（每个不同的年代只映射一次） ---
+    era_groups = {era: map_era_to_group(era) for era in datas['年代'].unique()}
+    datas['era_group'] = datas['年代'].map(era_groups)
+    datas.loc[datas["收藏地"].isna(),"收藏地"] = "未记录"
+
+    datas.loc[datas['材质'].isna(),'材质'] = "未记录"
+    datas.loc[datas['形制'].isna(),'形制'] = "未记录"
+    datas.loc[datas['材料'].isna(),'材料'] = "未记录"
+    datas = datas[~datas["年代"].str.contains("日本|室町|五代|不详")]
+    return datas
 
-datas.loc[datas['材质'].isna(),'材质'] = "未记录"
-datas.loc[datas['形制'].isna(),'形制'] = "未记录"
-datas.loc[datas['材料'].isna(),'材料'] = "未记录"
-datas = datas[~datas["年代"].str.contains("日本|室町|五代|不详")]
+datas = load_catalogue()
+# --- 新增：按作品ID的查找索引，所有路由共享 ---
+artwork_index = ArtworkIndex(datas, IMAGE_DIRECTORY)
+# --- 新增：全文检索与分面索引，目录内容未变时从快照加载 ---
+search_index = SearchIndex.load_or_build(datas, SEARCH_SNAPSHOT_PATH)
 
+def reload_catalogue():
+    """目录文件变化时重新加载数据并替换索引"""
+    global datas, search_index
+    new_datas = load_catalogue()
+    if new_datas is None:
+        return
+    new_search_index = SearchIndex.load_or_build(new_datas, SEARCH_SNAPSHOT_PATH)
+    artwork_index.rebuild(new_datas)
+    search_index = new_search_index
+    datas = new_datas
+    print(f"🔄 [服务端] 艺术品目录已重新加载，共 {len(artwork_index)} 条。")
+
+catalogue_watcher = CatalogueWatcher(DATA_FILE_PATH, reload_catalogue, interval=CATALOGUE_CHECK_INTERVAL)
 
 
 
@@ -193,32 +351,106 @@ MODEL_CONFIG = {
     },
     
 }
+providers.bind(MODEL_CONFIG)
+# --- 新增：投票/反馈/错误报告存储（后台线程批量提交） ---
+try:
+    record_store = RecordStore(RECORDS_DB_PATH)
+    for table, csv_path in (('ratings', RATINGS_FILE_PATH), ('feedback', FEEDBACK_FILE_PATH), ('error_reports', ERROR_REPORT_FILE_PATH)):
+        imported = record_store.import_csv(table, csv_path)
+        if imported:
+            print(f"📥 [服务端] 已将 {csv_path} 中的 {imported} 条记录导入存储。")
+    print("✅ [服务端] 记录存储已就绪。")
+except Exception as e:
+    print(f"❌ [服务端] 初始化记录存储失败，将退回直接写CSV: {e}")
+    record_store = None
+
+def save_record(table: str, record: Dict, csv_path: str):
+    """写入记录存储并等待批次提交；存储不可用时退回追加CSV文件"""
+    with span("record_write"):
+        if record_store is not None:
+            record_store.write(table, record)
+        else:
+            df = pd.DataFrame([record])
+            if os.path.exists(csv_path):
+                # 按已有表头的列追加，旧文件没有的新列（如 mode）不写入，避免列错位
+                df = df.reindex(columns=pd.read_csv(csv_path, nrows=0).columns)
+            df.to_csv(csv_path, mode='a', header=not os.path.exists(csv_path), index=False)
+
 # --- 新增：初始化自适应模型抽样器 ---
 try:
-    model_sampler = ModelSampler(list(MODEL_CONFIG.keys()), RATINGS_FILE_PATH)
+    model_sampler = ModelSampler(list(MODEL_CONFIG.keys()), RATINGS_FILE_PATH, vote_store=record_store,
+                                 unavailable_models=providers.unavailable_models,
+                                 latency_budget=SAMPLER_LATENCY_BUDGET, min_exploration=SAMPLER_MIN_EXPLORATION,
+                                 shared_stats=SAMPLER_SHARED_STATS and record_store is not None)
     print("✅ [服务端] 自适应模型抽样器已成功初始化。")
 except Exception as e:
     print(f"❌ [服务端] 初始化模型抽样器失败: {e}")
     model_sampler = None
 
-
+# --- 新增：Bradley–Terry 排行榜引擎 ---
+leaderboard = LeaderboardEngine(model_sampler.model_list, model_sampler.snapshot_stats,
+                                bootstrap_rounds=LEADERBOARD_BOOTSTRAP_ROUNDS,
+                                refit_min_votes=LEADERBOARD_REFIT_MIN_VOTES,
+                                refit_interval=LEADERBOARD_REFIT_INTERVAL) if model_sampler is not None else None
 
 print(f"✅ [服务端] 已配置模型: {list(MODEL_CONFIG.keys())}")
 
+# --- 新增：评价结果缓存 ---
+try:
+    evaluation_cache = EvaluationCache(EVALUATION_CACHE_PATH, EVALUATION_CACHE_SAMPLES_PER_KEY, EVALUATION_CACHE_MAX_BYTES)
+    print(f"✅ [服务端] 评价缓存已就绪: {evaluation_cache.stats()}")
+except Exception as e:
+    print(f"❌ [服务端] 初始化评价缓存失败: {e}")
+    evaluation_cache = None
+
+# --- 新增：图片负载缓存 ---
+image_payloads = ImagePayloadCache(IMAGE_CACHE_DIRECTORY)
+image_variants = ImageVariantStore(IMAGE_DIRECTORY, IMAGE_VARIANT_DIRECTORY, IMAGE_VARIANT_WIDTHS)
+
+tile_store = TileStore(IMAGE_DIRECTORY, TILE_DIRECTORY, TILE_SIZE, TILE_OVERLAP, TILE_FORMAT, min_side=TILE_MIN_SIDE)
+
+@app.template_global()
+def tile_source_url(artwork):
+    """
+    作品瓦片金字塔的 DZI 描述文件 URL（供 OpenSeadragon 等查看器使用）。
+    图片不够大时返回 None；瓦片包尚未生成时在后台开始生成并返回 None，页面先显示普通图片。
+    """
+    image_file = artwork.get('image_file')
+    if not image_file or not os.path.exists(image_file):
+        return None
+    pack = tile_store.open(artwork['id'], image_file)
+    if pack is None:
+        tile_store.request_build(artwork['id'], image_file)
+        return None
+    return url_for('tile_descriptor', artwork_id=artwork['id'], version=pack.version)
+
+@app.template_global()
+def image_url(artwork, width: int = None) -> str:
+    """
+    作品图片的 URL，带原图版本号（可被浏览器永久缓存）；width 为空时指向原图。
+    模板中用法: <img src="{{ image_url(artwork, 640) }}" srcset="{{ image_srcset(artwork) }}" sizes="...">
+    """
+    image_file = artwork.get('image_file') or os.path.join(IMAGE_DIRECTORY, f"{artwork['id']}.jpg")
+    try:
+        params = {"v": source_version(image_file)}
+    except OSError:
+        return artwork.get('path')
+    if width:
+        params["w"] = image_variants.snap_width(width)
+    return url_for('serve_image', filename=os.path.basename(image_file), **params)
+
+@app.template_global()
+def image_srcset(artwork, widths=IMAGE_VARIANT_WIDTHS) -> str:
+    return ", ".join(f"{image_url(artwork, width)} {width}w" for width in widths)
+
+# --- 新增：共享的有界线程池，对战中的两个模型并发调用 ---
+evaluation_executor = ThreadPoolExecutor(max_workers=EVALUATION_MAX_WORKERS, thread_name_prefix="evaluate")
+
 
 # --- 核心分析逻辑 ---
-def run_art_cot_analysis(model_key: str, artwork_info: pd.Series) -> Dict:
-    model_details = MODEL_CONFIG.get(model_key)
-    local_image_path = os.path.join(IMAGE_DIRECTORY, artwork_info['id'] + ".jpg")
-    
-    if not os.path.exists(local_image_path):
-        return {"error": f"图片文件未找到: {local_image_path}"}
-        
-    base64_image = encode_image_to_base64(local_image_path)
-    client = model_details["client"]
-    model_name = model_details["model_name"]
-    
-    combined_prompt = (
+def build_art_cot_prompt(artwork_info) -> str:
+    """实名评价提示词"""
+    return (
         # ---------- 任务说明 ----------
     # f"你的核心任务是对这件艺术品（已知信息：名称《{artwork_info['名称']}》，作者/出处: {artwork_info['作者']}）进行一次深刻的审美评价，撰写一篇约1000字的艺术评论。"
     "你是一位资深的艺术史学家、艺术批评家和大学学者，拥有对经典艺术（包括绘画、雕塑、建筑、书法等）的卓越洞察力与品味。"
@@ -236,39 +468,110 @@ def run_art_cot_analysis(model_key: str, artwork_info: pd.Series) -> Dict:
         "  6. **对作品的审美价值进行判断**（≈100 字）\n"
         "• 评论重心应放在作品的艺术魅力与审美价值，而非功能、知名度、考古学分析或拍卖价格；所有论点都须与作品的具体元素紧密对应"
     )
-    
-    try:
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=[{"role": "user", "content": [{"type": "text", "text": combined_prompt}, {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}]}],
-        )
-        return {
-            "model_name": model_key,
-            "response": response.choices[0].message.content,
-            "model_info": { "name": model_name, "provider": model_details.get("provider", "Unknown") }
-        }
-    except Exception as e:
-        return {"error": f"模型 {model_name} 在处理时发生错误: {str(e)}"}
+
+
+def run_art_cot_analysis(model_key: str, artwork_info: Dict) -> Dict:
+    return _run_analysis(model_key, artwork_info, build_art_cot_prompt(artwork_info), MODE_NAMED)
 
 # --- 辅助函数 ---
-def encode_image_to_base64(image_path: str) -> str:
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+def find_artwork(artwork_id):
+    with span("catalogue_lookup"):
+        return artwork_index.get(artwork_id)
 
-def run_art_cot_analysis_anonymous(model_key: str, artwork_info: pd.Series) -> Dict:
-    """匿名评价函数，不向模型提供作者和标题信息"""
-    model_details = MODEL_CONFIG.get(model_key)
-    local_image_path = os.path.join(IMAGE_DIRECTORY, artwork_info['id'] + ".jpg")
-    
-    if not os.path.exists(local_image_path):
-        return {"error": f"图片文件未找到: {local_image_path}"}
-        
-    base64_image = encode_image_to_base64(local_image_path)
-    client = model_details["client"]
-    model_name = model_details["model_name"]
-    
+def select_model_pair() -> tuple:
+    with span("sampler_select"):
+        return model_sampler.select_pair()
+
+def random_model_pair() -> tuple:
+    """匿名模式随机抽取模型对；与抽样器一致，跳过熔断中的模型，可用模型不足两个时不过滤"""
+    models = list(MODEL_CONFIG.keys())
+    unavailable = providers.unavailable_models()
+    available = [model for model in models if model not in unavailable]
+    if unavailable and len(available) >= 2:
+        print(f"🚫 [服务端] 匿名对战跳过不可用的模型: {sorted(unavailable)}")
+        models = available
+    return tuple(random.sample(models, 2))
+
+def _record_usage(model_key: str, usage):
+    """累计 response.usage 中的 token 用量（部分兼容接口不返回 usage）"""
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = getattr(usage, kind, None)
+        if value:
+            MODEL_TOKENS.inc(value, model=model_key, kind=kind[:-len("_tokens")])
+
+def _observe_model_call(model_key: str, result: Dict, elapsed: float, stream: bool):
+    error_type = result.get("error_type", "upstream_error") if "error" in result else None
+    if error_type:
+        MODEL_ERRORS.inc(model=model_key, error_type=error_type)
+    else:
+        MODEL_LATENCY.observe(elapsed, model=model_key, stream=str(stream).lower())
+    if model_sampler is not None and error_type not in NON_MODEL_ERROR_TYPES:
+        # 供抽样器估计每个模型对的预期耗时
+        model_sampler.record_latency(model_key, elapsed, success=error_type is None)
+
+def get_image_max_side(model_key: str) -> int:
+    model_details = MODEL_CONFIG.get(model_key, {})
+    provider_default = PROVIDER_IMAGE_MAX_SIDE.get(model_details.get("provider"), DEFAULT_IMAGE_MAX_SIDE)
+    return model_details.get("max_image_side", provider_default)
+
+def get_model_timeout(model_key: str) -> float:
+    return MODEL_CONFIG.get(model_key, {}).get("timeout", DEFAULT_MODEL_TIMEOUT)
+
+# 对战中每个模型调用的截止时刻（time.perf_counter()），由 run_battle 在工作线程的上下文中设置
+_call_deadline = contextvars.ContextVar("call_deadline", default=None)
+
+def _timed_analysis(analysis_fn, model_key: str, artwork_info, deadline: float = None) -> tuple:
+    start = time.perf_counter()
+    if deadline is not None:
+        _call_deadline.set(deadline)
+    result = analysis_fn(model_key, artwork_info)
+    return result, time.perf_counter() - start
+
+def run_battle(analysis_fn, model_keys, artwork_info) -> tuple:
+    """
+    在共享线程池中并发运行一场对战的两个模型调用。
+    每个模型有各自的截止时间，超时的模型单独返回结构化错误，不会拖住另一个模型。
+    截止时间同时传给上游请求的超时，超时的调用会自行结束并释放工作线程，不会占满线程池。
+    返回 (evaluations, timings)，timings 为每个模型的耗时（秒）。
+    """
+    start = time.perf_counter()
+    # 复制当前上下文，使工作线程中的计时 span 也计入本请求的 Server-Timing
+    futures = {key: evaluation_executor.submit(contextvars.copy_context().run, _timed_analysis, analysis_fn, key,
+                                               artwork_info, start + get_model_timeout(key))
+               for key in model_keys}
+    evaluations, timings = {}, {}
+    for key, future in futures.items():
+        timeout = get_model_timeout(key)
+        remaining = timeout - (time.perf_counter() - start)
+        try:
+            evaluations[key], elapsed = future.result(timeout=max(remaining, 0))
+        except FuturesTimeoutError:
+            elapsed = time.perf_counter() - start
+            evaluations[key] = {"error": f"模型 {key} 超过 {timeout} 秒未返回结果", "error_type": "timeout"}
+            print(f"⏱️ [服务端] 模型 {key} 超时（{timeout}s）")
+        timings[key] = round(elapsed, 3)
+    return evaluations, timings
+
+def collect_ticket(ticket) -> tuple:
+    """等待预取票据上的两个生成结束（截止时间从预取开始时算起），返回值与 run_battle 相同。"""
+    evaluations, timings = {}, {}
+    for key in ticket.model_keys:
+        timeout = get_model_timeout(key)
+        result = ticket.wait(key, max(timeout - (time.perf_counter() - ticket.started), 0))
+        if result is None:
+            result = {"error": f"模型 {key} 超过 {timeout} 秒未返回结果", "error_type": "timeout"}
+            print(f"⏱️ [服务端] 模型 {key} 超时（{timeout}s）")
+        evaluations[key] = result
+        timings[key] = round(ticket.elapsed.get(key, time.perf_counter() - ticket.started), 3)
+    ticket.stop_event.set()
+    return evaluations, timings
+
+def build_anonymous_prompt(artwork_info) -> str:
+    """匿名评价提示词，不向模型提供作者和标题信息"""
     # [匿名版] 提示词 - 核心区别在于第一句话，不提供任何已知信息
-    combined_prompt = (
+    return (
         f"你是一位资深的艺术评论家与美学学者，拥有对跨媒介艺术品（包括绘画、雕塑、器物等）的卓越洞察力与品味。"
         # f"你的核心任务是对这件艺术品（已知信息：名称《{artwork_info['名称']}》，作者/出处: {artwork_info['作者']}）进行一次深刻的审美评价，撰写一篇约1000字的艺术评论。"
         f"你的核心任务是对眼前这件【未知来源的匿名艺术品】进行一次纯粹基于视觉的深刻审美评价，撰写一篇约1000字的艺术评论。" # <-- 修改点
@@ -286,81 +589,517 @@ def run_art_cot_analysis_anonymous(model_key: str, artwork_info: pd.Series) -> D
         "   - 综合以上分析，深入探讨这件作品所传达的核心情感与营造的整体氛围。是宁静致远、雄伟壮丽，还是内敛含蓄、华贵典雅？\n"
         "   - 最终阐释作品是如何通过其独特的风格、构成与工艺，共同作用创造出一种超越物象本身的“意境”或艺术感染力的。这是作品的灵魂所在。\n"
     )
-    
+
+
+def run_art_cot_analysis_anonymous(model_key: str, artwork_info: Dict) -> Dict:
+    """匿名评价函数，不向模型提供作者和标题信息"""
+    return _run_analysis(model_key, artwork_info, build_anonymous_prompt(artwork_info), MODE_ANONYMOUS)
+
+def _prepare_request(model_key: str, artwork_info, prompt: str):
+    """读取图片并组装请求消息；图片缺失时返回错误字典。"""
+    local_image_path = artwork_info.get('image_file') or os.path.join(IMAGE_DIRECTORY, artwork_info['id'] + ".jpg")
+    if not os.path.exists(local_image_path):
+        return None, {"error": f"图片文件未找到: {local_image_path}"}
+    with span("image_encode"):
+        payload = image_payloads.get(local_image_path, get_image_max_side(model_key))
+    if payload.encoded_bytes < payload.original_bytes:
+        saved = payload.original_bytes - payload.encoded_bytes
+        print(f"🖼️ [服务端] 作品 {artwork_info['id']} → {model_key}: 图片 {payload.original_bytes // 1024}KB → "
+              f"{payload.encoded_bytes // 1024}KB，节省 {saved // 1024}KB")
+    messages = [{"role": "user", "content": [{"type": "text", "text": prompt}, {"type": "image_url", "image_url": {"url": f"data:{payload.mime_type};base64,{payload.base64}"}}]}]
+    return messages, None
+
+def _build_result(model_key: str, content: str) -> Dict:
+    model_details = MODEL_CONFIG.get(model_key)
+    return {
+        "model_name": model_key,
+        "response": content,
+        "model_info": { "name": model_details["model_name"], "provider": model_details.get("provider", "Unknown") }
+    }
+
+def _run_analysis(model_key: str, artwork_info, prompt: str, mode: str) -> Dict:
+    """先查缓存；未命中时调用模型，相同请求并发到达时只调用一次上游。"""
+    if evaluation_cache is None:
+        return _generate_analysis(model_key, artwork_info, prompt)
+    key = evaluation_cache.make_key(model_key, artwork_info['id'], mode, prompt)
+    return evaluation_cache.get_or_generate(key, lambda: _generate_analysis(model_key, artwork_info, prompt))
+
+def _generate_analysis(model_key: str, artwork_info, prompt: str) -> Dict:
+    model_details = MODEL_CONFIG.get(model_key)
+    model_name = model_details["model_name"]
+    timeout = get_model_timeout(model_key)
+    deadline = _call_deadline.get()
+    if deadline is not None:
+        # 在线程池中排队或等待缓存时已用掉部分时间，上游请求只用剩余的时间
+        timeout = deadline - time.perf_counter()
+        if timeout <= 0:
+            return {"error": f"模型 {model_key} 超过 {get_model_timeout(model_key)} 秒未返回结果", "error_type": "timeout"}
+    messages, error = _prepare_request(model_key, artwork_info, prompt)
+    if error:
+        return error
+
+    start = time.perf_counter()
     try:
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=[{"role": "user", "content": [{"type": "text", "text": combined_prompt}, {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}]}]        )
-        return {
-            "model_name": model_key,
-            "response": response.choices[0].message.content,
-            "model_info": { "name": model_name, "provider": model_details.get("provider", "Unknown") }
-        }
+        with providers.guard(model_key) as client, span("upstream"):
+            if deadline is not None:
+                client = client.with_options(max_retries=0)  # 重试会超出截止时间
+            response = client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                timeout=providers.timeout(model_key, timeout),
+            )
+        _record_usage(model_key, getattr(response, "usage", None))
+        result = _build_result(model_key, response.choices[0].message.content)
+    except ProviderUnavailableError as e:
+        result = {"error": str(e), "error_type": e.error_type}
     except Exception as e:
-        return {"error": f"模型 {model_name} 在处理时发生错误: {str(e)}"}
+        result = {"error": f"模型 {model_name} 在处理时发生错误: {str(e)}"}
+    _observe_model_call(model_key, result, time.perf_counter() - start, stream=False)
+    return result
+
+def _stream_analysis(model_key: str, artwork_info, prompt: str, mode: str, on_delta, stop_event: threading.Event) -> Dict:
+    """
+    以 stream=True 调用模型，每收到一段增量文本就调用 on_delta(text)。
+    stop_event 被置位（客户端断开或已超时）时提前关闭上游连接。
+    命中缓存时一次性推送完整文本。返回与 _run_analysis 相同结构的结果。
+    """
+    cache_key = None
+    if evaluation_cache is not None:
+        cache_key = evaluation_cache.make_key(model_key, artwork_info['id'], mode, prompt)
+        cached = evaluation_cache.lookup(cache_key)
+        if cached is not None:
+            on_delta(cached["response"])
+            return cached
+
+    model_details = MODEL_CONFIG.get(model_key)
+    model_name = model_details["model_name"]
+    messages, error = _prepare_request(model_key, artwork_info, prompt)
+    if error:
+        return error
+
+    start = time.perf_counter()
+    result = None
+    try:
+        with providers.guard(model_key) as client, span("upstream_stream"):
+            stream = client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                timeout=providers.timeout(model_key, get_model_timeout(model_key)),
+                stream=True,
+            )
+            parts = []
+            for chunk in stream:
+                if stop_event.is_set():
+                    if hasattr(stream, "close"):
+                        stream.close()
+                    result = {"error": f"模型 {model_name} 的流式输出已被取消", "error_type": "cancelled"}
+                    break
+                _record_usage(model_key, getattr(chunk, "usage", None))
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not parts:
+                        MODEL_FIRST_TOKEN.observe(time.perf_counter() - start, model=model_key)
+                    parts.append(delta)
+                    on_delta(delta)
+        if result is None:
+            result = _build_result(model_key, "".join(parts))
+            if cache_key is not None:
+                evaluation_cache.store(cache_key, result)
+    except ProviderUnavailableError as e:
+        result = {"error": str(e), "error_type": e.error_type}
+    except Exception as e:
+        result = {"error": f"模型 {model_name} 在处理时发生错误: {str(e)}"}
+    _observe_model_call(model_key, result, time.perf_counter() - start, stream=True)
+    return result
+
+def _sse(event: str, payload: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def stream_battle(prompt_builder, mode: str, model_keys, artwork_info, ticket=None):
+    """
+    并发流式调用对战中的两个模型，把增量文本复用到同一个 SSE 流上。
+    传入预取票据时不再发起调用，而是接入票据上进行中或已完成的生成（先回放已生成的内容）。
+
+    事件依次为：
+      start  —— {"slots": ["model_a", "model_b"], "evaluation_id": 服务端签发的对战ID}
+      delta  —— {"slot": "model_a" | "model_b", "text": 增量文本}
+      end    —— {"slot": ..., "elapsed": 秒, "error": 可选}
+      done   —— 与非流式接口相同的 {"evaluations": ..., "timings": ..., "evaluation_id": ...}
+    """
+    slots = dict(zip(model_keys, ("model_a", "model_b")))
+    evaluation_id = issue_battle(artwork_info['id'], model_keys, mode)
+    if ticket is not None:
+        events, stop_event, start = ticket.subscribe(), ticket.stop_event, ticket.started
+    else:
+        prompt = prompt_builder(artwork_info)
+        events = queue.Queue()
+        stop_event = threading.Event()
+        start = time.perf_counter()
+
+        def worker(key):
+            result = _stream_analysis(key, artwork_info, prompt, mode, lambda text: events.put(("delta", key, text)), stop_event)
+            events.put(("end", key, result))
+
+        for key in model_keys:
+            evaluation_executor.submit(worker, key)
+
+    evaluations, timings = {}, {}
+    deadlines = {key: start + get_model_timeout(key) for key in model_keys}
+    try:
+        yield _sse("start", {"slots": list(slots.values()), "evaluation_id": evaluation_id})
+        while len(evaluations) < len(model_keys):
+            pending = [key for key in model_keys if key not in evaluations]
+            wait_for = min(deadlines[key] for key in pending) - time.perf_counter()
+            try:
+                kind, key, payload = events.get(timeout=max(wait_for, 0))
+            except queue.Empty:
+                now = time.perf_counter()
+                for key in pending:
+                    if now >= deadlines[key]:
+                        timeout = get_model_timeout(key)
+                        evaluations[key] = {"error": f"模型 {key} 超过 {timeout} 秒未返回结果", "error_type": "timeout"}
+                        timings[key] = round(now - start, 3)
+                        print(f"⏱️ [服务端] 模型 {key} 超时（{timeout}s）")
+                        yield _sse("end", {"slot": slots[key], "elapsed": timings[key], "error": evaluations[key]["error"]})
+                continue
+            if key in evaluations:
+                continue  # 已超时的模型，丢弃其迟到的输出
+            if kind == "delta":
+                yield _sse("delta", {"slot": slots[key], "text": payload})
+            else:
+                evaluations[key] = payload
+                timings[key] = round(time.perf_counter() - start, 3)
+                end_event = {"slot": slots[key], "elapsed": timings[key]}
+                if "error" in payload:
+                    end_event["error"] = payload["error"]
+                yield _sse("end", end_event)
+        ordered = {key: evaluations[key] for key in model_keys}
+        yield _sse("done", {"evaluations": ordered, "timings": {key: timings[key] for key in model_keys},
+                            "evaluation_id": evaluation_id})
+    finally:
+        # 正常结束、超时或客户端断开时，都通知仍在运行的上游流停止
+        stop_event.set()
+
+PROMPT_BUILDERS = {MODE_NAMED: build_art_cot_prompt, MODE_ANONYMOUS: build_anonymous_prompt}
+
+# --- 新增：每场对战由服务端签发 evaluation_id 并记下作品、模型对和评价模式，投票的 mode 以服务端记录为准 ---
+_issued_battles = OrderedDict()
+_issued_battles_lock = threading.Lock()
+
+def issue_battle(artwork_id, model_keys, mode: str) -> str:
+    """签发一场对战的 evaluation_id，随评价结果返回给前端，投票时原样带回"""
+    evaluation_id = str(uuid.uuid4())
+    with _issued_battles_lock:
+        _issued_battles[evaluation_id] = (str(artwork_id), frozenset(model_keys), mode)
+        while len(_issued_battles) > BATTLE_MODE_MEMORY:
+            _issued_battles.popitem(last=False)
+    return evaluation_id
+
+def vote_mode(data: dict):
+    """
+    投票对应的评价模式：evaluation_id 是服务端签发的对战、且作品和模型对一致时，使用签发时记下的模式，忽略请求中的 mode；
+    找不到签发记录时（旧前端经 /api/evaluation/save 取得的ID，或记录已被淘汰）才退回请求中的 mode，仍无法确定时为 None
+    """
+    with _issued_battles_lock:
+        issued = _issued_battles.get(str(data.get('evaluation_id')))
+    if issued is not None:
+        artwork_id, model_keys, mode = issued
+        if artwork_id == str(data.get('artwork_id')) and model_keys == frozenset((data.get('model_a'), data.get('model_b'))):
+            return mode
+        print(f"⚠️ [服务端] 投票 {data.get('evaluation_id')} 的作品或模型与签发的对战不一致，不采用其评价模式。")
+        return None
+    mode = data.get('mode')
+    return mode if mode in PROMPT_BUILDERS else None
+
+def choose_model_pair(mode: str) -> tuple:
+    """实名模式使用自适应抽样器，匿名模式随机抽取（与评价接口的既有行为一致）"""
+    if mode == MODE_NAMED:
+        return select_model_pair()
+    return random_model_pair()
+
+def _prefetch_generate(model_key: str, artwork_info, mode: str, on_delta, stop_event) -> Dict:
+    return _stream_analysis(model_key, artwork_info, PROMPT_BUILDERS[mode](artwork_info), mode, on_delta, stop_event)
+
+prefetch_budget = TokenBucket(PREFETCH_MAX_PER_HOUR / 3600, burst=PREFETCH_MAX_INFLIGHT)
+prefetch_manager = PrefetchManager(evaluation_executor, _prefetch_generate, ttl=PREFETCH_TTL,
+                                   max_inflight=PREFETCH_MAX_INFLIGHT, budget=prefetch_budget)
+
+def start_prefetch(artwork_info, mode: str):
+    """签发预取票据并开始后台生成；名额已满、超出每小时预算或模型不足时返回 None"""
+    if mode not in PROMPT_BUILDERS or len(MODEL_CONFIG) < 2:
+        return None
+    ticket = prefetch_manager.start(artwork_info, mode, choose_model_pair(mode))
+    if ticket is not None:
+        print(f"🚀 [预取] 作品 {artwork_info['id']} 已预先开始生成 {list(ticket.model_keys)}（{mode}），票据 {ticket.id[:8]}")
+    return ticket
+
+def claim_prefetch(data, artwork_id, mode: str):
+    ticket_id = data.get('ticket') if data else None
+    if not ticket_id:
+        return None
+    ticket = prefetch_manager.claim(ticket_id, artwork_id, mode)
+    if ticket is None:
+        print(f"⚠️ [预取] 票据 {str(ticket_id)[:8]} 无效或已过期，改为现场生成。")
+    return ticket
+
 # ==============================================================================
 # 页面渲染路由 (Page Routes)
 # ==============================================================================
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    begin_request()
+
+@app.before_request
+def check_catalogue_changes():
+    catalogue_watcher.check()
+
+@app.after_request
+def finish_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    if "request_start" in g:
+        HTTP_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    spans = request_spans()
+    if METRICS_SERVER_TIMING and spans:
+        response.headers["Server-Timing"] = server_timing_header(spans)
+    return response
+
+@app.route('/metrics')
+def metrics_api():
+    """Prometheus 文本格式的指标"""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
 @app.route('/')
 def gallery_page():
     if datas is None:
         return "数据文件未加载，无法显示画廊。", 500
 
     # --- 新增：定义筛选分类和获取当前选择 ---
-    era_groups = ['唐前', '宋元', '明', '清', '近现代']
+    era_groups = ERA_GROUPS
     selected_era = request.args.get('era', None)
 
-    # --- 新增：根据选择筛选数据 ---
+    # --- 新增：根据选择从预先分好的年代桶中随机抽取 ---
     if selected_era and selected_era in era_groups:
-        # 如果有合法的筛选条件，则按条件筛选
-        filtered_data = datas[datas['era_group'] == selected_era]
-        # 为防止卡顿，即使筛选后也只显示部分数据，比如最多100条
-        artworks_to_display = filtered_data.sample(10).to_dict('records')
+        artworks_to_display = artwork_index.sample(selected_era, 10)
     else:
-        # 如果没有筛选条件（即显示“全部”），则随机展示20条
-        artworks_to_display = datas.sample(n=min(len(datas), 10)).to_dict('records')
+        # 如果没有筛选条件（即显示“全部”），则从全部作品中随机展示10条
+        artworks_to_display = artwork_index.sample(None, 10)
 
     return render_template('gallery.html', 
                            artworks=artworks_to_display,
                            era_groups=era_groups,        # 把所有分类传给前端
-                           selected_era=selected_era)    # 把当前选中的分类传给前端
+                           selected_era=selected_era,    # 把当前选中的分类传给前端
+                           image_width=GALLERY_IMAGE_WIDTH)  # 卡片图片: image_url(artwork, image_width)
+
+
+@app.route('/api/gallery')
+def gallery_api():
+    """
+    画廊分页接口，供无限滚动使用。
+    参数: era（可选）、limit、cursor（上一页返回的 next_cursor）、seed（首次请求可指定，便于复现顺序）。
+    同一个 seed 下顺序固定，cursor 形如 "<seed>-<offset>"。
+    """
+    if datas is None:
+        return jsonify({"error": "数据文件未加载"}), 500
+    era = request.args.get('era') or None
+    if era is not None and era not in ERA_GROUPS:
+        return jsonify({"error": f"未知的年代分组: {era}"}), 400
+    limit = min(max(request.args.get('limit', GALLERY_PAGE_SIZE, type=int), 1), GALLERY_MAX_PAGE_SIZE)
+
+    cursor = request.args.get('cursor')
+    try:
+        if cursor:
+            seed, offset = (int(part) for part in cursor.split('-', 1))
+        else:
+            seed, offset = request.args.get('seed', type=int), 0
+            if seed is None:
+                seed = random.randrange(1 << 31)
+    except ValueError:
+        return jsonify({"error": "无效的 cursor"}), 400
+
+    artworks = artwork_index.page(era, seed, offset, limit)
+    total = artwork_index.count(era)
+    next_offset = offset + len(artworks)
+    return jsonify({
+        "artworks": [dict(public_record(artwork), thumbnail=image_url(artwork, GALLERY_IMAGE_WIDTH),
+                          srcset=image_srcset(artwork)) for artwork in artworks],
+        "total": total,
+        "seed": seed,
+        "next_cursor": f"{seed}-{next_offset}" if next_offset < total else None,
+    })
+
+
+@app.route('/api/search')
+def search_api():
+    """
+    作品检索接口。
+    参数: q（查询词，按空白和标点切分，各片段都须命中）、field（可多次给出，限定检索字段）、
+    分面筛选（参数名为字段名，如 收藏地=故宫博物院，可多次给出；era 等同于 era_group）、
+    limit、offset、facets=0（不返回分面计数）。
+    """
+    if datas is None:
+        return jsonify({"error": "数据文件未加载"}), 500
+    fields = request.args.getlist('field')
+    unknown = [field for field in fields if field not in SEARCH_FIELDS]
+    if unknown:
+        return jsonify({"error": f"不可检索的字段: {', '.join(unknown)}"}), 400
+    filters = {field: request.args.getlist(field) for field in FACET_FIELDS if request.args.getlist(field)}
+    if request.args.getlist('era'):
+        filters.setdefault('era_group', []).extend(request.args.getlist('era'))
+    limit = min(max(request.args.get('limit', SEARCH_PAGE_SIZE, type=int), 1), SEARCH_MAX_PAGE_SIZE)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    index = search_index  # 目录重新加载时整体替换，本次请求始终使用同一个索引
+    result = index.search(request.args.get('q', ''), filters, fields or None, limit, offset,
+                          SEARCH_FACET_LIMIT if request.args.get('facets', '1') != '0' else 0)
+    artworks = [artwork for artwork in (artwork_index.get(artwork_id) for artwork_id in result.ids) if artwork]
+    next_offset = offset + len(result.ids)
+    return jsonify({
+        "artworks": [dict(public_record(artwork), thumbnail=image_url(artwork, GALLERY_IMAGE_WIDTH),
+                          srcset=image_srcset(artwork)) for artwork in artworks],
+        "total": result.total,
+        "facets": result.facets,
+        "next_offset": next_offset if next_offset < result.total else None,
+        "took_ms": round(result.took_ms, 3),
+    })
+
+
+@app.route('/api/search/suggest')
+def search_suggest_api():
+    """输入框自动补全：返回以 q 开头的 名称/作者/收藏地 等字段取值，按作品数排序。参数: q、field（可选）、limit"""
+    fields = request.args.getlist('field')
+    unknown = [field for field in fields if field not in SUGGEST_FIELDS]
+    if unknown:
+        return jsonify({"error": f"不支持补全的字段: {', '.join(unknown)}"}), 400
+    limit = min(max(request.args.get('limit', 10, type=int), 1), SUGGEST_MAX_LIMIT)
+    start = time.perf_counter()
+    suggestions = search_index.suggest(request.args.get('q', ''), limit, fields or None)
+    return jsonify({"suggestions": suggestions, "took_ms": round((time.perf_counter() - start) * 1000, 3)})
 
 
 @app.route('/artwork/<artwork_id>')
 def artwork_detail_page(artwork_id):
     if datas is None:
         return "数据文件未加载。", 500
-    artwork_data = datas[datas['id'] == artwork_id]
-    if artwork_data.empty:
+    artwork = find_artwork(artwork_id)
+    if artwork is None:
         abort(404)
-    return render_template('artwork_detail.html', artwork=artwork_data.iloc[0].to_dict())
+    # 启用时，用户阅读作品信息的同时后台开始生成，点击评价时凭 prefetch_ticket 直接接入
+    ticket = None
+    if PREFETCH_ON_DETAIL_PAGE and request.args.get('prefetch', '1') != '0':
+        ticket = start_prefetch(artwork, PREFETCH_DETAIL_MODE)
+    return render_template('artwork_detail.html', artwork=artwork, image_width=DETAIL_IMAGE_WIDTH,
+                           tile_source=tile_source_url(artwork),   # 超大图片的 DZI 地址，尚未生成时为 None
+                           prefetch_ticket=ticket.id if ticket else None,
+                           prefetch_mode=ticket.mode if ticket else None)
 
 @app.route('/images/<path:filename>')
 def serve_image(filename):
-    return send_from_directory(IMAGE_DIRECTORY, filename)
+    """
+    原图或派生图（?w=宽度，按档位向上取整，格式按 Accept 头协商）。
+    URL 中的 v 与原图当前版本一致时返回永久缓存头，否则要求浏览器凭 ETag 重新验证。
+    """
+    source_path = image_variants.source_path(filename)
+    if source_path is None:
+        abort(404)
+    variant = None
+    width = request.args.get('w', type=int)
+    if width:
+        with span("image_variant"):
+            variant = image_variants.get(source_path, width, negotiate_format(request.headers.get('Accept')))
+    if variant is not None:
+        response = send_file(variant.path, mimetype=variant.mime_type, etag=variant.etag, conditional=True)
+        response.vary.add('Accept')
+    else:
+        response = send_from_directory(IMAGE_DIRECTORY, filename)
+    immutable = request.args.get('v') == source_version(source_path)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+    return response
+
+def _open_tile_pack(artwork_id, version: str):
+    """打开作品当前版本的瓦片包；URL 中的版本已过期（原图被替换）时返回 None，查看器会重新请求描述文件。"""
+    artwork = find_artwork(artwork_id)
+    if artwork is None or not artwork.get('image_file'):
+        return None
+    pack = tile_store.open(artwork['id'], artwork['image_file'])
+    if pack is None or pack.version != version:
+        return None
+    return pack
+
+@app.route('/tiles/<artwork_id>/<version>.dzi')
+def tile_descriptor(artwork_id, version):
+    """DZI 描述文件；瓦片地址为同目录下的 <version>_files/<层级>/<列>_<行>.<格式>"""
+    pack = _open_tile_pack(artwork_id, version)
+    if pack is None:
+        abort(404)
+    response = Response(pack.descriptor(), mimetype="application/xml")
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+@app.route('/tiles/<artwork_id>/<version>_files/<int:level>/<int:col>_<int:row>.<extension>')
+def tile_image(artwork_id, version, level, col, row, extension):
+    with span("tile_read"):
+        pack = _open_tile_pack(artwork_id, version)
+        data = pack.tile(level, col, row) if pack is not None and extension == pack.extension else None
+    if data is None:
+        abort(404)
+    tile_store.record_served()
+    response = Response(data, mimetype=pack.mime_type)
+    response.set_etag(f"{version}-{level}-{col}-{row}")
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response.make_conditional(request)
+
+@app.route('/api/artwork/<artwork_id>/tiles')
+def artwork_tiles_api(artwork_id):
+    """瓦片金字塔状态：已生成时返回 DZI 地址；未生成且图片足够大时在后台开始生成"""
+    artwork = find_artwork(artwork_id)
+    if artwork is None:
+        return jsonify({"error": f"ID为 '{artwork_id}' 的艺术品未找到"}), 404
+    dzi = tile_source_url(artwork)
+    return jsonify({"ready": dzi is not None, "dzi": dzi, "tile_size": TILE_SIZE})
 
 # ==============================================================================
 # API 接口路由 (API Routes)
 # ==============================================================================
 
+@app.route('/api/artwork/prefetch', methods=['POST'])
+def prefetch_artwork_api():
+    """为作品签发预取票据（请求体: artwork_id, 可选 mode），名额已满时 ticket 为 null"""
+    data = request.get_json(silent=True) or {}
+    artwork_info = find_artwork(data.get('artwork_id'))
+    if artwork_info is None:
+        return jsonify({"error": f"ID为 '{data.get('artwork_id')}' 的艺术品未找到"}), 404
+    mode = data.get('mode', MODE_NAMED)
+    if mode not in PROMPT_BUILDERS:
+        return jsonify({"error": f"未知的评价模式: {mode}"}), 400
+    ticket = start_prefetch(artwork_info, mode)
+    return jsonify({"ticket": ticket.id if ticket else None, "mode": mode, "ttl": PREFETCH_TTL})
+
 @app.route('/api/artwork/evaluate', methods=['POST'])
 def evaluate_artwork_api():
     data = request.get_json()
     if not data or 'artwork_id' not in data:
         return jsonify({"error": "请求体必须包含 'artwork_id'"}), 400
     artwork_id = data['artwork_id']
-    artwork_info = datas[datas['id'] == artwork_id]
-    if artwork_info.empty:
+    artwork_info = find_artwork(artwork_id)
+    if artwork_info is None:
         return jsonify({"error": f"ID为 '{artwork_id}' 的艺术品未找到"}), 404
     available_models = list(MODEL_CONFIG.keys())
     if len(available_models) < 2:
         return jsonify({"error": "配置的模型少于2个，无法进行比较"}), 500
-    model_keys = model_sampler.select_pair()
-    print(f"🔄 [服务端] 随机选择模型: {model_keys} 对作品《{artwork_info.iloc[0]['名称']}》进行评价")
-    evaluations = {}
-    for key in model_keys:
-        evaluations[key] = run_art_cot_analysis(key, artwork_info.iloc[0])
-    return jsonify({"evaluations": evaluations})
+    ticket = claim_prefetch(data, artwork_id, MODE_NAMED)
+    if ticket is not None:
+        print(f"⚡ [服务端] 使用预取票据 {ticket.id[:8]} 的模型 {list(ticket.model_keys)} 对作品《{artwork_info['名称']}》进行评价")
+        evaluation_id = issue_battle(artwork_id, ticket.model_keys, MODE_NAMED)
+        evaluations, timings = collect_ticket(ticket)
+        return jsonify({"evaluations": evaluations, "timings": timings, "evaluation_id": evaluation_id})
+    model_keys = select_model_pair()
+    print(f"🔄 [服务端] 随机选择模型: {model_keys} 对作品《{artwork_info['名称']}》进行评价")
+    evaluation_id = issue_battle(artwork_id, model_keys, MODE_NAMED)
+    evaluations, timings = run_battle(run_art_cot_analysis, model_keys, artwork_info)
+    return jsonify({"evaluations": evaluations, "timings": timings, "evaluation_id": evaluation_id})
 
 
 @app.route('/api/artwork/evaluate_anonymous', methods=['POST'])
@@ -370,56 +1109,130 @@ def evaluate_artwork_anonymous_api():
     if not data or 'artwork_id' not in data:
         return jsonify({"error": "请求体必须包含 'artwork_id'"}), 400
     artwork_id = data['artwork_id']
-    artwork_info = datas[datas['id'] == artwork_id]
-    if artwork_info.empty:
+    artwork_info = find_artwork(artwork_id)
+    if artwork_info is None:
         return jsonify({"error": f"ID为 '{artwork_id}' 的艺术品未找到"}), 404
     
     available_models = list(MODEL_CONFIG.keys())
     if len(available_models) < 2:
         return jsonify({"error": "配置的模型少于2个，无法进行比较"}), 500
     
-    model_keys = random.sample(available_models, 2)
+    ticket = claim_prefetch(data, artwork_id, MODE_ANONYMOUS)
+    if ticket is not None:
+        print(f"⚡ [服务端] 使用预取票据 {ticket.id[:8]} 对作品 ID: {artwork_id} 进行【匿名】评价")
+        evaluation_id = issue_battle(artwork_id, ticket.model_keys, MODE_ANONYMOUS)
+        evaluations, timings = collect_ticket(ticket)
+        return jsonify({"evaluations": evaluations, "timings": timings, "evaluation_id": evaluation_id})
+
+    model_keys = random_model_pair()
     # 在匿名模式下，我们只打印ID，不泄露名称
     print(f"🔄 [服务端] 随机选择模型: {model_keys} 对作品 ID: {artwork_id} 进行【匿名】评价")
     
-    evaluations = {}
-    for key in model_keys:
-        # 调用新增的匿名分析函数
-        evaluations[key] = run_art_cot_analysis_anonymous(key, artwork_info.iloc[0])
-        
-    return jsonify({"evaluations": evaluations})
+    # 调用新增的匿名分析函数，两个模型并发执行
+    evaluation_id = issue_battle(artwork_id, model_keys, MODE_ANONYMOUS)
+    evaluations, timings = run_battle(run_art_cot_analysis_anonymous, model_keys, artwork_info)
+
+    return jsonify({"evaluations": evaluations, "timings": timings, "evaluation_id": evaluation_id})
+
+
+
+def _stream_response(events):
+    return Response(events, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/artwork/evaluate_stream', methods=['GET', 'POST'])
+def evaluate_artwork_stream_api():
+    """流式实名评价接口（SSE），GET 时通过查询参数 artwork_id 传入作品ID"""
+    data = request.get_json(silent=True) or request.args
+    if not data or 'artwork_id' not in data:
+        return jsonify({"error": "请求体必须包含 'artwork_id'"}), 400
+    artwork_id = data['artwork_id']
+    artwork_info = find_artwork(artwork_id)
+    if artwork_info is None:
+        return jsonify({"error": f"ID为 '{artwork_id}' 的艺术品未找到"}), 404
+    if len(MODEL_CONFIG) < 2:
+        return jsonify({"error": "配置的模型少于2个，无法进行比较"}), 500
+    ticket = claim_prefetch(data, artwork_id, MODE_NAMED)
+    if ticket is not None:
+        print(f"⚡ [服务端] 接入预取票据 {ticket.id[:8]} 的模型 {list(ticket.model_keys)} 进行【流式】评价")
+        return _stream_response(stream_battle(build_art_cot_prompt, MODE_NAMED, ticket.model_keys, artwork_info, ticket))
+    model_keys = select_model_pair()
+    print(f"🔄 [服务端] 随机选择模型: {model_keys} 对作品《{artwork_info['名称']}》进行【流式】评价")
+    return _stream_response(stream_battle(build_art_cot_prompt, MODE_NAMED, model_keys, artwork_info))
 
 
+@app.route('/api/artwork/evaluate_anonymous_stream', methods=['GET', 'POST'])
+def evaluate_artwork_anonymous_stream_api():
+    """流式匿名评价接口（SSE），不提供作品元数据"""
+    data = request.get_json(silent=True) or request.args
+    if not data or 'artwork_id' not in data:
+        return jsonify({"error": "请求体必须包含 'artwork_id'"}), 400
+    artwork_id = data['artwork_id']
+    artwork_info = find_artwork(artwork_id)
+    if artwork_info is None:
+        return jsonify({"error": f"ID为 '{artwork_id}' 的艺术品未找到"}), 404
+    available_models = list(MODEL_CONFIG.keys())
+    if len(available_models) < 2:
+        return jsonify({"error": "配置的模型少于2个，无法进行比较"}), 500
+    ticket = claim_prefetch(data, artwork_id, MODE_ANONYMOUS)
+    if ticket is not None:
+        print(f"⚡ [服务端] 接入预取票据 {ticket.id[:8]} 对作品 ID: {artwork_id} 进行【匿名流式】评价")
+        return _stream_response(stream_battle(build_anonymous_prompt, MODE_ANONYMOUS, ticket.model_keys, artwork_info, ticket))
+    model_keys = random_model_pair()
+    print(f"🔄 [服务端] 随机选择模型: {model_keys} 对作品 ID: {artwork_id} 进行【匿名流式】评价")
+    return _stream_response(stream_battle(build_anonymous_prompt, MODE_ANONYMOUS, model_keys, artwork_info))
+
 
 @app.route('/api/evaluation/save', methods=['POST'])
 def save_evaluation_api():
+    """旧前端使用的ID接口：这里签发的ID没有对应的对战记录，新前端应直接使用评价接口返回的 evaluation_id"""
     evaluation_id = str(uuid.uuid4())
     return jsonify({"evaluation_id": evaluation_id})
 
-@app.route('/api/vote', methods=['POST'])
-def vote_api():
-    data = request.get_json()
+@app.route('/api/leaderboard')
+def leaderboard_api():
+    """Bradley–Terry 排行榜（含 bootstrap 95% 置信区间和在线 Elo 评分），结果缓存，新投票到达后增量刷新"""
+    if leaderboard is None:
+        return jsonify({"error": "排行榜不可用"}), 503
+    return jsonify(leaderboard.snapshot())
+
+def handle_vote(data) -> tuple:
+    """
+    记录一笔投票：写入记录存储，并更新抽样器和排行榜的内存统计。返回 (响应体字典, 状态码)。
+    同步接口直接调用；异步服务 (async_main.py) 在线程池中调用，两边的投票逻辑只有这一份。
+    """
     required_fields = ['evaluation_id', 'winner', 'artwork_id', 'artwork_name', 'model_a', 'model_b', 'response_a', 'response_b']
     if not data or not all(field in data for field in required_fields):
-        return jsonify({"error": "请求体缺少必要字段"}), 400
+        return {"error": "请求体缺少必要字段"}, 400
     rating_record = {
         'timestamp': datetime.now().isoformat(), 'evaluation_id': data['evaluation_id'],
         'artwork_id': data['artwork_id'], 'artwork_name': data['artwork_name'],
         'winner': data['winner'], 'model_a': data['model_a'], 'model_b': data['model_b'],
-        'response_a': data['response_a'], 'response_b': data['response_b']
+        'response_a': data['response_a'], 'response_b': data['response_b'],
+        'mode': vote_mode(data)
     }
     try:
-        df = pd.DataFrame([rating_record])
-        df.to_csv(RATINGS_FILE_PATH, mode='a', header=not os.path.exists(RATINGS_FILE_PATH), index=False)
+        save_record('ratings', rating_record, RATINGS_FILE_PATH)
+        if model_sampler is not None:
+            # 直接更新抽样器的内存统计，无需重新解析整个投票文件
+            model_sampler.record_vote(data['model_a'], data['model_b'], data['winner'], data['evaluation_id'])
+        if leaderboard is not None:
+            leaderboard.record_vote(data['model_a'], data['model_b'], data['winner'])
         print(f"👍 [服务端] 收到并记录一笔新投票 (ID: {data['evaluation_id']})")
         stats = {'model_a': random.randint(5, 20), 'model_b': random.randint(5, 20), 'tie': random.randint(1, 10)}
-        return jsonify({"message": "投票成功", "stats": stats})
+        return {"message": "投票成功", "stats": stats}, 200
     except Exception as e:
         print(f"❌ [服务端] 写入评分文件失败: {e}")
-        return jsonify({"error": "服务器无法保存评分"}), 500
+        return {"error": "服务器无法保存评分"}, 500
+
+@app.route('/api/vote', methods=['POST'])
+def vote_api():
+    body, status = handle_vote(request.get_json(silent=True))
+    return jsonify(body), status
 @app.route('/api/feedback', methods=['POST'])
 def feedback_api():
-    """V7更新: 专门接收和更新反馈到 feedback.csv"""
+    """V7更新: 专门接收和更新反馈（写入记录存储的 feedback 表）"""
     data = request.get_json()
     evaluation_id = data.get('evaluation_id')
     feedback_text = data.get('feedback', '')
@@ -434,12 +1247,11 @@ def feedback_api():
     }
     
     try:
-        df = pd.DataFrame([feedback_record])
-        df.to_csv(FEEDBACK_FILE_PATH, mode='a', header=not os.path.exists(FEEDBACK_FILE_PATH), index=False)
-        print(f"👍 [服务端] 反馈已记录到 feedback.csv (ID: {evaluation_id})")
+        save_record('feedback', feedback_record, FEEDBACK_FILE_PATH)
+        print(f"👍 [服务端] 反馈已记录 (ID: {evaluation_id})")
         return jsonify({"message": "Feedback saved successfully"})
     except Exception as e:
-        print(f"❌ [服务端] 写入反馈文件 feedback.csv 失败: {e}")
+        print(f"❌ [服务端] 写入反馈失败: {e}")
         return jsonify({"error": "Failed to save feedback"}), 500
 @app.route('/api/error-report', methods=['POST'])
 def error_report_api():
@@ -462,8 +1274,7 @@ def error_report_api():
     }
     
     try:
-        df = pd.DataFrame([error_report_record])
-        df.to_csv(ERROR_REPORT_FILE_PATH, mode='a', header=not os.path.exists(ERROR_REPORT_FILE_PATH), index=False)
+        save_record('error_reports', error_report_record, ERROR_REPORT_FILE_PATH)
         print(f"⚠️ [服务端] 错误报告已记录 (ID: {evaluation_id}, IP: {user_ip})")
         return jsonify({"message": "Error report saved successfully"})
     except Exception as e:
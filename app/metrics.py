@@ -0,0 +1,157 @@
+# ==============================================================================
+# 文件: metrics.py
+# 描述: 轻量级指标采集（计数器、直方图、计时 span），以 Prometheus 文本格式导出，
+#       并可把单个请求内的各段耗时汇总为 Server-Timing 响应头
+# ==============================================================================
+
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# 默认的耗时分桶（秒），覆盖从毫秒级的本地操作到数分钟的模型生成
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# 当前请求的 span 收集器；跨线程时需用 contextvars.copy_context() 传递
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # 标签值 -> [各桶计数, 总和, 总数]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{float(bound)!r}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表；同名指标只创建一次，render() 输出所有指标的文本格式。"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+SPAN_SECONDS = REGISTRY.histogram("arena_span_seconds", "热路径各阶段耗时（秒）", ("span",))
+
+
+@contextmanager
+def span(name: str):
+    """
+    计时一个代码段：耗时计入 arena_span_seconds{span=name}，
+    若当前处于 begin_request() 开启的请求中，同时记入该请求的 Server-Timing 汇总。
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        SPAN_SECONDS.observe(elapsed, span=name)
+        spans = _request_spans.get()
+        if spans is not None:
+            with spans[0]:
+                spans[1].append((name, elapsed))
+
+
+def begin_request():
+    """为当前请求开启 span 收集。"""
+    _request_spans.set((threading.Lock(), []))
+
+
+def request_spans() -> list:
+    """当前请求已完成的 span 列表 [(名称, 秒)]。"""
+    spans = _request_spans.get()
+    if spans is None:
+        return []
+    with spans[0]:
+        return list(spans[1])
+
+
+def server_timing_header(spans: list) -> str:
+    """按名称汇总 span 耗时，生成 Server-Timing 头（时长单位为毫秒）。"""
+    totals, counts = {}, {}
+    for name, elapsed in spans:
+        totals[name] = totals.get(name, 0.0) + elapsed
+        counts[name] = counts.get(name, 0) + 1
+    return ", ".join(f'{name};dur={totals[name] * 1000:.1f};desc="x{counts[name]}"' for name in totals)
@@ -0,0 +1,177 @@
+# ==============================================================================
+# 文件: prefetch.py
+# 描述: 作品详情页打开时预先抽取对战模型对并在后台开始生成，结果挂在一张短时有效的票据上；
+#       评价接口凭票据接入进行中或已完成的结果，过期未认领的生成会被取消
+# ==============================================================================
+
+import queue
+import threading
+import time
+import uuid
+
+
+class PrefetchTicket:
+    """
+    一次预取的对战：两个模型的生成在后台进行，增量文本和最终结果都缓存在票据上，
+    认领方可以随时订阅，先收到已生成的全部内容，再继续收到后续增量。
+    """
+
+    def __init__(self, artwork_id: str, mode: str, model_keys: tuple):
+        self.id = uuid.uuid4().hex
+        self.artwork_id = str(artwork_id)
+        self.mode = mode
+        self.model_keys = tuple(model_keys)
+        self.created = time.monotonic()
+        self.started = time.perf_counter()   # 与 run_battle / stream_battle 的计时基准一致
+        self.stop_event = threading.Event()
+        self.futures = []
+        self.parts = {key: [] for key in self.model_keys}
+        self.results = {}
+        self.elapsed = {}
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+
+    def append(self, model_key: str, text: str):
+        with self._lock:
+            self.parts[model_key].append(text)
+            for events in self._subscribers:
+                events.put(("delta", model_key, text))
+
+    def finish(self, model_key: str, result: dict):
+        with self._lock:
+            self.results[model_key] = result
+            self.elapsed[model_key] = time.perf_counter() - self.started
+            for events in self._subscribers:
+                events.put(("end", model_key, result))
+            self._done.notify_all()
+
+    @property
+    def finished(self) -> bool:
+        with self._lock:
+            return len(self.results) == len(self.model_keys)
+
+    def subscribe(self) -> queue.Queue:
+        """返回一个事件队列：先回放已有的增量和结果，之后实时推送，事件格式与 stream_battle 内部一致。"""
+        events = queue.Queue()
+        with self._lock:
+            for key in self.model_keys:
+                if self.parts[key]:
+                    events.put(("delta", key, "".join(self.parts[key])))
+                if key in self.results:
+                    events.put(("end", key, self.results[key]))
+            self._subscribers.append(events)
+        return events
+
+    def wait(self, model_key: str, timeout: float):
+        """等待某个模型的最终结果，超时返回 None。"""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while model_key not in self.results:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._done.wait(remaining)
+            return self.results[model_key]
+
+
+class PrefetchManager:
+    """
+    预取票据管理。
+
+    - 同时进行中的预取不超过 max_inflight 场，超出时不再预取（页面退回点击后再生成）。
+      名额在两个模型的生成都结束后才释放，因此过期但仍在收尾的生成同样占用名额。
+    - 可选的 budget（令牌桶）限制预取的总量：有并发名额时才取令牌，名额已满的请求不消耗预算。
+    - 票据签发后 ttl 秒内未被认领即过期：通知流式生成停止，尚未开始的任务直接取消。
+    - 票据只能认领一次，且作品和模式必须与签发时一致。
+    """
+
+    def __init__(self, executor, generate, ttl: float = 90.0, max_inflight: int = 4, budget=None):
+        """
+        Args:
+            executor: 执行生成任务的线程池。
+            generate: generate(model_key, artwork_info, mode, on_delta, stop_event) -> 结果字典。
+            budget: 可选的 TokenBucket，每签发一张票据取一个令牌，取不到时不预取。
+        """
+        self.executor = executor
+        self.generate = generate
+        self.ttl = ttl
+        self.max_inflight = max_inflight
+        self.budget = budget
+        self._tickets = {}
+        self._inflight = 0
+        self._lock = threading.Lock()
+        self.stats_counters = {"issued": 0, "claimed": 0, "expired": 0, "rejected": 0, "over_budget": 0}
+        threading.Thread(target=self._reap_loop, name="prefetch-reaper", daemon=True).start()
+
+    def start(self, artwork_info: dict, mode: str, model_keys: tuple):
+        """为作品签发预取票据并开始后台生成；并发名额已满或预算用尽时返回 None。"""
+        self._reap()
+        with self._lock:
+            if self._inflight >= self.max_inflight:
+                self.stats_counters["rejected"] += 1
+                return None
+            if self.budget is not None and not self.budget.acquire(timeout=0):
+                self.stats_counters["over_budget"] += 1
+                return None
+            self._inflight += 1
+            ticket = PrefetchTicket(artwork_info['id'], mode, model_keys)
+            self._tickets[ticket.id] = ticket
+            self.stats_counters["issued"] += 1
+        futures = [self.executor.submit(self._run, ticket, key, artwork_info) for key in ticket.model_keys]
+        remaining = [len(futures)]
+
+        def release(_):
+            with self._lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    self._inflight -= 1
+
+        ticket.futures.extend(futures)
+        for future in futures:
+            future.add_done_callback(release)
+        return ticket
+
+    def _run(self, ticket: PrefetchTicket, model_key: str, artwork_info: dict):
+        if ticket.stop_event.is_set():
+            result = {"error": f"模型 {model_key} 的预取已被取消", "error_type": "cancelled"}
+        else:
+            try:
+                result = self.generate(model_key, artwork_info, ticket.mode,
+                                       lambda text: ticket.append(model_key, text), ticket.stop_event)
+            except Exception as e:
+                result = {"error": f"模型 {model_key} 预取时发生错误: {e}"}
+        ticket.finish(model_key, result)
+
+    def claim(self, ticket_id: str, artwork_id: str, mode: str):
+        """认领票据；票据不存在、已过期、已被认领或与请求不匹配时返回 None。"""
+        self._reap()
+        with self._lock:
+            ticket = self._tickets.get(ticket_id)
+            if ticket is None or ticket.artwork_id != str(artwork_id) or ticket.mode != mode:
+                return None
+            del self._tickets[ticket_id]
+            self.stats_counters["claimed"] += 1
+            return ticket
+
+    def _reap(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [ticket for ticket in self._tickets.values() if now - ticket.created > self.ttl]
+            for ticket in expired:
+                del self._tickets[ticket.id]
+            self.stats_counters["expired"] += len(expired)
+        for ticket in expired:
+            ticket.stop_event.set()
+            for future in ticket.futures:
+                future.cancel()
+            print(f"🗑️ [预取] 票据 {ticket.id[:8]}（作品 {ticket.artwork_id}）超过 {self.ttl:g} 秒未认领，已取消。")
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(max(self.ttl / 3, 1.0))
+            self._reap()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats_counters, pending=len(self._tickets), inflight=self._inflight)
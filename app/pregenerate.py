@@ -0,0 +1,242 @@
+# ==============================================================================
+# 文件: pregenerate.py
+# 描述: 离线批量预生成 (作品 × 模型 × 模式) 的评价，写入服务端共用的评价缓存，
+#       访客请求时直接命中缓存，新模型上线前也可以先预热
+# 用法: python pregenerate.py [--era 宋元 明] [--models o3 ...] [--modes named anonymous]
+#                            [--provider-limit dmxapi=8] [--checkpoint pregenerate.checkpoint.jsonl]
+# ==============================================================================
+
+import argparse
+import importlib.util
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MAIN_PATH = os.path.join(BASE_DIR, "main (3).py")
+DEFAULT_CHECKPOINT_PATH = os.path.join(BASE_DIR, "pregenerate.checkpoint.jsonl")
+DEFAULT_PROVIDER_CONCURRENCY = 4
+PROGRESS_INTERVAL = 10  # 每隔多少秒打印一次吞吐量和预计剩余时间
+
+
+def load_server(main_path: str):
+    """按文件路径导入服务端模块（不会启动 Flask），复用其中的目录、模型配置、提示词和评价缓存。"""
+    spec = importlib.util.spec_from_file_location("arena_server", main_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Checkpoint:
+    """
+    追加写入的进度文件，每完成一个任务写一行 JSON。
+    任务键包含提示词哈希，提示词修改后旧进度自动失效；失败的任务下次运行会重试。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # 上次中断时写了一半的行
+                    if entry.get("status") == "done":
+                        self.done.add(tuple(entry["key"]))
+        self._file = open(path, "a", encoding="utf-8")
+
+    def record(self, key: tuple, status: str, **extra):
+        with self._lock:
+            if status == "done":
+                self.done.add(key)
+            self._file.write(json.dumps({"key": list(key), "status": status, "time": time.time(), **extra},
+                                        ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class Progress:
+    """线程安全的进度统计，定期打印吞吐量和预计剩余时间。"""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.completed = 0
+        self.failed = 0
+        self.generated = 0
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._last_print = 0.0
+
+    def update(self, ok: bool, generated: int):
+        with self._lock:
+            self.completed += 1
+            self.failed += 0 if ok else 1
+            self.generated += generated
+            now = time.perf_counter()
+            if now - self._last_print >= PROGRESS_INTERVAL or self.completed == self.total:
+                self._last_print = now
+                self._print(now)
+
+    def _print(self, now: float):
+        elapsed = now - self.start
+        rate = self.completed / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.completed) / rate if rate > 0 else float("inf")
+        print(f"⏳ [预生成] {self.completed}/{self.total} 个任务（失败 {self.failed}），新样本 {self.generated} 份，"
+              f"{rate * 60:.1f} 任务/分钟，已用 {elapsed / 60:.1f} 分钟，预计剩余 {eta / 60:.1f} 分钟")
+
+
+class Pregenerator:
+    """
+    预生成任务调度器。
+
+    - 每个上游接入点（ProviderRegistry 中的 endpoint，而不是模型配置里的品牌名）一个线程池，
+      池大小即该接入点的并发上限；共用同一接入点的模型共用一个池，避免触发上游限流。
+    - 每个任务把对应缓存键补足到 samples_per_key 份样本，与服务端的缓存策略一致。
+    - 上游失败时按指数退避（带随机抖动）重试。
+    """
+
+    def __init__(self, server, checkpoint: Checkpoint, provider_limits: dict, retries: int = 4, backoff: float = 2.0):
+        self.server = server
+        self.cache = server.evaluation_cache
+        self.checkpoint = checkpoint
+        self.provider_limits = provider_limits
+        self.retries = retries
+        self.backoff = backoff
+        self.prompt_builders = {
+            server.MODE_NAMED: server.build_art_cot_prompt,
+            server.MODE_ANONYMOUS: server.build_anonymous_prompt,
+        }
+
+    def plan(self, artworks: list, model_keys: list, modes: list) -> list:
+        """列出尚未完成的任务 (作品, 模型, 模式, 提示词, 缓存键)。"""
+        tasks = []
+        for artwork in artworks:
+            if not os.path.exists(artwork['image_file']):
+                continue
+            for mode in modes:
+                prompt = self.prompt_builders[mode](artwork)
+                for model_key in model_keys:
+                    key = self.cache.make_key(model_key, artwork['id'], mode, prompt)
+                    if tuple(key) in self.checkpoint.done:
+                        continue
+                    tasks.append((artwork, model_key, mode, prompt, key))
+        return tasks
+
+    def _generate_with_retry(self, model_key: str, artwork: dict, prompt: str) -> dict:
+        result = None
+        for attempt in range(self.retries + 1):
+            result = self.server._generate_analysis(model_key, artwork, prompt)
+            if "error" not in result:
+                return result
+            if attempt < self.retries:
+                delay = self.backoff * (2 ** attempt) * (0.5 + random.random())
+                print(f"🔁 [预生成] {model_key} / {artwork['id']} 第 {attempt + 1} 次失败，{delay:.1f} 秒后重试: {result['error']}")
+                time.sleep(delay)
+        return result
+
+    def run_task(self, artwork: dict, model_key: str, mode: str, prompt: str, key) -> tuple:
+        """把一个缓存键补足到 samples_per_key 份样本；返回 (是否成功, 新增样本数)。"""
+        generated = 0
+        # 模型可能对同一输入给出完全相同的回答（不会重复写入），限制尝试次数避免死循环
+        attempts = self.cache.samples_per_key * 2
+        while self.cache.sample_count(key) < self.cache.samples_per_key and attempts > 0:
+            attempts -= 1
+            result = self._generate_with_retry(model_key, artwork, prompt)
+            if "error" in result:
+                self.checkpoint.record(tuple(key), "failed", error=result["error"])
+                return False, generated
+            generated += self.cache.store(key, result)
+        self.checkpoint.record(tuple(key), "done", samples=self.cache.sample_count(key))
+        return True, generated
+
+    def run(self, tasks: list):
+        progress = Progress(len(tasks))
+        pools = {}
+        futures = []
+        try:
+            for task in tasks:
+                endpoint = self.server.providers.endpoint_for(task[1])
+                if endpoint not in pools:
+                    limit = self.provider_limits.get(endpoint, DEFAULT_PROVIDER_CONCURRENCY)
+                    pools[endpoint] = ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f"pregen-{endpoint}")
+                futures.append(pools[endpoint].submit(self.run_task, *task))
+            for future in as_completed(futures):
+                try:
+                    ok, generated = future.result()
+                except Exception as e:
+                    print(f"❌ [预生成] 任务异常: {e}")
+                    ok, generated = False, 0
+                progress.update(ok, generated)
+        finally:
+            for pool in pools.values():
+                pool.shutdown(wait=True, cancel_futures=True)
+        return progress
+
+
+def parse_provider_limits(values: list) -> dict:
+    limits = {}
+    for value in values:
+        endpoint, _, limit = value.partition("=")
+        limits[endpoint] = int(limit)
+    return limits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线批量预生成模型评价并写入评价缓存")
+    parser.add_argument("--main", default=DEFAULT_MAIN_PATH, help="服务端主程序路径")
+    parser.add_argument("--era", nargs="+", default=None, help="只处理这些 era_group（默认全部）")
+    parser.add_argument("--models", nargs="+", default=None, help="只处理这些模型（默认 MODEL_CONFIG 中的全部模型）")
+    parser.add_argument("--modes", nargs="+", default=["named", "anonymous"], choices=["named", "anonymous"])
+    parser.add_argument("--limit", type=int, default=None, help="最多处理多少件作品")
+    parser.add_argument("--provider-limit", nargs="*", default=[], metavar="ENDPOINT=N",
+                        help=f"各上游接入点（如 dmxapi、openrouter、hunyuan）的并发上限（默认 {DEFAULT_PROVIDER_CONCURRENCY}）")
+    parser.add_argument("--retries", type=int, default=4)
+    parser.add_argument("--backoff", type=float, default=2.0, help="首次重试前的等待秒数，之后按指数增长")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT_PATH)
+    args = parser.parse_args()
+
+    server = load_server(args.main)
+    provider_limits = parse_provider_limits(args.provider_limit)
+    unknown_endpoints = [endpoint for endpoint in provider_limits if endpoint not in server.providers.endpoints]
+    if unknown_endpoints:
+        print(f"❌ [预生成] 未知的接入点: {unknown_endpoints}，可用: {list(server.providers.endpoints)}")
+        return
+    if server.evaluation_cache is None or not server.evaluation_cache.enabled:
+        print("❌ [预生成] 评价缓存不可用，预生成的结果无处保存。")
+        return
+    model_keys = args.models or list(server.MODEL_CONFIG.keys())
+    unknown = [key for key in model_keys if key not in server.MODEL_CONFIG]
+    if unknown:
+        print(f"❌ [预生成] 未配置的模型: {unknown}")
+        return
+
+    eras = args.era or [None]
+    artworks = [record for era in eras for record in server.artwork_index.page(era, seed=0, limit=len(server.artwork_index))]
+    if args.limit is not None:
+        artworks = artworks[:args.limit]
+
+    checkpoint = Checkpoint(args.checkpoint)
+    try:
+        pregenerator = Pregenerator(server, checkpoint, provider_limits, args.retries, args.backoff)
+        tasks = pregenerator.plan(artworks, model_keys, args.modes)
+        print(f"🚀 [预生成] {len(artworks)} 件作品 × {len(model_keys)} 个模型 × {len(args.modes)} 种模式，"
+              f"待处理 {len(tasks)} 个任务（已完成 {len(checkpoint.done)} 个）")
+        if tasks:
+            progress = pregenerator.run(tasks)
+            print(f"✅ [预生成] 完成 {progress.completed - progress.failed} 个任务，失败 {progress.failed} 个，"
+                  f"新增样本 {progress.generated} 份。缓存状态: {server.evaluation_cache.stats()}")
+    finally:
+        checkpoint.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+# ==============================================================================
+# 文件: providers.py
+# 描述: OpenAI 兼容接口的 provider 层：每个接入点独立的 HTTP 连接池和超时设置、
+#       令牌桶限流，以及按模型统计近期错误率的熔断器（熔断期间快速失败）
+# ==============================================================================
+
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+DEFAULT_CONNECT_TIMEOUT = 10.0   # 建立连接的超时（秒）
+DEFAULT_POOL_TIMEOUT = 10.0      # 等待连接池空闲连接的超时（秒）
+DEFAULT_ACQUIRE_TIMEOUT = 30.0   # 等待限流令牌的最长时间（秒）
+DEFAULT_ASYNC_MAX_CONNECTIONS = 2000  # 异步客户端的连接上限：挂起的请求只占协程，不占线程
+
+
+class ProviderUnavailableError(Exception):
+    """模型熔断中或限流等待超时，请求未发往上游。"""
+
+    def __init__(self, message: str, error_type: str):
+        super().__init__(message)
+        self.error_type = error_type
+
+
+class TokenBucket:
+    """令牌桶限流器：平均每秒 rate 个请求，允许突发 burst 个。rate 为 None 时不限流。"""
+
+    def __init__(self, rate: float = None, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _try_take(self) -> tuple:
+        """尝试取一个令牌，返回 (是否成功, 当前时间, 还需等待的秒数)。"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True, now, 0.0
+            return False, now, (1 - self.tokens) / self.rate
+
+    def acquire(self, timeout: float = None) -> bool:
+        if self.rate is None:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            taken, now, wait = self._try_take()
+            if taken:
+                return True
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    async def acquire_async(self, timeout: float = None) -> bool:
+        """acquire 的协程版本，等待期间不阻塞事件循环。"""
+        if self.rate is None:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            taken, now, wait = self._try_take()
+            if taken:
+                return True
+            if deadline is not None and now + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    熔断器，状态依次为：
+
+    - closed: 正常放行，记录最近 window 次调用的结果；调用数不少于 min_calls 且错误率达到 threshold 时转为 open。
+    - open: 直接拒绝，cooldown 秒后转为 half_open。
+    - half_open: 只放行一个探测请求，成功则恢复 closed，失败则重新 open。
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, window: int = 20, threshold: float = 0.5, min_calls: int = 5, cooldown: float = 60.0):
+        self.window = window
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._results = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probe_inflight = False
+        self._lock = threading.Lock()
+
+    def _refresh_locked(self):
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+            self.state = self.HALF_OPEN
+            self._probe_inflight = False
+
+    def is_open(self) -> bool:
+        """熔断中（不包括可以探测的 half_open 状态）。"""
+        with self._lock:
+            self._refresh_locked()
+            return self.state == self.OPEN
+
+    def allow(self) -> bool:
+        with self._lock:
+            self._refresh_locked()
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probe_inflight:
+                self._probe_inflight = True
+                return True
+            return False
+
+    def release_probe(self):
+        with self._lock:
+            self._probe_inflight = False
+
+    def record(self, success: bool):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe_inflight = False
+                if success:
+                    self.state = self.CLOSED
+                    self._results.clear()
+                else:
+                    self._open_locked()
+                return
+            self._results.append(success)
+            failures = self._results.count(False)
+            if len(self._results) >= self.min_calls and failures / len(self._results) >= self.threshold:
+                self._open_locked()
+
+    def _open_locked(self):
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._results.clear()
+
+    def error_rate(self) -> float:
+        with self._lock:
+            return self._results.count(False) / len(self._results) if self._results else 0.0
+
+
+class ProviderRegistry:
+    """
+    按接入点（endpoint）管理客户端和限流器，按模型管理熔断器。
+
+    endpoints 的每一项形如：
+        {"api_key": ..., "base_url": ..., "max_connections": 32, "max_keepalive": 16,
+         "requests_per_second": 10, "burst": 20, "max_retries": 1}
+    创建客户端后调用 bind(MODEL_CONFIG)，按每个模型配置中的 "client" 关联到对应接入点。
+    """
+
+    def __init__(self, endpoints: dict, breaker_window: int = 20, breaker_threshold: float = 0.5,
+                 breaker_min_calls: int = 5, breaker_cooldown: float = 60.0):
+        self.endpoints = endpoints
+        self.breaker_options = dict(window=breaker_window, threshold=breaker_threshold,
+                                    min_calls=breaker_min_calls, cooldown=breaker_cooldown)
+        self._clients = {}
+        self._async_clients = {}
+        self._limiters = {}
+        self._model_endpoints = {}
+        self._breakers = {}
+        for name, options in endpoints.items():
+            self._clients[name] = self._build_client(options)
+            self._limiters[name] = TokenBucket(options.get("requests_per_second"), options.get("burst", 1))
+
+    @staticmethod
+    def _build_client(options: dict) -> OpenAI:
+        max_connections = options.get("max_connections", 32)
+        http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=options.get("max_keepalive", max_connections // 2),
+                                keepalive_expiry=options.get("keepalive_expiry", 60.0)),
+            timeout=httpx.Timeout(options.get("read_timeout", 180.0),
+                                  connect=options.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT),
+                                  pool=options.get("pool_timeout", DEFAULT_POOL_TIMEOUT)),
+        )
+        return OpenAI(api_key=options["api_key"], base_url=options["base_url"],
+                      max_retries=options.get("max_retries", 1), http_client=http_client)
+
+    @staticmethod
+    def _build_async_client(options: dict) -> AsyncOpenAI:
+        max_connections = options.get("async_max_connections", DEFAULT_ASYNC_MAX_CONNECTIONS)
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=options.get("max_keepalive", max_connections // 2),
+                                keepalive_expiry=options.get("keepalive_expiry", 60.0)),
+            timeout=httpx.Timeout(options.get("read_timeout", 180.0),
+                                  connect=options.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT),
+                                  pool=options.get("pool_timeout", DEFAULT_POOL_TIMEOUT)),
+        )
+        return AsyncOpenAI(api_key=options["api_key"], base_url=options["base_url"],
+                           max_retries=options.get("max_retries", 1), http_client=http_client)
+
+    def client(self, name: str) -> OpenAI:
+        return self._clients[name]
+
+    def async_client(self, name: str) -> AsyncOpenAI:
+        """异步客户端在首次使用时创建（需在事件循环所在线程中调用）。"""
+        client = self._async_clients.get(name)
+        if client is None:
+            client = self._async_clients[name] = self._build_async_client(self.endpoints[name])
+        return client
+
+    def endpoint_for(self, model_key: str) -> str:
+        return self._model_endpoints[model_key]
+
+    def bind(self, model_config: dict):
+        endpoint_by_client = {id(client): name for name, client in self._clients.items()}
+        for model_key, model_details in model_config.items():
+            endpoint = endpoint_by_client.get(id(model_details.get("client")))
+            if endpoint is None:
+                raise ValueError(f"模型 {model_key} 的客户端不是由 ProviderRegistry 创建的")
+            self._model_endpoints[model_key] = endpoint
+            options = dict(self.breaker_options)
+            options.update({key[len("breaker_"):]: value for key, value in model_details.items()
+                            if key.startswith("breaker_")})
+            self._breakers[model_key] = CircuitBreaker(**options)
+
+    def timeout(self, model_key: str, seconds: float) -> httpx.Timeout:
+        """单次请求的超时：总读取时间按模型设置，连接和取连接的超时沿用接入点配置。"""
+        options = self.endpoints[self._model_endpoints[model_key]]
+        return httpx.Timeout(seconds, connect=options.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT),
+                             pool=options.get("pool_timeout", DEFAULT_POOL_TIMEOUT))
+
+    @contextmanager
+    def guard(self, model_key: str, acquire_timeout: float = DEFAULT_ACQUIRE_TIMEOUT):
+        """
+        包住一次上游调用：熔断中或等不到限流令牌时抛出 ProviderUnavailableError；
+        with 块内抛出的异常计为一次失败，正常退出计为一次成功。
+        """
+        breaker = self._breakers.get(model_key)
+        endpoint = self._model_endpoints.get(model_key)
+        if breaker is None:
+            raise ProviderUnavailableError(f"模型 {model_key} 未注册到 provider 层", "unavailable")
+        if not breaker.allow():
+            raise ProviderUnavailableError(f"模型 {model_key} 近期错误率过高，暂时停用", "circuit_open")
+        if not self._limiters[endpoint].acquire(acquire_timeout):
+            breaker.release_probe()  # 请求没有真正发出，探测名额留给下一个请求
+            raise ProviderUnavailableError(f"接入点 {endpoint} 请求过多，等待限流超时", "rate_limited")
+        try:
+            yield self._clients[endpoint]
+        except Exception:
+            breaker.record(False)
+            raise
+        breaker.record(True)
+
+    @asynccontextmanager
+    async def async_guard(self, model_key: str, acquire_timeout: float = DEFAULT_ACQUIRE_TIMEOUT):
+        """guard 的异步版本，产出异步客户端；熔断器和限流器与同步调用共享。"""
+        breaker = self._breakers.get(model_key)
+        endpoint = self._model_endpoints.get(model_key)
+        if breaker is None:
+            raise ProviderUnavailableError(f"模型 {model_key} 未注册到 provider 层", "unavailable")
+        if not breaker.allow():
+            raise ProviderUnavailableError(f"模型 {model_key} 近期错误率过高，暂时停用", "circuit_open")
+        if not await self._limiters[endpoint].acquire_async(acquire_timeout):
+            breaker.release_probe()
+            raise ProviderUnavailableError(f"接入点 {endpoint} 请求过多，等待限流超时", "rate_limited")
+        try:
+            yield self.async_client(endpoint)
+        except asyncio.CancelledError:
+            breaker.release_probe()  # 被调用方取消（如超时或客户端断开），不算模型失败
+            raise
+        except Exception:
+            breaker.record(False)
+            raise
+        breaker.record(True)
+
+    def unavailable_models(self) -> set:
+        """熔断中的模型，抽样器据此跳过包含这些模型的对战。"""
+        return {model_key for model_key, breaker in self._breakers.items() if breaker.is_open()}
+
+    def stats(self) -> dict:
+        return {model_key: {"endpoint": self._model_endpoints[model_key], "state": breaker.state,
+                            "error_rate": round(breaker.error_rate(), 3)}
+                for model_key, breaker in self._breakers.items()}
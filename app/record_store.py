@@ -0,0 +1,359 @@
+# ==============================================================================
+# 文件: record_store.py
+# 描述: 投票、反馈和错误报告的持久化存储（SQLite WAL 模式）
+#       请求线程只负责入队，后台写线程把排队的记录合并成一次事务提交（group commit）
+#       投票只保存紧凑记录，回答文本按内容哈希去重、压缩后单独存放
+# 用法: python record_store.py import  [--db records.db] [--dir .]         导入现有CSV
+#       python record_store.py export  [--db records.db] [--dir exports]   导出为CSV
+#       python record_store.py migrate --csv 旧的ratings.csv [--db records.db]
+# ==============================================================================
+
+import argparse
+import hashlib
+import io
+import os
+import queue
+import sqlite3
+import threading
+import zlib
+from concurrent.futures import Future
+
+import pandas as pd
+
+# 各数据流的列，与原来的 ratings.csv / feedback.csv / error_reports.csv 保持一致（ratings 末尾新增评价模式 mode）
+TABLE_COLUMNS = {
+    'ratings': ['timestamp', 'evaluation_id', 'artwork_id', 'artwork_name', 'winner',
+                'model_a', 'model_b', 'response_a', 'response_b', 'mode'],
+    'feedback': ['timestamp', 'evaluation_id', 'feedback'],
+    'error_reports': ['timestamp', 'user_ip', 'evaluation_id', 'artwork_id'],
+}
+CSV_FILE_NAMES = {
+    'ratings': 'ratings.csv',
+    'feedback': 'feedback.csv',
+    'error_reports': 'error_reports.csv',
+}
+# 投票在 votes 表中以紧凑形式保存：名称类字段为 symbols 表中的整数ID，回答为 16 字节内容哈希
+VOTE_SYMBOL_COLUMNS = ('artwork_name', 'winner', 'model_a', 'model_b', 'mode')
+RESPONSE_HASH_BYTES = 16
+
+_STOP = object()
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=FULL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+def response_hash(text) -> bytes:
+    return hashlib.blake2b(("" if text is None else str(text)).encode("utf-8"), digest_size=RESPONSE_HASH_BYTES).digest()
+
+
+class RecordStore:
+    """
+    投票/反馈/错误报告存储。
+
+    submit() 把记录放入内存队列，后台写线程每次取出当前排队的全部记录（至多 batch_size 条），
+    在一个事务里写入并提交，然后唤醒对应的请求。突发投票时，多个请求共享一次磁盘同步，
+    请求延迟不会随并发数线性上升；SQLite 的 WAL 模式也保证多个进程同时写入时数据不会交错或损坏。
+
+    投票写入 votes 表时只保留整数ID和回答的内容哈希，回答全文压缩后存入 responses 表，
+    相同文本（例如缓存命中的回答）只存一份。抽样器和排行榜扫描的只是 votes 表。
+    timestamp、evaluation_id、artwork_id 保留原文：SQLite 的行本身就是变长编码，做不到真正定长；
+    这三列合计约 70 字节，一条投票约 110 字节，而 evaluation_id 要与 feedback / error_reports 按原文关联，
+    timestamp 也要原样还原旧 CSV 中的写法，换成整数编码省下的空间不值得多一层转换。
+    """
+
+    def __init__(self, db_path: str, batch_size: int = 512):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self._local = threading.local()
+        conn = _connect(db_path)
+        with conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS symbols (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE
+                );
+                CREATE TABLE IF NOT EXISTS responses (
+                    hash BLOB PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    body BLOB NOT NULL
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS votes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp TEXT,
+                    evaluation_id TEXT,
+                    artwork_id TEXT,
+                    artwork_name INTEGER,
+                    winner INTEGER,
+                    model_a INTEGER,
+                    model_b INTEGER,
+                    response_a BLOB,
+                    response_b BLOB,
+                    mode INTEGER
+                );
+                -- size 为已导入到的字节位置，rows 为累计导入的行数
+                CREATE TABLE IF NOT EXISTS csv_imports (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, rows INTEGER);
+            """)
+            for table in ('feedback', 'error_reports'):
+                column_sql = ", ".join(f"{column} TEXT" for column in TABLE_COLUMNS[table])
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY AUTOINCREMENT, {column_sql})")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_feedback_evaluation ON feedback (evaluation_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_error_reports_evaluation ON error_reports (evaluation_id)")
+            self._migrate_legacy_ratings(conn)
+            if 'mode' not in [row[1] for row in conn.execute("PRAGMA table_info(votes)")]:
+                conn.execute("ALTER TABLE votes ADD COLUMN mode INTEGER")  # 旧库没有评价模式，已有投票为空
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_votes_evaluation ON votes (evaluation_id)")
+        conn.close()
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="record-store-writer", daemon=True)
+        self._writer.start()
+
+    def _migrate_legacy_ratings(self, conn: sqlite3.Connection):
+        """把旧版（回答全文内联）的 ratings 表转换为紧凑投票记录，原表重命名为 ratings_legacy 备份。"""
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(ratings)")]
+        if 'response_a' not in columns:
+            return
+        select_sql = ', '.join(column if column in columns else 'NULL' for column in TABLE_COLUMNS['ratings'])
+        legacy = conn.execute(f"SELECT {select_sql} FROM ratings ORDER BY id")
+        count = 0
+        while True:
+            rows = legacy.fetchmany(1000)
+            if not rows:
+                break
+            self._insert_rows(conn, 'ratings', rows)
+            count += len(rows)
+        conn.execute("ALTER TABLE ratings RENAME TO ratings_legacy")
+        print(f"📦 [存储] 已将旧版 ratings 表中的 {count} 条投票转换为紧凑格式。")
+
+    # --- 写入 ---
+    def submit(self, table: str, record: dict) -> Future:
+        """把一条记录加入写队列，返回在提交完成后得到行ID的 Future。"""
+        columns = TABLE_COLUMNS[table]
+        future = Future()
+        self._queue.put((table, tuple(record.get(column) for column in columns), future))
+        return future
+
+    def write(self, table: str, record: dict, timeout: float = 10.0) -> int:
+        """写入一条记录，并等待它所在的批次提交到磁盘。"""
+        return self.submit(table, record).result(timeout=timeout)
+
+    def _write_loop(self):
+        conn = _connect(self.db_path)
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self._queue.put(_STOP)
+                    break
+                batch.append(item)
+            self._commit_batch(conn, batch)
+        conn.close()
+
+    def _commit_batch(self, conn: sqlite3.Connection, batch: list):
+        try:
+            row_ids = []
+            with conn:
+                for table, values, _ in batch:
+                    row_ids.append(self._insert_rows(conn, table, [values]))
+        except Exception as e:
+            print(f"❌ [存储] 批量写入 {len(batch)} 条记录失败: {e}")
+            self._local.symbols = None  # 事务已回滚，新分配的符号ID作废
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, _, future), row_id in zip(batch, row_ids):
+            future.set_result(row_id)
+
+    def _insert_rows(self, conn: sqlite3.Connection, table: str, rows) -> int:
+        """在当前事务中插入若干行（按 TABLE_COLUMNS 的列顺序），返回最后一行的行ID。"""
+        if table != 'ratings':
+            columns = TABLE_COLUMNS[table]
+            cursor = conn.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows)
+            return conn.execute("SELECT last_insert_rowid()").fetchone()[0] if cursor.rowcount else None
+
+        last_id = None
+        for row in rows:
+            record = dict(zip(TABLE_COLUMNS['ratings'], row))
+            for column in VOTE_SYMBOL_COLUMNS:
+                record[column] = self._intern(conn, record[column])
+            for column in ('response_a', 'response_b'):
+                record[column] = self._put_response(conn, record[column])
+            cursor = conn.execute(
+                "INSERT INTO votes (timestamp, evaluation_id, artwork_id, artwork_name, winner, model_a, model_b, "
+                "response_a, response_b, mode) VALUES (:timestamp, :evaluation_id, :artwork_id, :artwork_name, :winner, "
+                ":model_a, :model_b, :response_a, :response_b, :mode)", record)
+            last_id = cursor.lastrowid
+        return last_id
+
+    def _intern(self, conn: sqlite3.Connection, name):
+        if name is None:
+            return None
+        name = str(name)
+        symbols = self._symbol_ids()
+        symbol_id = symbols.get(name)
+        if symbol_id is None:
+            conn.execute("INSERT OR IGNORE INTO symbols (name) VALUES (?)", (name,))
+            symbol_id = conn.execute("SELECT id FROM symbols WHERE name=?", (name,)).fetchone()[0]
+            symbols[name] = symbol_id
+        return symbol_id
+
+    def _symbol_ids(self) -> dict:
+        symbols = getattr(self._local, 'symbols', None)
+        if symbols is None:
+            symbols = self._local.symbols = {}
+        return symbols
+
+    @staticmethod
+    def _put_response(conn: sqlite3.Connection, text) -> bytes:
+        digest = response_hash(text)
+        if conn.execute("SELECT 1 FROM responses WHERE hash=?", (digest,)).fetchone() is None:
+            data = ("" if text is None else str(text)).encode("utf-8")
+            conn.execute("INSERT OR IGNORE INTO responses (hash, size, body) VALUES (?, ?, ?)",
+                         (digest, len(data), zlib.compress(data, 6)))
+        return digest
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._writer.join()
+
+    # --- 读取 ---
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = _connect(self.db_path)
+        return conn
+
+    def read_votes_since(self, last_id: int = 0) -> tuple:
+        """
+        读取行ID大于 last_id 的投票（只含抽样器需要的列，不读取任何回答文本）。
+        返回 (DataFrame[evaluation_id, model_a, model_b, winner], 新的 last_id)。
+        """
+        rows = self._reader().execute(
+            "SELECT v.id, v.evaluation_id, a.name, b.name, w.name FROM votes v "
+            "LEFT JOIN symbols a ON a.id = v.model_a LEFT JOIN symbols b ON b.id = v.model_b "
+            "LEFT JOIN symbols w ON w.id = v.winner WHERE v.id > ? ORDER BY v.id", (last_id,)).fetchall()
+        frame = pd.DataFrame(rows, columns=['id', 'evaluation_id', 'model_a', 'model_b', 'winner'])
+        return frame.drop(columns='id'), (rows[-1][0] if rows else last_id)
+
+    def get_response(self, digest: bytes):
+        row = self._reader().execute("SELECT body FROM responses WHERE hash=?", (digest,)).fetchone()
+        return None if row is None else zlib.decompress(row[0]).decode("utf-8")
+
+    def count(self, table: str) -> int:
+        physical = 'votes' if table == 'ratings' else table
+        return self._reader().execute(f"SELECT COUNT(*) FROM {physical}").fetchone()[0]
+
+    def read_table(self, table: str) -> pd.DataFrame:
+        """按原CSV的列读取整张表；ratings 会还原模型名称和回答全文。"""
+        conn = self._reader()
+        if table != 'ratings':
+            columns = TABLE_COLUMNS[table]
+            return pd.read_sql_query(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id", conn)
+
+        frame = pd.read_sql_query(
+            "SELECT v.timestamp, v.evaluation_id, v.artwork_id, n.name AS artwork_name, w.name AS winner, "
+            "a.name AS model_a, b.name AS model_b, v.response_a, v.response_b, m.name AS mode FROM votes v "
+            "LEFT JOIN symbols n ON n.id = v.artwork_name LEFT JOIN symbols w ON w.id = v.winner "
+            "LEFT JOIN symbols a ON a.id = v.model_a LEFT JOIN symbols b ON b.id = v.model_b "
+            "LEFT JOIN symbols m ON m.id = v.mode ORDER BY v.id", conn)
+        texts = {}
+        for column in ('response_a', 'response_b'):
+            for digest in frame[column].unique():
+                if digest is not None and digest not in texts:
+                    texts[digest] = self.get_response(digest)
+            frame[column] = frame[column].map(texts)
+        return frame
+
+    # --- CSV 兼容 ---
+    def import_csv(self, table: str, csv_path: str) -> int:
+        """
+        导入一个现有的CSV文件（ratings 会转换为紧凑投票记录）。
+        csv_imports 记录每个文件已导入到的字节位置：文件变长时（例如存储不可用期间 save_record 退回追加CSV）
+        只导入新增的尾部，未变化时跳过，避免重复启动时重复计票；文件变短说明被截断或替换，给出警告后不导入。
+        返回导入的行数。
+        """
+        if not os.path.exists(csv_path):
+            return 0
+        path = os.path.abspath(csv_path)
+        stat = os.stat(csv_path)
+        conn = self._reader()
+        imported = conn.execute("SELECT size, rows FROM csv_imports WHERE path=?", (path,)).fetchone()
+        offset, imported_rows = imported if imported else (0, 0)
+        if stat.st_size == offset:
+            return 0
+        if stat.st_size < offset:
+            print(f"⚠️ [存储] {csv_path} 比上次导入时变小（{offset} → {stat.st_size} 字节），文件可能被截断或替换，"
+                  f"本次不导入；确认内容后删除 csv_imports 中该路径的记录即可重新导入。")
+            return 0
+        with open(csv_path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        if offset:
+            header = pd.read_csv(csv_path, nrows=0, dtype=str).columns
+            frame = pd.read_csv(io.BytesIO(data), header=None, names=list(header), dtype=str, keep_default_na=False)
+        else:
+            frame = pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False)
+        columns = TABLE_COLUMNS[table]
+        for column in columns:
+            if column not in frame.columns:
+                frame[column] = None
+        try:
+            with conn:
+                self._insert_rows(conn, table, list(frame[columns].itertuples(index=False, name=None)))
+                conn.execute("INSERT OR REPLACE INTO csv_imports (path, size, mtime, rows) VALUES (?, ?, ?, ?)",
+                             (path, offset + len(data), stat.st_mtime, imported_rows + len(frame)))
+        except Exception:
+            self._local.symbols = None
+            raise
+        return len(frame)
+
+    def export_csv(self, table: str, csv_path: str) -> int:
+        frame = self.read_table(table)
+        frame.to_csv(csv_path, index=False)
+        return len(frame)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="投票/反馈/错误报告存储的导入导出工具")
+    parser.add_argument("command", choices=["import", "export", "migrate"])
+    parser.add_argument("--db", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "records.db"))
+    parser.add_argument("--dir", default=None, help="CSV文件所在目录（导入默认为脚本目录，导出默认为 exports/）")
+    parser.add_argument("--csv", nargs="+", default=[], help="migrate: 需要转换为紧凑格式的 ratings.csv 文件")
+    args = parser.parse_args()
+    if args.dir is None:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        args.dir = base_dir if args.command == "import" else os.path.join(base_dir, "exports")
+
+    store = RecordStore(args.db)
+    try:
+        if args.command == "migrate":
+            for csv_path in args.csv:
+                before = os.path.getsize(csv_path) if os.path.exists(csv_path) else 0
+                count = store.import_csv('ratings', csv_path)
+                print(f"📦 ratings: 已将 {csv_path} 中的 {count} 条投票（{before // 1024}KB）转换为紧凑格式")
+            return
+        os.makedirs(args.dir, exist_ok=True)
+        for table, file_name in CSV_FILE_NAMES.items():
+            csv_path = os.path.join(args.dir, file_name)
+            if args.command == "import":
+                print(f"📥 {table}: 从 {csv_path} 导入 {store.import_csv(table, csv_path)} 条记录")
+            else:
+                print(f"📤 {table}: 导出 {store.export_csv(table, csv_path)} 条记录到 {csv_path}")
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 # ==============================================================================
-# 文件: sampler.py (V3 - 修正排行榜胜率计算逻辑)
+# 文件: sampler.py (V5 - NumPy 对战矩阵，向量化权重计算)
 # 描述: 实现基于Chatbot Arena论文的自适应模型对战抽样器
 # ==============================================================================
 
@@ -7,7 +7,194 @@ import pandas as pd
 import numpy as np
 import random
 import os
-from itertools import combinations
+import io
+import hashlib
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+try:
+    import fcntl
+except ImportError:  # 非 POSIX 平台不支持跨进程共享统计
+    fcntl = None
+
+# 抽样器只需要投票文件中的这几列
+RATING_COLUMNS = ('winner', 'model_a', 'model_b')
+# 记住最近多少个从文件增量读到的 evaluation_id，用于与 record_vote 去重
+SYNCED_VOTES_MEMORY = 4096
+# winner 标识符到对战结果编码的映射；其他值（如 'tie'）只计对战次数
+WINNER_CODES = {'model_a': 0, 'model_b': 1}
+OUTCOME_TIE = 2
+# 模型延迟与失败率的指数滑动平均系数
+LATENCY_EWMA_ALPHA = 0.2
+
+
+class PairStats:
+    """
+    以模型序号为下标的稠密对战统计矩阵。
+
+    battles[i, j] 为 i 与 j 的对战次数（对称矩阵），wins[i, j] 为 i 战胜 j 的次数。
+    version 在每次更新后递增，供抽样器判断缓存的抽样分布是否过期。
+    """
+
+    def __init__(self, n_models: int):
+        self.battles = np.zeros((n_models, n_models), dtype=np.int64)
+        self.wins = np.zeros((n_models, n_models), dtype=np.int64)
+        self.version = 0
+
+    def reset(self):
+        self.battles[:] = 0
+        self.wins[:] = 0
+        self.version += 1
+
+    def add(self, idx_a, idx_b, outcomes, counts=1):
+        """
+        批量累加对战结果。
+
+        Args:
+            idx_a, idx_b: A位、B位模型序号（标量或数组）。
+            outcomes: 0 表示A胜，1 表示B胜，其他值表示平局等不计胜场的结果。
+            counts: 每条结果的次数。
+        """
+        idx_a, idx_b, outcomes, counts = np.broadcast_arrays(
+            np.asarray(idx_a, dtype=np.int64), np.asarray(idx_b, dtype=np.int64),
+            np.asarray(outcomes, dtype=np.int64), np.asarray(counts, dtype=np.int64))
+        np.add.at(self.battles, (idx_a, idx_b), counts)
+        np.add.at(self.battles, (idx_b, idx_a), counts)
+        a_won = outcomes == 0
+        b_won = outcomes == 1
+        np.add.at(self.wins, (idx_a[a_won], idx_b[a_won]), counts[a_won])
+        np.add.at(self.wins, (idx_b[b_won], idx_a[b_won]), counts[b_won])
+        self.version += 1
+
+    def snapshot(self) -> tuple:
+        """返回 (version, battles 副本, wins 副本)；进程内的线程互斥由调用方的锁负责。"""
+        return self.version, self.battles.copy(), self.wins.copy()
+
+
+class SharedPairStats(PairStats):
+    """
+    放在共享内存段中的对战统计矩阵，供同一台机器上的多个 worker 进程共用。
+
+    内存布局：头部若干 int64 字段，随后依次是 battles 和 wins 两个 n×n 的 int64 矩阵。
+    头部记录已计入的投票存储行ID（last_row_id），各进程在文件锁内从该行ID之后增量读取并累加，
+    因此每张投票恰好计入一次；任何进程都可以直接读取最新矩阵，无需重新解析投票数据。
+    共享段在所有进程退出后仍然保留，重启后继续从 last_row_id 增量同步。
+    """
+
+    MAGIC = 0x41524E41  # "ARNA"
+    HEADER_FIELDS = ('magic', 'n_models', 'version', 'last_row_id', 'leaderboard_printed')
+
+    def __init__(self, name: str, n_models: int, lock_path: str = None):
+        if fcntl is None:
+            raise RuntimeError("当前平台不支持跨进程共享的抽样统计（需要 fcntl）。")
+        self.name = name
+        header_bytes = 8 * len(self.HEADER_FIELDS)
+        matrix_bytes = 8 * n_models * n_models
+        self._shm = self._open_segment(name, header_bytes + 2 * matrix_bytes)
+        self._header = np.ndarray((len(self.HEADER_FIELDS),), dtype=np.int64, buffer=self._shm.buf)
+        self.battles = np.ndarray((n_models, n_models), dtype=np.int64, buffer=self._shm.buf, offset=header_bytes)
+        self.wins = np.ndarray((n_models, n_models), dtype=np.int64, buffer=self._shm.buf,
+                               offset=header_bytes + matrix_bytes)
+        self._lock_file = open(lock_path or os.path.join(tempfile.gettempdir(), f"{name}.lock"), 'a+b')
+        with self.locked():
+            if self._field('magic') == 0:
+                self._set_field('n_models', n_models)
+                self._set_field('magic', self.MAGIC)
+            elif self._field('magic') != self.MAGIC or self._field('n_models') != n_models:
+                raise ValueError(f"共享内存段 {name} 的布局与当前模型列表不一致。")
+
+    @staticmethod
+    def _open_segment(name: str, size: int) -> shared_memory.SharedMemory:
+        for _ in range(50):
+            try:
+                shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            except FileExistsError:
+                try:
+                    shm = shared_memory.SharedMemory(name=name)
+                except (FileNotFoundError, ValueError):
+                    time.sleep(0.01)  # 另一个进程正在创建（尚未设置大小），稍后重试
+                    continue
+                if shm.size < size:
+                    shm.close()
+                    time.sleep(0.01)
+                    continue
+            # 共享段的生命周期不跟随任何单个进程：避免 resource_tracker 在进程退出时将其删除
+            try:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(shm._name, "shared_memory")
+            except Exception:
+                pass
+            return shm
+        raise RuntimeError(f"无法打开共享内存段 {name}。")
+
+    def _field(self, field: str) -> int:
+        return int(self._header[self.HEADER_FIELDS.index(field)])
+
+    def _set_field(self, field: str, value: int):
+        self._header[self.HEADER_FIELDS.index(field)] = value
+
+    @contextmanager
+    def locked(self):
+        """跨进程互斥（文件锁）；同一进程内的线程互斥仍由调用方的锁负责。"""
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    @property
+    def version(self) -> int:
+        return self._field('version')
+
+    @version.setter
+    def version(self, value: int):
+        self._set_field('version', value)
+
+    @property
+    def last_row_id(self) -> int:
+        return self._field('last_row_id')
+
+    @last_row_id.setter
+    def last_row_id(self, value: int):
+        self._set_field('last_row_id', value)
+
+    def snapshot(self) -> tuple:
+        """在文件锁内复制矩阵：其他进程的 add() 同样持有该锁，因此不会读到更新了一半的矩阵，版本号也与副本严格对应。"""
+        with self.locked():
+            return super().snapshot()
+
+    def claim_leaderboard_print(self) -> bool:
+        """所有进程中只有第一个调用者返回 True，用于只打印一次启动排行榜。"""
+        with self.locked():
+            if self._field('leaderboard_printed'):
+                return False
+            self._set_field('leaderboard_printed', 1)
+            return True
+
+    def close(self):
+        self._lock_file.close()
+        self._shm.close()
+
+    @staticmethod
+    def unlink(name: str):
+        """删除共享内存段（例如投票存储被重建后），下次启动时会从头同步。"""
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            return
+        shm.close()
+        shm.unlink()
+
+
+def shared_stats_name(db_path: str, model_list: list) -> str:
+    """由投票存储路径和模型列表确定共享段名称，模型列表变化时自然换用新的段。"""
+    digest = hashlib.sha1(("\n".join([os.path.abspath(db_path)] + sorted(model_list))).encode("utf-8")).hexdigest()
+    return f"arena_stats_{digest[:16]}"
+
 
 class ModelSampler:
     """
@@ -21,105 +208,331 @@ class ModelSampler:
     抽样权重的计算遵循论文中公式(9)的精神。
     """
 
-    def __init__(self, model_list: list, ratings_file_path: str):
+    def __init__(self, model_list: list, ratings_file_path: str, vote_store=None, unavailable_models=None,
+                 latency_budget: float = None, min_exploration: float = 0.2, shared_stats: bool = False):
         """
         初始化抽样器。
 
         Args:
             model_list (list): 所有可用模型名称的列表。
             ratings_file_path (str): 存储历史投票记录的CSV文件路径。
+            vote_store: 可选的投票存储（需提供 read_votes_since(last_id)）；提供时代替CSV文件作为数据源。
+            unavailable_models: 可选的无参函数，返回当前不可用（如已熔断）的模型集合，抽样时跳过包含它们的模型对。
+            latency_budget (float): 可选的单场对战耗时预算（秒）。预期耗时超出预算的模型对按比例降权。
+            min_exploration (float): 降权的下限（相对原权重的比例），保证慢模型仍有足够对战数据，排名不被偏置。
+            shared_stats (bool): 为 True 时对战统计放在共享内存中，由同一台机器上的所有 worker 进程共用（需要 vote_store）。
         """
         if len(model_list) < 2:
             raise ValueError("模型抽样器至少需要两个模型才能工作。")
         self.model_list = sorted(model_list)
+        self.model_index = {model: i for i, model in enumerate(self.model_list)}
         self.ratings_file = ratings_file_path
-        self.all_pairs = list(combinations(self.model_list, 2))
-        self.battle_counts = {pair: 0 for pair in self.all_pairs}
-        self.win_counts = {model: {other_model: 0 for other_model in self.model_list if other_model != model} for model in self.model_list}
+        self.vote_store = vote_store
+        self.unavailable_models = unavailable_models
+        self.latency_budget = latency_budget
+        self.min_exploration = min_exploration
         self.leaderboard_printed = False
 
+        # 所有模型对 (i < j) 的上三角下标，以及按统计版本缓存的累积抽样分布
+        if shared_stats:
+            if vote_store is None:
+                raise ValueError("共享抽样统计需要投票存储（vote_store）作为唯一数据源。")
+            self.stats = SharedPairStats(shared_stats_name(vote_store.db_path, self.model_list), len(self.model_list))
+        else:
+            self.stats = PairStats(len(self.model_list))
+        self.shared = shared_stats
+        self._pair_rows, self._pair_cols = np.triu_indices(len(self.model_list), k=1)
+        self._cdf = None
+        self._cdf_version = None
+
+        # 每个模型观测到的调用耗时和失败率（指数滑动平均，NaN 表示尚无观测）
+        self._latency = np.full(len(self.model_list), np.nan)
+        self._failure_rate = np.zeros(len(self.model_list))
+        self._latency_version = 0
+
+        # 统计数据常驻内存：启动时完整加载一次，之后只读取文件新追加的字节
+        self._lock = threading.RLock()
+        self._ratings_offset = 0          # 已处理到的文件字节偏移（使用投票存储时为行ID）
+        self._ratings_header = None       # CSV 表头，用于解析不带表头的追加片段
+        self._pending_votes = {}          # 已由 record_vote 计入、尚未在文件中读到的 evaluation_id
+        self._synced_votes = OrderedDict()  # 已从文件计入、可能稍后再经 record_vote 上报的 evaluation_id
+        if not self.shared:
+            self._reset_counts()
+        self._load_and_process_ratings()
+
+    def _reset_counts(self):
+        self.stats.reset()
+
+    @property
+    def all_pairs(self) -> list:
+        return [(self.model_list[i], self.model_list[j]) for i, j in zip(self._pair_rows, self._pair_cols)]
+
+    @property
+    def battle_counts(self) -> dict:
+        """以 {(m1, m2): 次数} 形式返回对战次数，仅用于兼容和调试。"""
+        counts = self.stats.battles[self._pair_rows, self._pair_cols]
+        return {pair: int(n) for pair, n in zip(self.all_pairs, counts)}
+
+    @property
+    def win_counts(self) -> dict:
+        """以 {胜者: {败者: 次数}} 形式返回胜场次数，仅用于兼容和调试。"""
+        wins = self.stats.wins
+        return {model: {other: int(wins[i, j]) for j, other in enumerate(self.model_list) if j != i}
+                for i, model in enumerate(self.model_list)}
+
     def _load_and_process_ratings(self):
         """
-        从CSV文件中加载历史投票数据，并计算每个模型对的对战次数和胜利次数。
+        启动时从CSV文件中一次性加载历史投票数据（只解析所需列），并记录文件偏移。
+        共享统计模式下只需从共享段记录的行ID之后增量同步。
         """
-        # 每次调用时重置统计数据，以反映最新状态
-        self.battle_counts = {pair: 0 for pair in self.all_pairs}
-        self.win_counts = {model: {other_model: 0 for other_model in self.model_list if other_model != model} for model in self.model_list}
-
-        if not os.path.exists(self.ratings_file):
-            print("ℹ️ [抽样器] 未找到历史投票文件，将从零开始。")
+        if self.shared:
+            self._sync_shared()
             return
-
-        try:
-            ratings_df = pd.read_csv(self.ratings_file)
-            if ratings_df.empty:
+        with self._lock:
+            self._reset_counts()
+            self._ratings_offset = 0
+            self._ratings_header = None
+
+            if self.vote_store is not None:
+                try:
+                    ratings_df, self._ratings_offset = self.vote_store.read_votes_since(0)
+                    self._apply_ratings(ratings_df)
+                    print(f"✅ [抽样器] 已从投票存储加载 {len(ratings_df)} 条历史投票。")
+                except Exception as e:
+                    print(f"❌ [抽样器] 读取投票存储时发生错误: {e}")
+                    self._reset_counts()
                 return
 
-            required_cols = ['winner', 'model_a', 'model_b']
-            if not all(col in ratings_df.columns for col in required_cols):
-                print(f"⚠️ [抽样器] 投票文件 '{self.ratings_file}' 缺少必需列，已跳过历史数据处理。")
+            if not os.path.exists(self.ratings_file):
+                print("ℹ️ [抽样器] 未找到历史投票文件，将从零开始。")
                 return
 
-            # [关键修复] 迭代数据行并正确解析胜者
-            for _, row in ratings_df.iterrows():
-                model_a_name = row['model_a']
-                model_b_name = row['model_b']
-                winner_identifier = row['winner'] # winner列的值是 'model_a' 或 'model_b'
-
-                if model_a_name not in self.model_list or model_b_name not in self.model_list:
-                    continue
-
-                # 为对战次数计数
-                pair = tuple(sorted((model_a_name, model_b_name)))
-                if pair in self.battle_counts:
-                    self.battle_counts[pair] += 1
-                
-                # 根据 'winner' 列的标识符，确定胜者和败者的真实模型名称
-                if winner_identifier == 'model_a':
-                    winning_model, losing_model = model_a_name, model_b_name
-                    self.win_counts[winning_model][losing_model] += 1
-                elif winner_identifier == 'model_b':
-                    winning_model, losing_model = model_b_name, model_a_name
-                    self.win_counts[winning_model][losing_model] += 1
-                # 如果是 'tie' 或其他值，则不计入任何一方的胜场，此逻辑保持不变
-        
-        except Exception as e:
-            print(f"❌ [抽样器] 处理投票文件时发生错误: {e}")
-            self.battle_counts = {pair: 0 for pair in self.all_pairs}
-            self.win_counts = {model: {other_model: 0 for other_model in self.model_list if other_model != model} for model in self.model_list}
+            try:
+                with open(self.ratings_file, 'rb') as f:
+                    raw = f.read()
+                if not raw.strip():
+                    return
+
+                header = pd.read_csv(io.BytesIO(raw), nrows=0).columns.tolist()
+                if not all(col in header for col in RATING_COLUMNS):
+                    print(f"⚠️ [抽样器] 投票文件 '{self.ratings_file}' 缺少必需列，已跳过历史数据处理。")
+                    return
+
+                usecols = [col for col in RATING_COLUMNS + ('evaluation_id',) if col in header]
+                ratings_df = pd.read_csv(io.BytesIO(raw), usecols=usecols)
+                self._ratings_header = header
+                self._ratings_offset = len(raw)
+                self._apply_ratings(ratings_df)
+                print(f"✅ [抽样器] 已加载 {len(ratings_df)} 条历史投票。")
+
+            except Exception as e:
+                print(f"❌ [抽样器] 处理投票文件时发生错误: {e}")
+                self._reset_counts()
+
+    def _load_appended_ratings(self):
+        """
+        增量读取自上次偏移以来追加到CSV文件中的投票（例如来自其他进程的写入）。
+        共享统计模式下其他进程记录投票时已经同步了共享矩阵，这里无需任何操作。
+        """
+        if self.shared:
+            return
+        with self._lock:
+            if self.vote_store is not None:
+                try:
+                    new_df, self._ratings_offset = self.vote_store.read_votes_since(self._ratings_offset)
+                except Exception as e:
+                    print(f"❌ [抽样器] 读取投票存储时发生错误: {e}")
+                    return
+                self._apply_ratings(self._drop_pending_votes(new_df))
+                return
 
+            try:
+                size = os.path.getsize(self.ratings_file)
+            except OSError:
+                return
+            if size == self._ratings_offset:
+                return
+            if size < self._ratings_offset:
+                # 文件被截断或替换，只能整体重新加载
+                self._load_and_process_ratings()
+                return
 
-    def _calculate_sampling_weights(self) -> (list, list):
+            with open(self.ratings_file, 'rb') as f:
+                f.seek(self._ratings_offset)
+                chunk = f.read(size - self._ratings_offset)
+            if not chunk.endswith(b'\n'):
+                return  # 另一方仍在写入，下次再读
+
+            try:
+                if self._ratings_header is None:
+                    header = pd.read_csv(io.BytesIO(chunk), nrows=0).columns.tolist()
+                    if not all(col in header for col in RATING_COLUMNS):
+                        return
+                    usecols = [col for col in RATING_COLUMNS + ('evaluation_id',) if col in header]
+                    new_df = pd.read_csv(io.BytesIO(chunk), usecols=usecols)
+                    self._ratings_header = header
+                else:
+                    usecols = [col for col in RATING_COLUMNS + ('evaluation_id',) if col in self._ratings_header]
+                    new_df = pd.read_csv(io.BytesIO(chunk), header=None, names=self._ratings_header, usecols=usecols)
+            except (pd.errors.ParserError, pd.errors.EmptyDataError):
+                return  # 片段不完整（如多行回答写到一半），下次再读
+
+            self._ratings_offset = size
+            new_df = self._drop_pending_votes(new_df)
+            self._apply_ratings(new_df)
+
+    def _sync_shared(self):
+        """在跨进程锁内把投票存储中尚未计入的投票累加到共享矩阵。"""
+        with self._lock, self.stats.locked():
+            initial = self.stats.last_row_id == 0
+            try:
+                new_df, last_row_id = self.vote_store.read_votes_since(self.stats.last_row_id)
+            except Exception as e:
+                print(f"❌ [抽样器] 读取投票存储时发生错误: {e}")
+                return
+            self._apply_ratings(new_df)
+            self.stats.last_row_id = last_row_id
+        if initial and not new_df.empty:
+            print(f"✅ [抽样器] 已将 {len(new_df)} 条投票同步到共享统计 {self.stats.name}。")
+
+    def _drop_pending_votes(self, ratings_df: pd.DataFrame) -> pd.DataFrame:
+        """去掉已经通过 record_vote 计入的行，并记住其余行以便对 record_vote 去重。"""
+        if 'evaluation_id' not in ratings_df.columns:
+            return ratings_df
+        keep = []
+        for evaluation_id in ratings_df['evaluation_id']:
+            if self._pending_votes.get(evaluation_id):
+                self._pending_votes[evaluation_id] -= 1
+                if not self._pending_votes[evaluation_id]:
+                    del self._pending_votes[evaluation_id]
+                keep.append(False)
+            else:
+                self._synced_votes[evaluation_id] = self._synced_votes.get(evaluation_id, 0) + 1
+                keep.append(True)
+        while len(self._synced_votes) > SYNCED_VOTES_MEMORY:
+            self._synced_votes.popitem(last=False)
+        return ratings_df[keep]
+
+    def _apply_ratings(self, ratings_df: pd.DataFrame):
         """
-        根据历史数据为每个模型对计算抽样权重。
+        将一批投票记录累加到对战次数和胜利次数中。
+        winner列的值是 'model_a' 或 'model_b'；'tie' 或其他值只计对战次数，不计入任何一方的胜场。
         """
-        pairs, weights = [], []
-        max_weight_for_unseen = 0.0
+        if ratings_df.empty:
+            return
+        idx_a = ratings_df['model_a'].map(self.model_index)
+        idx_b = ratings_df['model_b'].map(self.model_index)
+        valid = (idx_a.notna() & idx_b.notna() & (idx_a != idx_b)).to_numpy()
+        outcomes = ratings_df['winner'].map(WINNER_CODES).fillna(OUTCOME_TIE)
+        self.stats.add(idx_a.to_numpy()[valid].astype(np.int64),
+                       idx_b.to_numpy()[valid].astype(np.int64),
+                       outcomes.to_numpy()[valid].astype(np.int64))
+
+    def record_vote(self, model_a: str, model_b: str, winner: str, evaluation_id: str = None):
+        """
+        公开方法，在投票写入文件后直接更新内存中的统计数据。
 
-        for pair in self.all_pairs:
-            m1, m2 = pair
-            n = self.battle_counts.get(pair, 0)
-            
-            if n > 0:
-                # 注意：p_hat是m1相对m2的胜率，即使交换m1,m2，p_hat会变为1-p_hat，但p(1-p)不变
-                wins_m1_vs_m2 = self.win_counts[m1].get(m2, 0)
-                p_hat = wins_m1_vs_m2 / n
-                variance_proxy = p_hat * (1 - p_hat) + 1e-6
-                weight = np.sqrt(variance_proxy) * (1/np.sqrt(n) - 1/np.sqrt(n + 1))
-                pairs.append(pair)
-                weights.append(weight)
-                if weight > max_weight_for_unseen:
-                    max_weight_for_unseen = weight
+        Args:
+            model_a (str): A位模型名称。
+            model_b (str): B位模型名称。
+            winner (str): 'model_a'、'model_b' 或 'tie' 等。
+            evaluation_id (str): 本次评价的ID，用于与文件增量读取去重。
+        """
+        if model_a not in self.model_list or model_b not in self.model_list or model_a == model_b:
+            return
+        if self.shared:
+            # 投票已提交到投票存储，按行ID同步即可保证各进程合计恰好计入一次
+            self._sync_shared()
+            return
+        with self._lock:
+            if evaluation_id is not None:
+                if self._synced_votes.get(evaluation_id):
+                    # 增量读取已经先一步从文件中计入了这一票
+                    self._synced_votes[evaluation_id] -= 1
+                    if not self._synced_votes[evaluation_id]:
+                        del self._synced_votes[evaluation_id]
+                    return
+                self._pending_votes[evaluation_id] = self._pending_votes.get(evaluation_id, 0) + 1
+            self.stats.add(self.model_index[model_a], self.model_index[model_b],
+                           WINNER_CODES.get(winner, OUTCOME_TIE))
+
+    def snapshot_stats(self) -> tuple:
+        """先同步其他进程追加的投票，再返回 (battles, wins) 矩阵的副本，供排行榜引擎离线拟合。"""
+        self._load_appended_ratings()
+        with self._lock:
+            _, battles, wins = self.stats.snapshot()
+            return battles, wins
+
+    def _calculate_sampling_weights(self, battles: np.ndarray = None, wins: np.ndarray = None) -> np.ndarray:
+        """
+        根据历史数据为每个模型对计算抽样权重（一次向量化计算所有模型对）。
+        battles / wins 为统计矩阵的快照，缺省时直接读取当前矩阵。
+        返回的权重与 self._pair_rows / self._pair_cols 一一对应。
+        """
+        battles = self.stats.battles if battles is None else battles
+        wins = self.stats.wins if wins is None else wins
+        n = battles[self._pair_rows, self._pair_cols].astype(np.float64)
+        seen = n > 0
+        weights = np.empty_like(n)
+
+        if seen.any():
+            n_seen = n[seen]
+            # 注意：p_hat是m1相对m2的胜率，即使交换m1,m2，p_hat会变为1-p_hat，但p(1-p)不变
+            p_hat = wins[self._pair_rows[seen], self._pair_cols[seen]] / n_seen
+            variance_proxy = p_hat * (1 - p_hat) + 1e-6
+            weights[seen] = np.sqrt(variance_proxy) * (1 / np.sqrt(n_seen) - 1 / np.sqrt(n_seen + 1))
+            max_weight_for_unseen = weights[seen].max()
+        else:
+            max_weight_for_unseen = 0.0
 
         if max_weight_for_unseen == 0.0:
             max_weight_for_unseen = 1.0
 
-        for pair in self.all_pairs:
-            if self.battle_counts.get(pair, 0) == 0:
-                pairs.append(pair)
-                weights.append(max_weight_for_unseen * 1.1)
-        
-        return pairs, weights
+        weights[~seen] = max_weight_for_unseen * 1.1
+        return weights
+
+    def record_latency(self, model: str, seconds: float, success: bool = True):
+        """
+        记录一次模型调用的耗时和成败，用于按延迟调整抽样权重。
+        失败的调用只更新失败率，不计入耗时。
+        """
+        i = self.model_index.get(model)
+        if i is None:
+            return
+        with self._lock:
+            self._failure_rate[i] += LATENCY_EWMA_ALPHA * ((0.0 if success else 1.0) - self._failure_rate[i])
+            if success:
+                previous = self._latency[i]
+                self._latency[i] = seconds if np.isnan(previous) else previous + LATENCY_EWMA_ALPHA * (seconds - previous)
+            self._latency_version += 1
+
+    def _expected_pair_seconds(self, rows, cols) -> np.ndarray:
+        """
+        模型对的预期耗时：两个模型并发调用，耗时取较慢的一方；
+        任一方失败时这场对战作废，需要重来，因此再除以双方都成功的概率。无观测时为 NaN。
+        """
+        slowest = np.fmax(self._latency[rows], self._latency[cols])
+        both_succeed = (1 - self._failure_rate[rows]) * (1 - self._failure_rate[cols])
+        return slowest / np.maximum(both_succeed, 0.05)
+
+    def _latency_factors(self, rows, cols) -> np.ndarray:
+        """预期耗时超出预算的模型对按 预算/预期耗时 降权，且不低于 min_exploration。"""
+        if not self.latency_budget:
+            return np.ones(len(rows))
+        expected = self._expected_pair_seconds(rows, cols)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            factors = np.where(expected > self.latency_budget, self.latency_budget / expected, 1.0)
+        return np.clip(np.nan_to_num(factors, nan=1.0), self.min_exploration, 1.0)
+
+    def _sampling_cdf(self) -> np.ndarray:
+        """返回累积抽样分布；统计数据和延迟观测都未变化时直接复用上一次的结果。"""
+        if self._cdf is None or self._cdf_version != (self.stats.version, self._latency_version):
+            # 不加锁读到的版本号只用来判断是否过期；权重按一致的快照计算，并记在快照自己的版本号下
+            stats_version, battles, wins = self.stats.snapshot()
+            weights = self._calculate_sampling_weights(battles, wins) * self._latency_factors(self._pair_rows, self._pair_cols)
+            self._cdf = np.cumsum(weights)
+            self._cdf_version = (stats_version, self._latency_version)
+        return self._cdf
 
     def _display_leaderboard(self):
         """
@@ -129,22 +542,12 @@ class ModelSampler:
         print("📊 当前模型排行榜 (基于历史投票数据)".center(70))
         print("="*70)
 
-        model_stats = []
-        for model in self.model_list:
-            total_wins = sum(self.win_counts[model].values())
-            total_battles = sum(self.battle_counts[pair] for pair in self.all_pairs if model in pair)
-            
-            win_rate = (total_wins / total_battles) * 100 if total_battles > 0 else 0
-            model_stats.append({
-                'model': model,
-                'win_rate': win_rate,
-                'wins': total_wins,
-                'battles': total_battles
-            })
-
-        sorted_stats = sorted(model_stats, key=lambda x: x['win_rate'], reverse=True)
+        total_wins = self.stats.wins.sum(axis=1)
+        total_battles = self.stats.battles.sum(axis=1)
+        win_rates = np.divide(total_wins * 100.0, total_battles,
+                              out=np.zeros(len(self.model_list)), where=total_battles > 0)
 
-        if not any(s['battles'] > 0 for s in sorted_stats):
+        if not (total_battles > 0).any():
             print("无有效的对战数据，无法生成排行榜。")
             print("="*70 + "\n")
             return
@@ -152,10 +555,10 @@ class ModelSampler:
         print(f"{'排名':<5}{'模型名称':<45}{'胜率':<10}{'胜场/总对战':<15}")
         print(f"{'-'*4:<5}{'-'*44:<45}{'-'*9:<10}{'-'*14:<15}")
 
-        for rank, stats in enumerate(sorted_stats, 1):
-            battle_summary = f"{stats['wins']}/{stats['battles']}"
-            print(f"{rank:<5}{stats['model']:<45}{stats['win_rate']:.2f}%{'':<4}{battle_summary:<15}")
-        
+        for rank, i in enumerate(np.argsort(-win_rates, kind='stable'), 1):
+            battle_summary = f"{total_wins[i]}/{total_battles[i]}"
+            print(f"{rank:<5}{self.model_list[i]:<45}{win_rates[i]:.2f}%{'':<4}{battle_summary:<15}")
+
         print("="*70 + "\n")
 
     def _get_selection_reason(self, pair: tuple) -> str:
@@ -163,15 +566,25 @@ class ModelSampler:
         根据模型对的情况，生成选择它的技术理由。
         """
         canonical_pair = tuple(sorted(pair))
-        n = self.battle_counts.get(canonical_pair, 0)
+        i, j = (self.model_index[model] for model in canonical_pair)
+        return self._uncertainty_reason(i, j) + self._latency_reason(i, j)
+
+    def _latency_reason(self, i: int, j: int) -> str:
+        factor = self._latency_factors(np.array([i]), np.array([j]))[0]
+        if factor >= 1.0:
+            return ""
+        expected = self._expected_pair_seconds(np.array([i]), np.array([j]))[0]
+        return (f" (延迟降权：预期耗时约 {expected:.0f} 秒，超出 {self.latency_budget:g} 秒预算，"
+                f"抽样权重降至 {factor:.0%}，仍保留最低探索比例)")
+
+    def _uncertainty_reason(self, i: int, j: int) -> str:
+        n = int(self.stats.battles[i, j])
 
         if n == 0:
             return "全新对决：这对模型组合是首次被抽中，优先进行探索。"
 
         # 确保 p_hat 计算基于范式对的顺序
-        m1, m2 = canonical_pair
-        wins_m1_vs_m2 = self.win_counts[m1].get(m2, 0)
-        p_hat = wins_m1_vs_m2 / n
+        p_hat = self.stats.wins[i, j] / n
 
         reason = ""
         # 分析不确定性
@@ -188,27 +601,51 @@ class ModelSampler:
 
         return reason
 
+    def _exclude_unavailable(self, cdf: np.ndarray) -> tuple:
+        """
+        把包含不可用模型的模型对权重置零，返回 (新的累积分布, 可用模型列表)。
+        可用模型不足两个时不做过滤。
+        """
+        unavailable = self.unavailable_models() if self.unavailable_models is not None else None
+        if not unavailable:
+            return cdf, self.model_list
+        available = [model for model in self.model_list if model not in unavailable]
+        if len(available) < 2:
+            print("⚠️ [抽样器] 可用模型不足两个，忽略可用性过滤。")
+            return cdf, self.model_list
+        blocked = np.zeros(len(self.model_list), dtype=bool)
+        blocked[[self.model_index[model] for model in unavailable if model in self.model_index]] = True
+        weights = np.diff(cdf, prepend=0.0)
+        weights[blocked[self._pair_rows] | blocked[self._pair_cols]] = 0.0
+        print(f"🚫 [抽样器] 跳过不可用的模型: {sorted(unavailable)}")
+        return np.cumsum(weights), available
+
     def select_pair(self) -> tuple:
         """
         公开方法，用于选择下一场对战的模型对。
         """
-        self._load_and_process_ratings()
+        self._load_appended_ratings()
 
         if not self.leaderboard_printed:
-            self._display_leaderboard()
             self.leaderboard_printed = True
+            if not self.shared or self.stats.claim_leaderboard_print():
+                self._display_leaderboard()
         
         print("🔄 [抽样器] 正在使用自适应策略选择模型对...")
         
-        pairs, weights = self._calculate_sampling_weights()
+        with self._lock:
+            cdf = self._sampling_cdf()
+        cdf, available = self._exclude_unavailable(cdf)
 
-        if not pairs:
+        if len(cdf) == 0 or not np.isfinite(cdf[-1]) or cdf[-1] <= 0:
             print("⚠️ [抽样器] 未能计算权重，已回退至随机抽样。")
-            return tuple(random.sample(self.model_list, 2))
+            return tuple(random.sample(available, 2))
         
         try:
-            selected_pair = random.choices(population=pairs, weights=weights, k=1)[0]
-            reason = self._get_selection_reason(selected_pair)
+            k = min(int(np.searchsorted(cdf, random.random() * cdf[-1], side='right')), len(cdf) - 1)
+            selected_pair = (self.model_list[self._pair_rows[k]], self.model_list[self._pair_cols[k]])
+            with self._lock:
+                reason = self._get_selection_reason(selected_pair)
             print(f"✅ [抽样器] 策略选定对战: {selected_pair}")
             print(f"    👉 理由: {reason}")
             
@@ -216,4 +653,4 @@ class ModelSampler:
         
         except Exception as e:
             print(f"❌ [抽样器] 加权抽样时发生错误: {e}。已回退至随机抽用。")
-            return tuple(random.sample(self.model_list, 2))
\ No newline at end of file
+            return tuple(random.sample(available, 2))
\ No newline at end of file
@@ -0,0 +1,306 @@
+# ==============================================================================
+# 文件: search.py
+# 描述: 艺术品目录的进程内全文检索与分面统计：按 名称/作者/收藏地/材质/形制/年代 建立
+#       CJK 单字+双字 n-gram 倒排索引，分面取值预先计算位图，支持前缀自动补全；
+#       倒排表可保存为快照，目录内容未变时启动直接加载
+# ==============================================================================
+
+import bisect
+import json
+import math
+import os
+import re
+import time
+import unicodedata
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# 快照格式版本：分词或索引结构变化时递增，使旧快照失效
+SEARCH_FORMAT_VERSION = 1
+# 可检索字段及其相关性权重
+SEARCH_FIELDS = {'名称': 3.0, '作者': 2.0, '收藏地': 1.0, '材质': 1.0, '形制': 1.0, '年代': 1.0}
+# 返回分面计数、可作为筛选条件的字段
+FACET_FIELDS = ['作者', '收藏地', '材质', '形制', '年代', 'era_group']
+# 自动补全候选来源字段
+SUGGEST_FIELDS = ['名称', '作者', '收藏地', '材质', '形制', '年代']
+# 取值数不超过该值的分面字段在构建时预先计算全部位图，其余字段首次筛选时再计算并缓存
+PRECOMPUTED_BITMAP_MAX_VALUES = 512
+# 字段以查询词开头时的权重加成
+PREFIX_BOOST = 2.0
+# 前缀 n-gram 的标记字符，不会出现在分词结果中
+_PREFIX_MARK = '^'
+_SEGMENT_PATTERN = re.compile(r"\w+")
+
+SearchResult = namedtuple("SearchResult", ["ids", "total", "facets", "took_ms"])
+
+
+def normalize(text) -> str:
+    """全角转半角、统一大小写；空值返回空串。"""
+    if text is None or (isinstance(text, float) and math.isnan(text)):
+        return ''
+    return unicodedata.normalize('NFKC', str(text)).lower().strip()
+
+
+def segments(text) -> list:
+    """按标点和空白切分为连续的文字片段。"""
+    return _SEGMENT_PATTERN.findall(normalize(text))
+
+
+def ngrams(segment: str) -> set:
+    """片段的全部单字和相邻双字。"""
+    grams = set(segment)
+    grams.update(segment[i:i + 2] for i in range(len(segment) - 1))
+    return grams
+
+
+def _document_grams(text: str) -> set:
+    parts = _SEGMENT_PATTERN.findall(text)
+    grams = set()
+    for part in parts:
+        grams.update(ngrams(part))
+    if parts:
+        # 字段开头的单字和双字另记一份，前缀匹配不必逐条比对原文
+        grams.add(_PREFIX_MARK + parts[0][:1])
+        grams.add(_PREFIX_MARK + parts[0][:2])
+    return grams
+
+
+def _build_postings(texts: list) -> tuple:
+    """构建一个字段的倒排表，返回 (有序词表, 偏移数组, 文档号数组)。"""
+    postings = {}
+    for doc, text in enumerate(texts):
+        for gram in _document_grams(text):
+            postings.setdefault(gram, []).append(doc)
+    vocab = sorted(postings)
+    offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(postings[gram]) for gram in vocab])
+    docs = np.fromiter((doc for gram in vocab for doc in postings[gram]), dtype=np.int32, count=int(offsets[-1]))
+    return vocab, offsets, docs
+
+
+def content_fingerprint(frame: pd.DataFrame) -> str:
+    """被索引的列的内容指纹，作为快照是否可用的依据。"""
+    columns = ['id'] + [field for field in SEARCH_FIELDS if field in frame.columns]
+    hashed = pd.util.hash_pandas_object(frame[columns].astype(str), index=False)
+    return f"{len(frame)}-{int(hashed.sum()) & 0xFFFFFFFFFFFFFFFF:016x}"
+
+
+class SearchIndex:
+    """
+    只读的检索索引，构建完成后不再修改，目录重新加载时整体替换。
+
+    - 每个可检索字段一份倒排表：词项为单字和相邻双字，文档号为目录中的行号。
+      长度不超过 2 的查询词直接取倒排表，更长的查询词先求各双字倒排表的交集，再对少量候选核对原文。
+    - 分面字段按取值编码，计数对命中文档做一次 bincount；筛选使用按取值的位图按位与。
+    - 自动补全在各字段排好序的取值表上二分查找前缀。
+    """
+
+    def __init__(self, frame: pd.DataFrame = None, postings: dict = None, fingerprint: str = None):
+        start = time.perf_counter()
+        frame = frame.reset_index(drop=True) if frame is not None else pd.DataFrame(columns=['id'])
+        self.size = len(frame)
+        self.ids = frame['id'].astype(str).tolist()
+        self.fingerprint = fingerprint or content_fingerprint(frame)
+        self.fields = [field for field in SEARCH_FIELDS if field in frame.columns]
+        self._texts = {field: [normalize(value) for value in frame[field].tolist()] for field in self.fields}
+        self.source = 'snapshot' if postings is not None else 'built'
+        if postings is None:
+            postings = {field: _build_postings(self._texts[field]) for field in self.fields}
+        self._raw_postings = postings
+        self._postings = {}
+        for field, (vocab, offsets, docs) in postings.items():
+            self._postings[field] = {gram: docs[offsets[i]:offsets[i + 1]] for i, gram in enumerate(vocab)}
+
+        self._all_bitmap = np.packbits(np.ones(self.size, dtype=bool))
+        self._facet_codes, self._facet_values, self._bitmaps = {}, {}, {}
+        for field in FACET_FIELDS:
+            if field not in frame.columns:
+                continue
+            codes, values = pd.factorize(frame[field].astype(object), use_na_sentinel=True)
+            self._facet_codes[field] = np.where(codes < 0, len(values), codes).astype(np.int32)
+            self._facet_values[field] = [str(value) for value in values]
+            self._bitmaps[field] = {}
+            if len(values) <= PRECOMPUTED_BITMAP_MAX_VALUES:
+                for code, value in enumerate(self._facet_values[field]):
+                    self._bitmaps[field][value] = np.packbits(self._facet_codes[field] == code)
+
+        self._suggestions = {}
+        for field in SUGGEST_FIELDS:
+            if field not in self.fields:
+                continue
+            counts = {}
+            for text, value in zip(self._texts[field], frame[field].tolist()):
+                if text:
+                    key = (text, str(value))
+                    counts[key] = counts.get(key, 0) + 1
+            entries = sorted((text, value, count) for (text, value), count in counts.items())
+            self._suggestions[field] = ([text for text, _, _ in entries], entries)
+        self.build_seconds = time.perf_counter() - start
+
+    # --- 快照 ---
+
+    def save(self, snapshot_path: str):
+        """将倒排表写成 .npz 快照（先写临时文件再替换）。"""
+        arrays = {'meta': np.array(json.dumps({
+            'format_version': SEARCH_FORMAT_VERSION,
+            'fingerprint': self.fingerprint,
+            'fields': list(self._raw_postings),
+        }, ensure_ascii=False))}
+        for i, (vocab, offsets, docs) in enumerate(self._raw_postings.values()):
+            arrays[f'vocab_{i}'] = np.array(vocab, dtype=str)
+            arrays[f'offsets_{i}'] = offsets
+            arrays[f'docs_{i}'] = docs
+        tmp_path = f"{snapshot_path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, snapshot_path)
+
+    @classmethod
+    def load(cls, frame: pd.DataFrame, snapshot_path: str):
+        """快照与当前目录内容一致时从快照构建索引，否则返回 None。"""
+        if frame is None or not os.path.exists(snapshot_path):
+            return None
+        fingerprint = content_fingerprint(frame)
+        try:
+            with np.load(snapshot_path, allow_pickle=False) as snapshot:
+                meta = json.loads(str(snapshot['meta']))
+                if meta.get('format_version') != SEARCH_FORMAT_VERSION or meta.get('fingerprint') != fingerprint:
+                    return None
+                postings = {field: (snapshot[f'vocab_{i}'].tolist(), snapshot[f'offsets_{i}'], snapshot[f'docs_{i}'])
+                            for i, field in enumerate(meta['fields'])}
+        except Exception as e:
+            print(f"⚠️ [检索] 读取索引快照失败，将重新构建: {e}")
+            return None
+        return cls(frame, postings=postings, fingerprint=fingerprint)
+
+    @classmethod
+    def load_or_build(cls, frame: pd.DataFrame, snapshot_path: str = None):
+        index = cls.load(frame, snapshot_path) if snapshot_path else None
+        if index is None:
+            index = cls(frame)
+            if snapshot_path and frame is not None:
+                try:
+                    index.save(snapshot_path)
+                except Exception as e:
+                    print(f"⚠️ [检索] 写入索引快照失败: {e}")
+        print(f"✅ [检索] 检索索引{'从快照加载' if index.source == 'snapshot' else '构建完成'}，"
+              f"{index.size} 条，耗时 {index.build_seconds:.3f} 秒。")
+        return index
+
+    # --- 查询 ---
+
+    def _posting(self, field: str, gram: str) -> np.ndarray:
+        return self._postings[field].get(gram, np.empty(0, dtype=np.int32))
+
+    def _match(self, field: str, segment: str, prefix: bool = False) -> np.ndarray:
+        """字段包含（prefix=True 时为以之开头）该片段的文档号。"""
+        if len(segment) <= 2:
+            return self._posting(field, _PREFIX_MARK + segment if prefix else segment)
+        lists = sorted((self._posting(field, segment[i:i + 2]) for i in range(len(segment) - 1)), key=len)
+        if prefix:
+            lists.insert(0, self._posting(field, _PREFIX_MARK + segment[:2]))
+        candidates = lists[0]
+        for docs in lists[1:]:
+            if not candidates.size:
+                break
+            candidates = np.intersect1d(candidates, docs, assume_unique=True)
+        # 双字都出现不代表整个片段连续出现，核对原文
+        texts = self._texts[field]
+        if prefix:
+            keep = [_SEGMENT_PATTERN.search(texts[doc]).group().startswith(segment) for doc in candidates.tolist()]
+        else:
+            keep = [segment in texts[doc] for doc in candidates.tolist()]
+        return candidates[np.array(keep, dtype=bool)] if candidates.size else candidates
+
+    def _facet_bitmap(self, field: str, value: str) -> np.ndarray:
+        bitmaps = self._bitmaps[field]
+        bitmap = bitmaps.get(value)
+        if bitmap is None:
+            try:
+                code = self._facet_values[field].index(value)
+            except ValueError:
+                return np.zeros_like(self._all_bitmap)
+            bitmap = bitmaps[value] = np.packbits(self._facet_codes[field] == code)
+        return bitmap
+
+    def _facet_counts(self, docs: np.ndarray, limit: int) -> dict:
+        facets = {}
+        for field, codes in self._facet_codes.items():
+            values = self._facet_values[field]
+            counts = np.bincount(codes[docs], minlength=len(values) + 1)[:len(values)]
+            top = np.flatnonzero(counts)
+            top = top[np.argsort(-counts[top], kind='stable')][:limit]
+            facets[field] = [{'value': values[code], 'count': int(counts[code])} for code in top]
+        return facets
+
+    def search(self, query: str = '', filters: dict = None, fields: list = None,
+               limit: int = 20, offset: int = 0, facet_limit: int = 20) -> SearchResult:
+        """
+        检索作品。query 按标点和空白切成多个片段，每个片段须在任一检索字段中出现；
+        filters 为 {分面字段: [取值, ...]}，同一字段内取值为“或”，不同字段之间为“且”。
+        有查询词时按字段权重（字段以查询词开头时加成）排序，否则保持目录顺序。
+        """
+        start = time.perf_counter()
+        fields = [field for field in (fields or self.fields) if field in self._postings]
+        parts = segments(query)
+        scores = None
+        bitmap = self._all_bitmap
+        if parts:
+            scores = np.zeros(self.size, dtype=np.float32)
+            matched = np.ones(self.size, dtype=bool)
+            for part in parts:
+                part_scores = np.zeros(self.size, dtype=np.float32)
+                for field in fields:
+                    weight = SEARCH_FIELDS[field]
+                    docs = self._match(field, part)
+                    part_scores[docs] = np.maximum(part_scores[docs], weight)
+                    prefixed = self._match(field, part, prefix=True)
+                    part_scores[prefixed] = np.maximum(part_scores[prefixed], weight * PREFIX_BOOST)
+                matched &= part_scores > 0
+                scores += part_scores
+            bitmap = np.packbits(matched)
+
+        for field, values in (filters or {}).items():
+            if field not in self._bitmaps or not values:
+                continue
+            field_bitmap = np.zeros_like(bitmap)
+            for value in values:
+                field_bitmap |= self._facet_bitmap(field, value)
+            bitmap = bitmap & field_bitmap
+
+        docs = np.flatnonzero(np.unpackbits(bitmap, count=self.size))
+        facets = self._facet_counts(docs, facet_limit) if facet_limit else {}
+        if scores is not None:
+            docs = docs[np.argsort(-scores[docs], kind='stable')]
+        page = docs[offset:offset + limit]
+        return SearchResult([self.ids[doc] for doc in page.tolist()], int(docs.size), facets,
+                            (time.perf_counter() - start) * 1000)
+
+    def suggest(self, prefix: str, limit: int = 10, fields: list = None, scan_limit: int = 200) -> list:
+        """自动补全：返回以 prefix 开头的字段取值，按作品数降序。"""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        candidates = []
+        for field in (fields or SUGGEST_FIELDS):
+            if field not in self._suggestions:
+                continue
+            keys, entries = self._suggestions[field]
+            start = bisect.bisect_left(keys, prefix)
+            for text, value, count in entries[start:start + scan_limit]:
+                if not text.startswith(prefix):
+                    break
+                candidates.append((-count, len(text), field, value))
+        candidates.sort()
+        return [{'field': field, 'value': value, 'count': -negative_count}
+                for negative_count, _, field, value in candidates[:limit]]
+
+    def stats(self) -> dict:
+        return {
+            'documents': self.size,
+            'source': self.source,
+            'build_seconds': round(self.build_seconds, 4),
+            'terms': {field: len(postings) for field, postings in self._postings.items()},
+            'bitmaps': {field: len(bitmaps) for field, bitmaps in self._bitmaps.items()},
+        }
@@ -0,0 +1,260 @@
+# ==============================================================================
+# 文件: simulate_convergence.py
+# 描述: 抽样策略收敛模拟。按给定的 Bradley–Terry 真实强度生成模拟投票（可设平局率和随机投票噪声），
+#       让各抽样策略（均匀随机、抽样器当前的自适应权重及其变体）逐票选择对战，
+#       统计达到目标排名相关系数或置信区间宽度所需的票数。各次试验分散到进程池并行运行。
+# 用法: python simulate_convergence.py [--n-models 19] [--trials 200] [--strategies uniform adaptive balanced]
+#                                      [--target-corr 0.9] [--target-ci 100] [--max-votes 20000] [--output result.json]
+# ==============================================================================
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from leaderboard import ELO_BASE, ELO_SCALE, fit_bradley_terry
+from sampler import ModelSampler, OUTCOME_TIE
+
+Z_95 = 1.959964
+ELO_PER_NAT = ELO_SCALE / math.log(10)   # 自然对数强度差 1 对应的 Elo 分差
+
+
+# ------------------------------------------------------------------------------
+# 抽样策略：strategy(sampler, rng) -> 模型对在 sampler._pair_rows / _pair_cols 中的下标
+# ------------------------------------------------------------------------------
+
+def _weighted_choice(weights: np.ndarray, rng) -> int:
+    cdf = np.cumsum(weights)
+    return min(int(np.searchsorted(cdf, rng.random() * cdf[-1], side='right')), len(cdf) - 1)
+
+
+def uniform_strategy(sampler: ModelSampler, rng) -> int:
+    """所有模型对等概率。"""
+    return int(rng.integers(len(sampler._pair_rows)))
+
+
+def adaptive_strategy(sampler: ModelSampler, rng) -> int:
+    """抽样器当前使用的权重（与 select_pair 相同的累积分布）。"""
+    cdf = sampler._sampling_cdf()
+    return min(int(np.searchsorted(cdf, rng.random() * cdf[-1], side='right')), len(cdf) - 1)
+
+
+def balanced_strategy(sampler: ModelSampler, rng) -> int:
+    """按 1/(对战次数+1) 加权，使各模型对的对战次数趋于均衡。"""
+    n = sampler.stats.battles[sampler._pair_rows, sampler._pair_cols]
+    return _weighted_choice(1.0 / (n + 1.0), rng)
+
+
+def greedy_strategy(sampler: ModelSampler, rng) -> int:
+    """总是选择自适应权重最大的模型对（并列时随机）。"""
+    weights = sampler._calculate_sampling_weights()
+    best = np.flatnonzero(weights == weights.max())
+    return int(best[rng.integers(len(best))])
+
+
+STRATEGIES = {
+    "uniform": uniform_strategy,
+    "adaptive": adaptive_strategy,
+    "balanced": balanced_strategy,
+    "greedy": greedy_strategy,
+}
+
+
+# ------------------------------------------------------------------------------
+# 评估
+# ------------------------------------------------------------------------------
+
+def kendall_tau(x: np.ndarray, y: np.ndarray) -> float:
+    """Kendall τ-a 排名相关系数（模型数很少，直接比较所有模型对）。"""
+    dx = np.sign(x[:, None] - x[None, :])
+    dy = np.sign(y[:, None] - y[None, :])
+    n = len(x)
+    return float((dx * dy).sum() / (n * (n - 1)))
+
+
+def ci_widths(ratings: np.ndarray, battles: np.ndarray, prior: float) -> np.ndarray:
+    """
+    各模型评分 95% 置信区间的宽度（Elo）。
+    用拟合结果处的 Fisher 信息矩阵近似协方差，代替逐检查点的 bootstrap，使大量试验可以在合理时间内完成；
+    虚拟对手先验（与 fit_bradley_terry 一致）保证信息矩阵可逆；评分只有相对意义，
+    因此取中心化（各模型评分减去均值）后的方差，不计整体平移的不确定性。
+    """
+    theta = (ratings - ELO_BASE) / ELO_PER_NAT
+    p = 1.0 / (1.0 + np.exp(-(theta[:, None] - theta[None, :])))
+    information = -battles * p * p.T
+    np.fill_diagonal(information, 0.0)
+    prior_p = 1.0 / (1.0 + np.exp(-theta))
+    information[np.diag_indices_from(information)] = -information.sum(axis=1) + 2 * prior * prior_p * (1 - prior_p)
+    centering = np.eye(len(theta)) - 1.0 / len(theta)
+    variance = np.diag(centering @ np.linalg.inv(information) @ centering)
+    return 2 * Z_95 * np.sqrt(np.maximum(variance, 0.0)) * ELO_PER_NAT
+
+
+def true_strengths(n_models: int, spread: float, seed: int) -> np.ndarray:
+    """真实强度（Elo 刻度），按正态分布抽取，标准差为 spread。"""
+    return ELO_BASE + np.random.default_rng(seed).normal(0.0, spread, size=n_models)
+
+
+# ------------------------------------------------------------------------------
+# 单次试验（在子进程中运行）
+# ------------------------------------------------------------------------------
+
+def run_trial(strategy: str, model_list: list, strengths: np.ndarray, settings: dict, seed: int) -> dict:
+    """
+    用一个全新的抽样器从零开始逐票模拟，每 eval_every 票拟合一次 Bradley–Terry 模型并与真实强度对比。
+    返回首次达到目标相关系数和目标置信区间宽度时的票数（未达到为 None）。
+    """
+    rng = np.random.default_rng(seed)
+    choose = STRATEGIES[strategy]
+    with contextlib.redirect_stdout(io.StringIO()):
+        sampler = ModelSampler(model_list, ratings_file_path="__simulation_no_such_file__.csv")
+    theta = (strengths - ELO_BASE) / ELO_PER_NAT
+    rows, cols = sampler._pair_rows, sampler._pair_cols
+
+    votes_to_corr = votes_to_ci = None
+    corr = width = float("nan")
+    for vote in range(1, settings["max_votes"] + 1):
+        k = choose(sampler, rng)
+        i, j = (rows[k], cols[k]) if rng.random() < 0.5 else (cols[k], rows[k])
+        if rng.random() < settings["tie_rate"]:
+            outcome = OUTCOME_TIE
+        elif rng.random() < settings["noise_rate"]:
+            outcome = int(rng.random() < 0.5)  # 随手乱投的一票，与强度无关
+        else:
+            outcome = 0 if rng.random() < 1.0 / (1.0 + math.exp(theta[j] - theta[i])) else 1
+        sampler.stats.add(i, j, outcome)
+
+        if vote % settings["eval_every"]:
+            continue
+        battles, wins = sampler.stats.battles, sampler.stats.wins
+        ratings = fit_bradley_terry(wins, battles - wins - wins.T, prior=settings["prior"], tol=1e-7)
+        corr = kendall_tau(ratings, strengths)
+        width = float(ci_widths(ratings, battles, settings["prior"]).max())
+        if votes_to_corr is None and corr >= settings["target_corr"]:
+            votes_to_corr = vote
+        if votes_to_ci is None and width <= settings["target_ci"]:
+            votes_to_ci = vote
+        if votes_to_corr is not None and votes_to_ci is not None:
+            break
+    return {"strategy": strategy, "seed": seed, "votes_to_corr": votes_to_corr, "votes_to_ci": votes_to_ci,
+            "final_corr": corr, "final_ci": width}
+
+
+def _run_trial_task(task: tuple) -> dict:
+    return run_trial(*task)
+
+
+# ------------------------------------------------------------------------------
+# 汇总
+# ------------------------------------------------------------------------------
+
+def summarize(results: list, strategies: list) -> dict:
+    summary = {}
+    for strategy in strategies:
+        trials = [result for result in results if result["strategy"] == strategy]
+        entry = {"trials": len(trials)}
+        for field in ("votes_to_corr", "votes_to_ci"):
+            reached = np.array([result[field] for result in trials if result[field] is not None], dtype=np.float64)
+            entry[field] = {
+                "reached": len(reached) / len(trials) if trials else 0.0,
+                "median": float(np.median(reached)) if len(reached) else None,
+                "mean": float(reached.mean()) if len(reached) else None,
+                "p90": float(np.percentile(reached, 90)) if len(reached) else None,
+            }
+        summary[strategy] = entry
+    return summary
+
+
+def print_summary(summary: dict, settings: dict):
+    baseline = summary.get("uniform")
+    print(f"\n目标: Kendall τ ≥ {settings['target_corr']}，最大 95% 置信区间宽度 ≤ {settings['target_ci']} Elo"
+          f"（最多 {settings['max_votes']} 票，每 {settings['eval_every']} 票评估一次）")
+    print(f"{'策略':<10}{'试验':>6}{'τ达标率':>9}{'τ中位票数':>11}{'τ p90':>9}{'CI达标率':>10}{'CI中位票数':>12}{'CI p90':>9}{'τ票数相对均匀':>10}")
+    for strategy, entry in summary.items():
+        corr, ci = entry["votes_to_corr"], entry["votes_to_ci"]
+        relative = "-"
+        if baseline and strategy != "uniform" and corr["median"] and baseline["votes_to_corr"]["median"]:
+            relative = f"{corr['median'] / baseline['votes_to_corr']['median'] - 1:+.1%}"
+
+        def fmt(value):
+            return f"{value:.0f}" if value is not None else "-"
+
+        print(f"{strategy:<10}{entry['trials']:>6}{corr['reached']:>9.0%}{fmt(corr['median']):>11}{fmt(corr['p90']):>9}"
+              f"{ci['reached']:>10.0%}{fmt(ci['median']):>12}{fmt(ci['p90']):>9}{relative:>10}")
+
+
+def load_models(args) -> tuple:
+    """返回 (模型列表, 固定的真实强度或 None)。"""
+    if args.strengths:
+        with open(args.strengths, encoding="utf-8") as f:
+            ratings = json.load(f)  # {模型: Elo 评分}，例如从 /api/leaderboard 导出
+        model_list = sorted(ratings)
+        return model_list, np.array([float(ratings[model]) for model in model_list])
+    if args.n_models:
+        return [f"model-{i:03d}" for i in range(args.n_models)], None
+    from pregenerate import DEFAULT_MAIN_PATH, load_server
+    with contextlib.redirect_stdout(io.StringIO()):
+        server = load_server(args.main or DEFAULT_MAIN_PATH)
+    return sorted(server.MODEL_CONFIG), None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟比较各抽样策略使排名收敛所需的票数")
+    parser.add_argument("--main", default=None, help="服务端主程序路径（默认使用其中 MODEL_CONFIG 的模型）")
+    parser.add_argument("--n-models", type=int, default=None, help="改用指定数量的虚拟模型，不加载服务端")
+    parser.add_argument("--strengths", default=None, help="固定的真实强度 JSON（{模型: Elo}），不指定时每次试验随机抽取")
+    parser.add_argument("--spread", type=float, default=150.0, help="随机真实强度的标准差（Elo）")
+    parser.add_argument("--strategies", nargs="+", default=list(STRATEGIES), choices=list(STRATEGIES))
+    parser.add_argument("--trials", type=int, default=200, help="每个策略的试验次数")
+    parser.add_argument("--tie-rate", type=float, default=0.1, help="平局概率")
+    parser.add_argument("--noise-rate", type=float, default=0.05, help="随机投票（与强度无关）的概率")
+    parser.add_argument("--target-corr", type=float, default=0.9, help="目标 Kendall τ")
+    parser.add_argument("--target-ci", type=float, default=100.0, help="目标最大 95%% 置信区间宽度（Elo）")
+    parser.add_argument("--max-votes", type=int, default=20000)
+    parser.add_argument("--eval-every", type=int, default=100, help="每隔多少票拟合一次并检查是否达标")
+    parser.add_argument("--prior", type=float, default=1.0, help="Bradley–Terry 拟合的虚拟对手先验场数")
+    parser.add_argument("--processes", type=int, default=None, help="进程数（默认 CPU 核数）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="把逐次试验结果和汇总写入 JSON 文件")
+    args = parser.parse_args()
+
+    model_list, fixed_strengths = load_models(args)
+    settings = {"tie_rate": args.tie_rate, "noise_rate": args.noise_rate, "target_corr": args.target_corr,
+                "target_ci": args.target_ci, "max_votes": args.max_votes, "eval_every": args.eval_every,
+                "prior": args.prior}
+    # 同一试验序号下各策略使用相同的真实强度和随机种子，差异只来自策略本身
+    tasks = []
+    for trial in range(args.trials):
+        seed = args.seed * 1_000_003 + trial
+        strengths = fixed_strengths if fixed_strengths is not None else true_strengths(len(model_list), args.spread, seed)
+        for strategy in args.strategies:
+            tasks.append((strategy, model_list, strengths, settings, seed))
+
+    processes = args.processes or os.cpu_count()
+    print(f"🚀 [模拟] {len(model_list)} 个模型，{len(args.strategies)} 种策略 × {args.trials} 次试验，{processes} 个进程")
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        for result in pool.map(_run_trial_task, tasks, chunksize=max(1, len(tasks) // (processes * 8))):
+            results.append(result)
+            if len(results) % max(1, len(tasks) // 10) == 0:
+                print(f"⏳ [模拟] 已完成 {len(results)}/{len(tasks)} 次试验，用时 {time.perf_counter() - start:.1f} 秒")
+
+    summary = summarize(results, args.strategies)
+    print_summary(summary, settings)
+    print(f"\n✅ [模拟] 共 {len(results)} 次试验，用时 {time.perf_counter() - start:.1f} 秒")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"models": model_list, "settings": settings, "spread": args.spread,
+                       "summary": summary, "trials": results}, f, ensure_ascii=False, indent=2)
+        print(f"💾 [模拟] 结果已写入 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+# ==============================================================================
+# 文件: tiles.py
+# 描述: 超大手卷、册页的深度缩放（Deep Zoom / DZI）瓦片金字塔。每件作品的全部层级和瓦片打包成一个文件，
+#       文件头之后是 (偏移, 长度) 索引，服务端以内存映射方式按需读取单个瓦片；
+#       命令行可用多进程并行预先生成全部作品的瓦片包
+# 用法: python tiles.py [--images images/] [--tiles tiles/] [--tile-size 256] [--format jpeg]
+#                       [--min-side 2048] [--workers 8]
+# ==============================================================================
+
+import argparse
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+try:
+    from PIL import Image
+except ImportError:  # 未安装 Pillow 时只能读取已生成的瓦片包
+    Image = None
+
+MAGIC = b"ARTL"
+PACK_VERSION = 1
+FORMATS = {"jpeg": (0, "JPEG", "jpg", "image/jpeg"), "webp": (1, "WEBP", "webp", "image/webp")}
+FORMAT_BY_CODE = {code: name for name, (code, _, _, _) in FORMATS.items()}
+# 文件头: 魔数, 包格式版本, 瓦片边长, 重叠像素, 图片格式, 原图宽, 原图高, 原图修改时间(ns), 瓦片总数
+_HEADER = struct.Struct("<4sHHHB3xIIqI")
+_INDEX_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u4")])
+MAX_SOURCE_PIXELS = 2_000_000_000   # 书画扫描件可达数亿像素，超出 Pillow 默认的解压炸弹阈值
+DZI_NAMESPACE = "http://schemas.microsoft.com/deepzoom/2008"
+
+
+def level_dimensions(width: int, height: int) -> list:
+    """DZI 各层级的尺寸：第 0 层为 1×1 像素，最高层为原图尺寸，每层宽高减半（向上取整）。"""
+    max_level = math.ceil(math.log2(max(width, height, 1)))
+    return [(math.ceil(width / 2 ** (max_level - level)), math.ceil(height / 2 ** (max_level - level)))
+            for level in range(max_level + 1)]
+
+
+def level_grids(width: int, height: int, tile_size: int) -> list:
+    """各层级的瓦片列数和行数。"""
+    return [(math.ceil(w / tile_size), math.ceil(h / tile_size)) for w, h in level_dimensions(width, height)]
+
+
+def _tile_box(col: int, row: int, size: tuple, tile_size: int, overlap: int) -> tuple:
+    x0 = col * tile_size - (overlap if col > 0 else 0)
+    y0 = row * tile_size - (overlap if row > 0 else 0)
+    return x0, y0, min((col + 1) * tile_size + overlap, size[0]), min((row + 1) * tile_size + overlap, size[1])
+
+
+def build_pack(source_path: str, pack_path: str, tile_size: int = 256, overlap: int = 1,
+               fmt: str = "jpeg", quality: int = 85) -> dict:
+    """
+    生成一件作品的瓦片包。从原图开始逐层缩小一半，按层级、行、列的顺序编码瓦片并顺序写入；
+    写完后回填文件头之后的索引，最后原子替换旧文件。
+    """
+    Image.MAX_IMAGE_PIXELS = MAX_SOURCE_PIXELS
+    code, pil_format, _, _ = FORMATS[fmt]
+    start = time.perf_counter()
+    mtime_ns = os.stat(source_path).st_mtime_ns
+    with Image.open(source_path) as source:
+        image = source.convert("RGB")
+    width, height = image.size
+    dimensions = level_dimensions(width, height)
+    grids = level_grids(width, height, tile_size)
+    n_tiles = sum(cols * rows for cols, rows in grids)
+    level_starts = np.concatenate([[0], np.cumsum([cols * rows for cols, rows in grids])])
+    index = np.zeros(n_tiles, dtype=_INDEX_DTYPE)
+    options = {"quality": quality}
+    if pil_format == "WEBP":
+        options["method"] = 4
+
+    tmp_path = f"{pack_path}.{os.getpid()}.tmp"
+    data_start = _HEADER.size + index.nbytes
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * data_start)
+        offset = data_start
+        for level in range(len(dimensions) - 1, -1, -1):
+            if image.size != dimensions[level]:
+                image = image.resize(dimensions[level], Image.BOX)
+            cols, rows = grids[level]
+            for row in range(rows):
+                for col in range(cols):
+                    tile = image.crop(_tile_box(col, row, dimensions[level], tile_size, overlap))
+                    tile.save(f, format=pil_format, **options)
+                    position = f.tell()
+                    index[level_starts[level] + row * cols + col] = (offset, position - offset)
+                    offset = position
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, PACK_VERSION, tile_size, overlap, code, width, height, mtime_ns, n_tiles))
+        f.write(index.tobytes())
+    os.replace(tmp_path, pack_path)
+    return {"width": width, "height": height, "levels": len(dimensions), "tiles": n_tiles,
+            "bytes": offset, "seconds": time.perf_counter() - start}
+
+
+class TilePack:
+    """以内存映射方式打开的瓦片包；读取单个瓦片只访问索引中的一项和对应的字节区间。"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.tile_size, self.overlap, code, self.width, self.height,
+         self.source_mtime_ns, n_tiles) = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != PACK_VERSION:
+            raise ValueError(f"{path} 不是可识别的瓦片包")
+        self.format = FORMAT_BY_CODE[code]
+        self.grids = level_grids(self.width, self.height, self.tile_size)
+        self._level_starts = np.concatenate([[0], np.cumsum([cols * rows for cols, rows in self.grids])])
+        self._index = np.frombuffer(self._mmap, dtype=_INDEX_DTYPE, count=n_tiles, offset=_HEADER.size)
+
+    @property
+    def extension(self) -> str:
+        return FORMATS[self.format][2]
+
+    @property
+    def mime_type(self) -> str:
+        return FORMATS[self.format][3]
+
+    @property
+    def version(self) -> str:
+        return format(self.source_mtime_ns, "x")
+
+    def tile(self, level: int, col: int, row: int):
+        """返回瓦片的编码字节；层级或行列越界时返回 None。"""
+        if not 0 <= level < len(self.grids):
+            return None
+        cols, rows = self.grids[level]
+        if not (0 <= col < cols and 0 <= row < rows):
+            return None
+        offset, length = self._index[self._level_starts[level] + row * cols + col]
+        return self._mmap[int(offset):int(offset) + int(length)]
+
+    def descriptor(self) -> str:
+        """DZI 描述文件（OpenSeadragon 等查看器据此计算每个层级需要的瓦片）。"""
+        return (f'<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<Image xmlns="{DZI_NAMESPACE}" Format="{self.extension}" Overlap="{self.overlap}" '
+                f'TileSize="{self.tile_size}"><Size Width="{self.width}" Height="{self.height}"/></Image>')
+
+
+class TileStore:
+    """
+    按作品管理瓦片包。
+
+    - 打开的瓦片包按 LRU 保留最多 max_open 个；淘汰时只丢弃引用，正在读取的请求不受影响。
+    - 原图修改时间与包内记录不一致时视为过期；缺失或过期的包在后台进程中重建，期间调用方退回普通图片。
+    - 长边小于 min_side 的图片不生成瓦片（记住结论，原图更新前不再尝试）。
+    """
+
+    def __init__(self, image_directory: str, tile_directory: str, tile_size: int = 256, overlap: int = 1,
+                 fmt: str = "jpeg", quality: int = 85, min_side: int = 0, max_open: int = 256):
+        self.image_directory = image_directory
+        self.tile_directory = tile_directory
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.format = fmt
+        self.quality = quality
+        self.min_side = min_side
+        self.max_open = max_open
+        self._packs = OrderedDict()
+        self._building = set()
+        self._skipped = {}  # 作品 -> 判定为过小时的原图修改时间
+        self._pool = None
+        self._lock = threading.Lock()
+        self.counters = {"tiles_served": 0, "builds_started": 0, "builds_failed": 0}
+        os.makedirs(tile_directory, exist_ok=True)
+
+    def pack_path(self, key: str) -> str:
+        return os.path.join(self.tile_directory, f"{key}_{self.tile_size}_{self.format}.tiles")
+
+    def open(self, key: str, source_path: str):
+        """返回与原图当前版本一致的瓦片包，没有时返回 None。"""
+        try:
+            mtime_ns = os.stat(source_path).st_mtime_ns
+        except OSError:
+            return None
+        with self._lock:
+            pack = self._packs.get(key)
+            if pack is not None and pack.source_mtime_ns == mtime_ns:
+                self._packs.move_to_end(key)
+                return pack
+        try:
+            pack = TilePack(self.pack_path(key))
+        except (OSError, ValueError):
+            return None
+        if pack.source_mtime_ns != mtime_ns:
+            return None
+        with self._lock:
+            self._packs[key] = pack
+            while len(self._packs) > self.max_open:
+                self._packs.popitem(last=False)
+        return pack
+
+    def request_build(self, key: str, source_path: str) -> bool:
+        """在后台进程中生成瓦片包（同一作品同时只生成一次）；返回是否新发起了生成。"""
+        try:
+            mtime_ns = os.stat(source_path).st_mtime_ns
+        except OSError:
+            return False
+        if Image is None:
+            return False
+        with self._lock:
+            if key in self._building or self._skipped.get(key) == mtime_ns:
+                return False
+            self._building.add(key)
+            self.counters["builds_started"] += 1
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=1)
+        future = self._pool.submit(_build_one, source_path, self.pack_path(key), self.tile_size, self.overlap,
+                                   self.format, self.quality, self.min_side)
+        future.add_done_callback(lambda done: self._build_finished(key, mtime_ns, done))
+        return True
+
+    def _build_finished(self, key: str, mtime_ns: int, future):
+        error = future.exception()
+        result = future.result() if error is None else None
+        with self._lock:
+            self._building.discard(key)
+            self._packs.pop(key, None)
+            if error is not None:
+                self.counters["builds_failed"] += 1
+            elif result is None:
+                self._skipped[key] = mtime_ns
+        if error is not None:
+            print(f"❌ [瓦片] 作品 {key} 的瓦片生成失败: {error}")
+        elif result is not None:
+            print(f"🧩 [瓦片] 作品 {key} 的瓦片已生成: {result['tiles']} 块，{result['levels']} 层，"
+                  f"{result['bytes'] / 2**20:.1f} MB，耗时 {result['seconds']:.1f} 秒")
+
+    def record_served(self):
+        with self._lock:
+            self.counters["tiles_served"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters, open_packs=len(self._packs), building=len(self._building))
+
+
+def _build_one(source_path: str, pack_path: str, tile_size: int, overlap: int, fmt: str, quality: int, min_side: int):
+    """在子进程中生成瓦片包；图片长边小于 min_side 时不生成，返回 None。"""
+    Image.MAX_IMAGE_PIXELS = MAX_SOURCE_PIXELS
+    with Image.open(source_path) as img:
+        if max(img.size) < min_side:
+            return None
+    return build_pack(source_path, pack_path, tile_size, overlap, fmt, quality)
+
+
+def main():
+    data_dir = os.environ.get("ARENA_DATA_DIR", os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="为作品图片预先生成 Deep Zoom 瓦片包")
+    parser.add_argument("--images", default=os.path.join(data_dir, "images"), help="原图目录")
+    parser.add_argument("--tiles", default=os.path.join(data_dir, "tiles"), help="瓦片包目录")
+    parser.add_argument("--tile-size", type=int, default=256, choices=[256, 512])
+    parser.add_argument("--overlap", type=int, default=1)
+    parser.add_argument("--format", default="jpeg", choices=list(FORMATS))
+    parser.add_argument("--quality", type=int, default=85)
+    parser.add_argument("--min-side", type=int, default=0, help="只处理长边不小于该值的图片")
+    parser.add_argument("--workers", type=int, default=None, help="进程数（默认 CPU 核数）")
+    parser.add_argument("--force", action="store_true", help="忽略已有的最新瓦片包，全部重新生成")
+    args = parser.parse_args()
+
+    if Image is None:
+        print("❌ [瓦片] 未安装 Pillow，无法生成瓦片。")
+        return
+    store = TileStore(args.images, args.tiles, args.tile_size, args.overlap, args.format, args.quality)
+    jobs = []
+    for name in sorted(os.listdir(args.images)):
+        key, extension = os.path.splitext(name)
+        source_path = os.path.join(args.images, name)
+        if extension.lower() not in (".jpg", ".jpeg", ".png", ".tif", ".tiff") or not os.path.isfile(source_path):
+            continue
+        if not args.force and store.open(key, source_path) is not None:
+            continue
+        jobs.append((key, source_path))
+
+    print(f"🚀 [瓦片] 待生成 {len(jobs)} 件作品的瓦片包（{args.tile_size}px，{args.format}）")
+    start = time.perf_counter()
+    built = tiles = total_bytes = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(_build_one, source_path, store.pack_path(key), args.tile_size, args.overlap,
+                               args.format, args.quality, args.min_side): key for key, source_path in jobs}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"❌ [瓦片] 作品 {futures[future]} 生成失败: {e}")
+                continue
+            if result is not None:
+                built += 1
+                tiles += result["tiles"]
+                total_bytes += result["bytes"]
+            if done % 20 == 0:
+                print(f"⏳ [瓦片] 已处理 {done}/{len(jobs)} 件作品，用时 {time.perf_counter() - start:.0f} 秒")
+    print(f"✅ [瓦片] 生成 {built} 个瓦片包，共 {tiles} 块瓦片，{total_bytes / 2**20:.1f} MB，"
+          f"耗时 {time.perf_counter() - start:.1f} 秒。")
+
+
+if __name__ == '__main__':
+    main()